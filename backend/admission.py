@@ -0,0 +1,133 @@
+"""
+Admission control for the API: concurrency limits per endpoint class and cost limits for route searches.
+
+Endpoints are grouped into classes (cheap lookups, route searches, batches) with a limit of concurrent requests each.
+A request waits for a free slot for at most the queue timeout of its class and is rejected immediately if too many
+requests are already waiting, so that expensive searches cannot occupy all server threads and cheap lookups stay
+fast under load. Exhaustive route searches are additionally rejected before the search if their number of candidate
+routes (counted by the route planner, see route_planner.py) exceeds MAX_ESTIMATED_ROUTES.
+"""
+
+import os
+import threading
+from typing import Dict, Optional, Text
+
+# endpoint (flask view function name) -> endpoint class, endpoints without class are not limited
+ENDPOINT_CLASSES = {
+    "markers": "lookup",
+    "viewport": "lookup",
+    "search_huts": "lookup",
+    "submit": "lookup",
+    "register_watch": "lookup",
+    "watch": "lookup",
+    "multi_day_planning": "search",
+    "stay_windows": "search",
+    "reachability": "search",
+    "submit_batch": "batch",
+}
+# concurrent requests per class of the whole server, overridden with e.g. HUTFINDER_CONCURRENCY="search=1,batch=1"
+DEFAULT_CONCURRENCY = {"lookup": 16, "search": 2, "batch": 1}
+# seconds a request waits for a free slot before it is rejected
+QUEUE_TIMEOUT = {"lookup": 5.0, "search": 2.0, "batch": 2.0}
+# requests that may wait per slot, further requests are rejected immediately
+MAX_WAITING_PER_SLOT = 2
+# exhaustive route searches with more candidate routes are rejected (about 15 s of search on a dense graph)
+MAX_ESTIMATED_ROUTES = 1_000_000
+
+
+class AdmissionRejected(Exception):
+    """A request that was not admitted, with the HTTP status and message for the client."""
+
+    def __init__(self, message: Text, status: int = 503, retry_after: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_concurrency(spec: Text) -> Dict[Text, int]:
+    """Parse a concurrency specification ("search=2,batch=1") into limits per class."""
+    limits = dict(DEFAULT_CONCURRENCY)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        endpoint_class, limit = item.split("=")
+        limits[endpoint_class.strip()] = int(limit)
+    return limits
+
+
+class AdmissionController:
+    """Concurrency limits per endpoint class with bounded waiting."""
+
+    def __init__(
+        self, limits: Dict[Text, int] = None, queue_timeout: Dict[Text, float] = None, workers: int = None
+    ) -> None:
+        """
+        Initialize the controller.
+
+        The slots of a process are its share of the limits of the server: with several worker processes
+        (HUTFINDER_WORKERS, set by serve.py), each worker gets limit / workers slots per class, rounded up.
+
+        Args:
+            limits: maximum number of concurrent requests per endpoint class of the server
+            queue_timeout: maximum waiting time in seconds per endpoint class
+            workers: number of worker processes of the server (default: HUTFINDER_WORKERS or 1)
+        """
+        limits = limits or parse_concurrency(os.environ.get("HUTFINDER_CONCURRENCY", ""))
+        workers = workers or int(os.environ.get("HUTFINDER_WORKERS", "1"))
+        self.limits = {endpoint_class: max(1, -(-limit // workers)) for endpoint_class, limit in limits.items()}
+        self.queue_timeout = queue_timeout or QUEUE_TIMEOUT
+        self._slots = {
+            endpoint_class: threading.BoundedSemaphore(limit) for endpoint_class, limit in self.limits.items()
+        }
+        self._waiting = {endpoint_class: 0 for endpoint_class in self.limits}
+        self._lock = threading.Lock()
+
+    def acquire(self, endpoint_class: Text) -> None:
+        """
+        Wait for a slot of an endpoint class.
+
+        Raises:
+            AdmissionRejected: if too many requests are waiting or no slot became free within the queue timeout
+        """
+        slots = self._slots[endpoint_class]
+        if slots.acquire(blocking=False):
+            return
+        with self._lock:
+            if self._waiting[endpoint_class] >= MAX_WAITING_PER_SLOT * self.limits[endpoint_class]:
+                raise AdmissionRejected(
+                    f"The server is busy with other {endpoint_class} requests, please try again in a few seconds",
+                    retry_after=1,
+                )
+            self._waiting[endpoint_class] += 1
+        try:
+            admitted = slots.acquire(timeout=self.queue_timeout.get(endpoint_class, 1.0))
+        finally:
+            with self._lock:
+                self._waiting[endpoint_class] -= 1
+        if not admitted:
+            raise AdmissionRejected(
+                f"The server is busy with other {endpoint_class} requests, please try again in a few seconds",
+                retry_after=2,
+            )
+
+    def release(self, endpoint_class: Text) -> None:
+        """Release the slot of an endpoint class."""
+        self._slots[endpoint_class].release()
+
+
+def check_route_cost(estimated_routes: float, max_routes: float = None) -> None:
+    """
+    Reject a route search whose number of candidate routes is too large.
+
+    Args:
+        estimated_routes: number of candidate routes (see route_planner.RoutePlanner)
+        max_routes: maximum number of candidate routes (default: MAX_ESTIMATED_ROUTES)
+
+    Raises:
+        AdmissionRejected: with a hint how to narrow the search
+    """
+    if estimated_routes > (max_routes if max_routes is not None else MAX_ESTIMATED_ROUTES):
+        raise AdmissionRejected(
+            f"This search is too broad (about {estimated_routes:.0f} possible routes). Please reduce the search "
+            "radius or the number of days, or set a maximum distance between huts.",
+            status=422,
+        )
@@ -2,19 +2,56 @@
 
 import json
 import os
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Any, Dict, Text
+from typing import Any, Dict, Optional, Text
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import psycopg2
 import sqlalchemy
-from flask import Flask, jsonify, render_template, request, send_from_directory
+from flask import Flask, Response, jsonify, render_template, request, send_from_directory
 from flask_cors import CORS, cross_origin
 from sqlalchemy import create_engine
 
-from filtering import DATE_FORMAT_IN, DATE_FORMAT_OUT, filter_huts, generate_date_range, multi_day_route_finding
+from admission import ENDPOINT_CLASSES, AdmissionController, AdmissionRejected, check_route_cost
+from availability_snapshot import SNAPSHOT_DIR, SnapshotReader
+from filtering import (
+    DATE_FORMAT_IN,
+    DATE_FORMAT_OUT,
+    filter_huts,
+    filter_huts_batch,
+    find_stay_windows,
+    generate_date_range,
+)
+from hut_grid import HutGrid
+from metrics import METRICS, pool_stats
+from name_search import NameIndex
+from profiling import (
+    DEFAULT_PROFILE_DIR,
+    PROFILE_HEADER,
+    PROFILE_TOKEN,
+    PROFILED_ENDPOINTS,
+    ProfileStore,
+    SamplingProfiler,
+    is_authorized,
+)
+from route_planner import (
+    PLAN_AUTO,
+    PLAN_BEAM,
+    PLAN_EXHAUSTIVE,
+    PLAN_SAMPLED,
+    PLANS,
+    RouteGraph,
+    RoutePlanner,
+    choose_plan,
+)
+from route_precompute import PrecomputedRoutes
+from serialization import routes_to_json, table_to_dict
+from watches import WATCH_DB_PATH, WATCH_TOKEN_HEADER, WatchStore, public_watch
 
 app = Flask(__name__, static_folder="static")
 
@@ -25,11 +62,18 @@ CORS(app, origins=["*", "null"])  # allowing any origin as well as localhost (nu
 ONLINE_AVAIL_CHECK = False
 # db login for database
 DB_LOGIN_PATH = "db_login.json"
+# optional database url (e.g. sqlite:///availability.db) used instead of the postgres login, e.g. for load testing
+DB_URL = os.environ.get("HUTFINDER_DB_URL")
+# directory of the request profiles (profiling is enabled by HUTFINDER_PROFILE_TOKEN, see profiling.py)
+PROFILE_DIR = os.environ.get("HUTFINDER_PROFILE_DIR", DEFAULT_PROFILE_DIR)
+# maximum number of results of the hut search
+MAX_SEARCH_RESULTS = 50
 # debug mode: directly return rendered html table
 DEBUG = False
 
-with open(DB_LOGIN_PATH, "r") as infile:
-    db_credentials = json.load(infile)
+if DB_URL is None:
+    with open(DB_LOGIN_PATH, "r") as infile:
+        db_credentials = json.load(infile)
 
 
 def get_con():
@@ -38,7 +82,7 @@ def get_con():
 
 
 try:
-    engine = create_engine("postgresql+psycopg2://", creator=get_con)
+    engine = create_engine(DB_URL) if DB_URL is not None else create_engine("postgresql+psycopg2://", creator=get_con)
 except sqlalchemy.exc.OperationalError as err:
     raise RuntimeError("Database issue: No connection can be established! Check login and database server") from err
 
@@ -46,21 +90,155 @@ except sqlalchemy.exc.OperationalError as err:
 # load huts database
 huts = gpd.read_file(os.path.join("data", "huts_database.geojson"))
 id_to_hut_name = huts.set_index("id")["name"].to_dict()
+# routes of common multi-day queries, precomputed after every availability update (see route_precompute.py)
+precomputed_routes = PrecomputedRoutes()
+snapshot_reader = SnapshotReader(SNAPSHOT_DIR)
+# marker clusters of all zoom levels for the viewport endpoint
+hut_grid = HutGrid(huts)
+# accent-folded prefix and trigram index of the hut names, vereine and sections for the search endpoint
+name_index = NameIndex(huts)
+# store of the availability watches (HUTFINDER_WATCH_DB), opened on first use: importing the app creates no database
+# file, and the workers of serve.py open their own connection
+watch_store: Optional[WatchStore] = None
+watch_store_lock = threading.Lock()
+# concurrency limits per endpoint class (HUTFINDER_CONCURRENCY, see admission.py)
+admission = AdmissionController()
+profile_store = ProfileStore(PROFILE_DIR)
+
+
+def get_watch_store() -> WatchStore:
+    """Watch store of this process, opened on the first request that needs it."""
+    global watch_store
+    with watch_store_lock:
+        if watch_store is None:
+            watch_store = WatchStore(WATCH_DB_PATH)
+        return watch_store
 
 
 def get_availability_for_dates(dates: list, min_places: int = 1) -> pd.DataFrame:
     """Get table with number of available places for each hut on a given date."""
-    # create engine
-    engine = create_engine("postgresql+psycopg2://", creator=get_con)
-    # load availability
-    date_str = "date='" + "' OR date='".join(dates) + "'"
-    availability = pd.read_sql(
-        f"SELECT hut_id, date, places_avail FROM hut_availability WHERE places_avail>={min_places} AND ({date_str})",
-        engine,
-    )
+    # read from the memory-mapped snapshot of the last update, the database is only used if none was published, if
+    # it is outdated (e.g. publishing failed) or if a date lies outside of it (e.g. past dates)
+    snapshot = snapshot_reader.current()
+    if snapshot is not None and snapshot.is_fresh() and snapshot.covers(dates):
+        return snapshot.availability_for_dates(dates, min_places)
+
+    # filter on the partition key avail_date, so that only the partitions of the requested months are scanned
+    avail_dates = [datetime.strptime(date, DATE_FORMAT_OUT).date().isoformat() for date in dates]
+    query = sqlalchemy.text(
+        "SELECT hut_id, date, places_avail FROM hut_availability "
+        "WHERE places_avail >= :min_places AND avail_date IN :avail_dates"
+    ).bindparams(sqlalchemy.bindparam("avail_dates", expanding=True))
+    availability = pd.read_sql(query, engine, params={"min_places": min_places, "avail_dates": avail_dates})
     return availability
 
 
+@app.before_request
+def admit_request():
+    """Wait for a free slot of the endpoint class of the request (rejected if the server is busy)."""
+    endpoint_class = ENDPOINT_CLASSES.get(request.endpoint)
+    if endpoint_class is not None:
+        admission.acquire(endpoint_class)
+        request.admission_class = endpoint_class
+
+
+@app.before_request
+def start_profiling():
+    """Profile the request if it sends the admin token in the X-Profile-Token header."""
+    if (
+        PROFILE_TOKEN is not None
+        and request.endpoint in PROFILED_ENDPOINTS
+        and is_authorized(request.headers.get(PROFILE_HEADER))
+    ):
+        request.profiler = SamplingProfiler(threading.get_ident())
+        request.profiler.start()
+
+
+@app.after_request
+def store_profile(response: Response) -> Response:
+    """Store the profile of a profiled request with its parameters and return its id in the X-Profile-Id header."""
+    if hasattr(request, "profiler"):
+        request.profiler.stop()
+        request_info = {
+            "endpoint": request.endpoint,
+            "path": request.path,
+            "args": request.args.to_dict(),
+            "body": request.get_json(silent=True),
+            "status": response.status_code,
+        }
+        response.headers["X-Profile-Id"] = profile_store.save(request.profiler, request_info)
+    return response
+
+
+@app.teardown_request
+def release_admission(exception: Exception = None) -> None:
+    """Release the slot of the request (and stop the profiler of a failed request)."""
+    if hasattr(request, "admission_class"):
+        admission.release(request.admission_class)
+    if hasattr(request, "profiler"):
+        request.profiler.stop()
+
+
+@app.errorhandler(AdmissionRejected)
+def reject_request(rejection: AdmissionRejected) -> Response:
+    """Answer a rejected request with its status and a message for the user."""
+    response = jsonify({"status": "error", "message": rejection.message})
+    response.status_code = rejection.status
+    if rejection.retry_after is not None:
+        response.headers["Retry-After"] = str(rejection.retry_after)
+    return response
+
+
+@app.before_request
+def start_request_timing():
+    """Reset the per-request timing spans."""
+    if METRICS.enabled:
+        METRICS.start_request()
+        request.start_time = time.perf_counter()
+
+
+@app.after_request
+def record_request_timing(response: Response) -> Response:
+    """Record the request duration and add the Server-Timing header if enabled."""
+    if METRICS.enabled and hasattr(request, "start_time"):
+        METRICS.observe(
+            "request_seconds", time.perf_counter() - request.start_time, {"endpoint": str(request.endpoint)}
+        )
+        if METRICS.server_timing:
+            response.headers["Server-Timing"] = METRICS.server_timing_header()
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    """Publish timing and row count metrics in the Prometheus text format."""
+    if not METRICS.export:
+        return Response("metrics are disabled (set HUTFINDER_METRICS=1)\n", status=404, mimetype="text/plain")
+    return Response(METRICS.render(pool_stats(engine)), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/profiles")
+def profiles():
+    """List the stored request profiles (requires the admin token)."""
+    if not is_authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    return jsonify({"status": "success", "profiles": profile_store.list()})
+
+
+@app.route("/api/profiles/<profile_id>")
+def download_profile(profile_id: Text):
+    """Download a request profile in the speedscope format (requires the admin token)."""
+    path = profile_store.path(profile_id) if is_authorized(request.headers.get(PROFILE_HEADER)) else None
+    if path is None:
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    return send_from_directory(
+        os.path.abspath(profile_store.directory),
+        os.path.basename(path),
+        mimetype="application/json",
+        as_attachment=True,
+    )
+
+
 @app.route("/")
 def serve_index():
     """Serve index page."""
@@ -104,6 +282,67 @@ def convert_to_float(request: request, col_name: Text, default: float) -> float:
         return default
 
 
+@app.route("/api/viewport")
+def viewport():
+    """Publish the huts in the map viewport, clustered per grid cell up to a zoom level of hut_grid.MAX_CLUSTER_ZOOM."""
+    with METRICS.span("viewport_query"):
+        result = hut_grid.query(
+            south=convert_to_float(request, "south", -90),
+            west=convert_to_float(request, "west", -180),
+            north=convert_to_float(request, "north", 90),
+            east=convert_to_float(request, "east", 180),
+            zoom=int(convert_to_float(request, "zoom", 0)),
+        )
+    METRICS.observe_rows("viewport_markers", len(result["clusters"]) + len(result["markers"]))
+    return jsonify({"status": "success", **result})
+
+
+@app.route("/api/search")
+def search_huts():
+    """
+    Typeahead search of huts by name, verein or section (see name_search.py).
+
+    Optional filters: huts within minDistance and maxDistance (km) of latitude and longitude, between minAltitude and
+    maxAltitude, and with at least minPlaces available places on a date. The results then include the distance
+    and the available places.
+    """
+    query = request.args.get("q", "")
+    limit = min(int(convert_to_float(request, "limit", 10)), MAX_SEARCH_RESULTS)
+    filters = {
+        "min_distance": convert_to_float(request, "minDistance", 0),
+        "max_distance": convert_to_float(request, "maxDistance", np.inf),
+        "min_altitude": convert_to_float(request, "minAltitude", 0),
+        "max_altitude": convert_to_float(request, "maxAltitude", np.inf),
+    }
+    if "latitude" in request.args and "longitude" in request.args:
+        filters["start_lat"] = convert_to_float(request, "latitude", 0)
+        filters["start_lon"] = convert_to_float(request, "longitude", 0)
+
+    candidates, distances, places = None, None, None
+    if any(key in request.args for key in ["latitude", "minDistance", "maxDistance", "minAltitude", "maxAltitude"]):
+        with METRICS.span("filter"):
+            mask, distances = filter_huts_batch(huts, [filters])
+        candidates, distances = mask[0], distances[0]
+    if request.args.get("date"):
+        check_date = datetime.strptime(request.args["date"], DATE_FORMAT_IN).strftime(DATE_FORMAT_OUT)
+        with METRICS.span("db_fetch"):
+            availability = get_availability_for_dates([check_date], int(convert_to_float(request, "minPlaces", 1)))
+        places = dict(zip(availability["hut_id"], availability["places_avail"], strict=True))
+        available = name_index.mask(list(places))
+        candidates = available if candidates is None else candidates & available
+
+    with METRICS.span("name_search"):
+        results = name_index.search(query, limit, candidates)
+    for result in results:
+        position = name_index.positions[result["id"]]
+        if distances is not None and not np.isnan(distances[position]):
+            result["distance"] = round(float(distances[position]), 2)
+        if places is not None:
+            result["places_avail"] = int(places[result["id"]])
+    METRICS.observe_rows("search_results", len(results))
+    return jsonify({"status": "success", "huts": results})
+
+
 def availability_as_html(availability: pd.DataFrame, filtered_huts: pd.DataFrame) -> Any:
     """
     Return availability as HTML table (deprecated).
@@ -145,20 +384,29 @@ def availability_as_html(availability: pd.DataFrame, filtered_huts: pd.DataFrame
     return render_template("simple.html", tables=[result.to_html(classes="data")], titles=result.columns.values)
 
 
-def table_to_dict(table: pd.DataFrame) -> [Dict]:
-    """
-    Converts pandas dataframe to list of dicts.
+def parse_filter_attributes(data: Dict) -> Dict[Text, float]:
+    """Convert the filter inputs of a request (strings) to the arguments of filter_huts."""
+    return {
+        "start_lat": float(data["latitude"]),
+        "start_lon": float(data["longitude"]),
+        "min_distance": float(data["minDistance"]),
+        "max_distance": float(data["maxDistance"]),
+        "min_altitude": float(data["minAltitude"]),
+        "max_altitude": float(data["maxAltitude"]),
+    }
 
-    Args:
-        table: pandas dataframe
 
-    Returns:
-        List of dicts
-    """
-    if table.index.name is not None:
-        table.reset_index(inplace=True)
-    table.drop(["geometry"], axis=1, errors="ignore", inplace=True)
-    return [row.to_dict() for _, row in table.iterrows()]
+def booking_link(hut_id: int) -> Text:
+    """Link to the reservation page of a hut."""
+    return f"https://www.hut-reservation.org/reservation/book-hut/{hut_id}/wizard"
+
+
+def merge_availability(filtered_huts: pd.DataFrame, availability: pd.DataFrame) -> pd.DataFrame:
+    """Add the available places of a date to the filtered huts (-1 if unknown, other missing values as "-")."""
+    huts_filtered_and_available = filtered_huts.merge(availability, left_on="id", right_on="hut_id", how="left")
+    # fill nans
+    huts_filtered_and_available["places_avail"] = huts_filtered_and_available["places_avail"].fillna(-1)
+    return huts_filtered_and_available.fillna("-")
 
 
 @app.route("/api/submit", methods=["POST"])
@@ -167,25 +415,18 @@ def submit():
     data = request.json
 
     # Convert strings to floats and date string to datetime object
-    filter_attributes = {
-        "start_lat": float(data["latitude"]),
-        "start_lon": float(data["longitude"]),
-        "min_distance": float(data["minDistance"]),
-        "max_distance": float(data["maxDistance"]),
-        "min_altitude": float(data["minAltitude"]),
-        "max_altitude": float(data["maxAltitude"]),
-    }
+    filter_attributes = parse_filter_attributes(data)
 
     # get inputs for checking date availability (need to convert to datetime and back for correct format)
     check_date_str = data.get("date", None)
     # min_avail_spaces = int(data.get("minSpaces", 1))
 
     # filter huts by distance from start etc
-    filtered_huts = filter_huts(huts, **filter_attributes)
-    filtered_huts["link"] = filtered_huts["id"].apply(
-        lambda x: f"https://www.hut-reservation.org/reservation/book-hut/{x}/wizard"
-    )
-    filtered_huts["verein"] = filtered_huts["verein"].fillna("-")
+    with METRICS.span("filter"):
+        filtered_huts = filter_huts(huts, **filter_attributes)
+        filtered_huts["link"] = filtered_huts["id"].apply(booking_link)
+        filtered_huts["verein"] = filtered_huts["verein"].fillna("-")
+    METRICS.observe_rows("filtered_huts", len(filtered_huts))
 
     # filter by availability
     if check_date_str is not None:
@@ -194,7 +435,9 @@ def submit():
         check_date = check_date_datetime.strftime(DATE_FORMAT_OUT)
 
         # load availability (cannot preload it because it is updated daily)
-        availability = get_availability_for_dates([check_date])
+        with METRICS.span("db_fetch"):
+            availability = get_availability_for_dates([check_date])
+        METRICS.observe_rows("availability", len(availability))
 
         if DEBUG:
             return availability_as_html(availability, filtered_huts)
@@ -207,12 +450,11 @@ def submit():
         # availability = availability.groupby("id")["available_spaces"].sum().reset_index()
 
         # add places_avail column to filtered huts
-        huts_filtered_and_available = filtered_huts.merge(availability, left_on="id", right_on="hut_id", how="left")
-        # fill nans
-        huts_filtered_and_available["places_avail"] = huts_filtered_and_available["places_avail"].fillna(-1)
-        huts_filtered_and_available = huts_filtered_and_available.fillna("-")
+        with METRICS.span("merge"):
+            huts_filtered_and_available = merge_availability(filtered_huts, availability)
         # huts_filtered_and_available = filtered_huts[filtered_huts["id"].isin(available_huts["hut_id"])]
-        return jsonify({"status": "success", "markers": table_to_dict(huts_filtered_and_available)})
+        with METRICS.span("serialize"):
+            return jsonify({"status": "success", "markers": table_to_dict(huts_filtered_and_available)})
 
     # just return filtered huts without availability check
     else:
@@ -220,7 +462,54 @@ def submit():
             return render_template(
                 "simple.html", tables=[filtered_huts.to_html(classes="data")], titles=filtered_huts.columns.values
             )
-        return jsonify({"status": "success", "markers": table_to_dict(filtered_huts)})
+        with METRICS.span("serialize"):
+            return jsonify({"status": "success", "markers": table_to_dict(filtered_huts)})
+
+
+@app.route("/api/submit_batch", methods=["POST"])
+def submit_batch():
+    """
+    Handle a list of submit queries in one request.
+
+    The availability of the union of all dates is fetched once and the filters of all queries are evaluated together
+    on the hut arrays. The results are returned in the order of the queries, each in the format of /api/submit.
+    """
+    queries = request.json["queries"]
+    filter_attributes = [parse_filter_attributes(query) for query in queries]
+    check_dates = [
+        datetime.strptime(query["date"], DATE_FORMAT_IN).strftime(DATE_FORMAT_OUT)
+        if query.get("date") is not None
+        else None
+        for query in queries
+    ]
+
+    with METRICS.span("filter"):
+        mask, distances = filter_huts_batch(huts, filter_attributes)
+        links = huts["id"].apply(booking_link).to_numpy()
+        vereine = huts["verein"].fillna("-").to_numpy()
+
+    dates = sorted({check_date for check_date in check_dates if check_date is not None})
+    with METRICS.span("db_fetch"):
+        availability = get_availability_for_dates(dates) if len(dates) > 0 else None
+    if availability is not None:
+        METRICS.observe_rows("availability", len(availability))
+        availability_per_date = {date: availability[availability["date"] == date] for date in dates}
+
+    results = []
+    with METRICS.span("serialize"):
+        for i, check_date in enumerate(check_dates):
+            filtered_huts = huts[mask[i]].copy()
+            if np.isnan(distances[i]).all():
+                filtered_huts["distance"] = pd.NA
+            else:
+                filtered_huts["distance"] = distances[i, mask[i]].astype(int)
+            filtered_huts["link"] = links[mask[i]]
+            filtered_huts["verein"] = vereine[mask[i]]
+            if check_date is not None:
+                filtered_huts = merge_availability(filtered_huts, availability_per_date[check_date])
+            results.append({"status": "success", "markers": table_to_dict(filtered_huts)})
+    METRICS.observe_rows("batch_queries", len(queries))
+    return jsonify({"status": "success", "results": results})
 
 
 @app.route("/api/multi_day", methods=["POST"])
@@ -229,56 +518,239 @@ def multi_day_planning():
     data = request.json
 
     # Convert strings to floats and date string to datetime object
-    filter_attributes = {
-        "start_lat": float(data["latitude"]),
-        "start_lon": float(data["longitude"]),
-        "min_distance": float(data["minDistance"]),
-        "max_distance": float(data["maxDistance"]),
-        "min_altitude": float(data["minAltitude"]),
-        "max_altitude": float(data["maxAltitude"]),
-    }
+    filter_attributes = parse_filter_attributes(data)
     # construct list of dates
     date_list = generate_date_range(data["startDate"], data["endDate"])
     nr_days = len(date_list)
-    assert len(date_list) > 1, "There must be at least two dates for multi-day planning"
+    # flexible start: trips of nrDays days that start on any date between startDate and endDate
+    flexible_start = data.get("nrDays") is not None
+    if flexible_start:
+        nr_days = int(data["nrDays"])
+        last_date = datetime.strptime(data["endDate"], DATE_FORMAT_IN) + timedelta(days=nr_days - 1)
+        date_list = generate_date_range(data["startDate"], last_date.strftime(DATE_FORMAT_IN))
+    assert nr_days > 1, "There must be at least two dates for multi-day planning"
+
+    # optional fixed start and end hut (or round trip back to the start hut)
+    start_hut_id = int(data["startHutId"]) if data.get("startHutId") is not None else None
+    end_hut_id = int(data["endHutId"]) if data.get("endHutId") is not None else None
+    round_trip = bool(data.get("roundTrip", False)) and start_hut_id is not None
+    assert not flexible_start or (start_hut_id is None and end_hut_id is None), "Flexible start requires free huts"
+    min_places = int(data["minSpaces"])
+    max_dist_between_huts = float(data.get("maxHutDistance", -1)) * 1000  # convert to meters
+    # execution strategy of the search (see route_planner.py), chosen by the number of candidate routes by default
+    requested_plan = data.get("plan", PLAN_AUTO)
+    assert requested_plan in PLANS, f"The plan must be one of {PLANS}"
+
+    # filter huts by distance from start etc (the fixed start and end huts are always allowed)
+    with METRICS.span("filter"):
+        filtered_huts = filter_huts(huts, **filter_attributes)
+        fixed_hut_ids = [hut_id for hut_id in [start_hut_id, end_hut_id] if hut_id is not None]
+        filtered_huts = pd.concat(
+            [filtered_huts, huts[huts["id"].isin(fixed_hut_ids) & ~huts["id"].isin(filtered_huts["id"])]]
+        )
+        filtered_hut_ids = filtered_huts["id"]
+    METRICS.observe_rows("filtered_huts", len(filtered_huts))
+
+    # common queries (popular regions, weekend trips) are served from the routes precomputed after the last update
+    precomputed_key = None
+    if len(fixed_hut_ids) == 0 and not flexible_start:
+        precomputed_key = precomputed_routes.find(filtered_hut_ids, date_list)
+
+    if precomputed_key is not None:
+        with METRICS.span("precomputed_routes"):
+            trip_options = precomputed_routes.routes(
+                precomputed_key, filtered_hut_ids, id_to_hut_name, min_places, max_dist_between_huts
+            )
+        plan_info = {"plan": "precomputed"}
+    else:
+        # get availability for all dates
+        with METRICS.span("db_fetch"):
+            availability_from_database = get_availability_for_dates(date_list, min_places)
+        METRICS.observe_rows("availability", len(availability_from_database))
+        with METRICS.span("pivot"):
+            avail_per_date = availability_from_database.pivot(index="hut_id", columns="date", values="places_avail")
+            avail_per_date = avail_per_date[avail_per_date.index.isin(filtered_hut_ids)]
+
+        # count the candidate routes and choose exhaustive enumeration, top-K beam search or sampling (searches from or
+        # to a fixed hut only expand the routes of the fixed huts and are always exhaustive)
+        with METRICS.span("plan"):
+            planner = RoutePlanner(
+                date_list,
+                avail_per_date,
+                id_to_hut_name,
+                nr_days,
+                max_dist_between_huts=max_dist_between_huts,
+                flexible_start=flexible_start,
+                start_hut_id=start_hut_id,
+                end_hut_id=end_hut_id,
+                round_trip=round_trip,
+            )
+            plan = choose_plan(planner.estimated_routes, requested_plan if len(fixed_hut_ids) == 0 else PLAN_EXHAUSTIVE)
+            plan_info = planner.info(plan)
+        METRICS.observe_rows("estimated_routes", planner.estimated_routes)
+        # reject exhaustive searches that are too broad before running them
+        if plan == PLAN_EXHAUSTIVE:
+            check_route_cost(planner.estimated_routes)
+        with METRICS.span("route_search"):
+            trip_options = planner.run(plan)
+
+    # markers: the huts of all routes, or if only a part of the routes is returned (beam search or sample), the huts
+    # reachable on candidate routes in the route graph (without enumerating the routes). These are a superset of the
+    # huts of all routes, since routes that visit a hut twice are not excluded (see RouteGraph.route_huts)
+    with METRICS.span("markers"):
+        if plan_info["plan"] in (PLAN_BEAM, PLAN_SAMPLED):
+            marker_ids = planner.route_hut_ids()
+        else:
+            marker_ids = pd.unique(trip_options[[f"day{day}" for day in range(nr_days)]].to_numpy().ravel())
+    filtered_huts = filtered_huts[filtered_huts["id"].isin(marker_ids)]
 
-    # get availability for all dates
-    availability_from_database = get_availability_for_dates(date_list, int(data["minSpaces"]))
-    avail_per_date = availability_from_database.pivot(index="hut_id", columns="date", values="places_avail")
+    # convert to dicts
+    with METRICS.span("serialize"):
+        json_dicts = routes_to_json(trip_options, huts.set_index("id"), nr_days)
+        return jsonify(
+            {"status": "success", "routes": json_dicts, "markers": table_to_dict(filtered_huts), "plan": plan_info}
+        )
 
-    # filter huts by distance from start etc
-    filtered_huts = filter_huts(huts, **filter_attributes)
-    filtered_hut_ids = filtered_huts["id"]
-    avail_per_date = avail_per_date[avail_per_date.index.isin(filtered_hut_ids)]
 
-    # compute trip options
+@app.route("/api/reachability", methods=["POST"])
+def reachability():
+    """
+    Huts that can be reached on each day of a trip from startDate to endDate, given the availability.
+
+    The trip starts at any filtered hut (the filters of /api/multi_day) or at startHutId and, as in /api/multi_day,
+    only stays at filtered huts on the following days (the start hut is always allowed). The reachable huts are
+    propagated day by day as boolean vectors over the huts (see route_planner.RouteGraph.reachable), so the cost is
+    linear in the number of connections times days and independent of the number of routes.
+    """
+    data = request.json
+    filter_attributes = parse_filter_attributes(data)
+    date_list = generate_date_range(data["startDate"], data["endDate"])
+    start_hut_id = int(data["startHutId"]) if data.get("startHutId") is not None else None
+    min_places = int(data["minSpaces"])
     max_dist_between_huts = float(data.get("maxHutDistance", -1)) * 1000  # convert to meters
-    trip_options = multi_day_route_finding(
-        date_list, avail_per_date, id_to_hut_name, max_dist_between_huts=max_dist_between_huts
-    )
 
-    all_ids_in_trip_options = set()
-    for day in range(nr_days):
-        all_ids_in_trip_options.update(trip_options[f"day{day}"].unique())
-    filtered_huts = filtered_huts[filtered_huts["id"].isin(all_ids_in_trip_options)]
+    # the trip may start at the filtered huts (or the start hut) and continue to the filtered huts
+    with METRICS.span("filter"):
+        filtered_hut_ids = filter_huts(huts, **filter_attributes)["id"].to_numpy()
+        start_hut_ids = filtered_hut_ids if start_hut_id is None else [start_hut_id]
+        allowed_hut_ids = np.union1d(filtered_hut_ids, start_hut_ids)
+    with METRICS.span("db_fetch"):
+        availability_from_database = get_availability_for_dates(date_list, min_places)
+    METRICS.observe_rows("availability", len(availability_from_database))
+    with METRICS.span("reachability"):
+        avail_per_date = availability_from_database.pivot(index="hut_id", columns="date", values="places_avail")
+        avail_per_date = avail_per_date[avail_per_date.index.isin(allowed_hut_ids)]
+        graph = RouteGraph(date_list, avail_per_date, max_dist_between_huts=max_dist_between_huts)
+        frontiers = graph.reachable(0, len(date_list), start_huts=graph.mask(start_hut_ids))
+
+    days = [
+        {"date": date, "hutIds": [int(hut_id) for hut_id in graph.hut_ids[frontier]]}
+        for date, frontier in zip(date_list, frontiers, strict=True)
+    ]
+    # markers of all reachable huts with the first day on which they can be reached
+    reached = frontiers.any(axis=0)
+    first_day = pd.Series(frontiers.argmax(axis=0)[reached], index=graph.hut_ids[reached])
+    reachable_huts = huts[huts["id"].isin(first_day.index)].copy()
+    reachable_huts["first_day"] = reachable_huts["id"].map(first_day)
+    METRICS.observe_rows("reachable_huts", len(reachable_huts))
+    with METRICS.span("serialize"):
+        return jsonify({"status": "success", "days": days, "markers": table_to_dict(reachable_huts)})
+
+
+@app.route("/api/stay_windows", methods=["POST"])
+def stay_windows():
+    """Find all windows of consecutive nights with enough free places in the filtered huts over a date range."""
+    data = request.json
 
-    # convert to dicts
-    huts_with_id = huts.set_index("id")
-    json_dicts = []
-    for _, row in trip_options.iterrows():
-        # make list of coordinates
-        coordinates = [
-            [huts_with_id.loc[row[f"day{k}"], "latitude"], huts_with_id.loc[row[f"day{k}"], "longitude"]]
-            for k in range(nr_days)
-        ]
-        # combine names, places and distances
-        infos = " -> ".join(
-            [row[f"name_day{k}"] + " (" + str(int(row[f"places_day{k}"])) + " spots)" for k in range(nr_days)]
-        )
-        dist = ", ".join([str(round(row[f"distance_day{k}"] / 1000, 2)) + " km" for k in range(1, nr_days)])
-        json_dicts.append({"infos": infos, "coordinates": coordinates, "distance": dist})
+    filter_attributes = parse_filter_attributes(data)
+    date_list = generate_date_range(data["startDate"], data["endDate"])
+    nr_nights = int(data.get("nights", 1))
+    min_places = int(data.get("minSpaces", 1))
+    # optional list of weekdays (0 = Monday) on which the stay may start, e.g. [4, 5] for weekends
+    start_weekdays = data.get("startWeekdays", None)
+
+    with METRICS.span("filter"):
+        filtered_huts = filter_huts(huts, **filter_attributes)
+    METRICS.observe_rows("filtered_huts", len(filtered_huts))
+
+    with METRICS.span("db_fetch"):
+        availability = get_availability_for_dates(date_list, min_places)
+    METRICS.observe_rows("availability", len(availability))
+    with METRICS.span("pivot"):
+        avail_per_date = availability.pivot(index="hut_id", columns="date", values="places_avail")
+        avail_per_date = avail_per_date[avail_per_date.index.isin(filtered_huts["id"])]
+
+    with METRICS.span("window_search"):
+        windows = find_stay_windows(avail_per_date, date_list, nr_nights, min_places, start_weekdays)
+    METRICS.observe_rows("stay_windows", len(windows))
+
+    with METRICS.span("serialize"):
+        windows_per_hut = {
+            hut_id: hut_windows.drop("hut_id", axis=1).to_dict(orient="records")
+            for hut_id, hut_windows in windows.groupby("hut_id")
+        }
+        huts_with_windows = filtered_huts[filtered_huts["id"].isin(windows_per_hut.keys())].copy()
+        huts_with_windows["link"] = huts_with_windows["id"].apply(booking_link)
+        huts_with_windows["verein"] = huts_with_windows["verein"].fillna("-")
+        huts_with_windows = huts_with_windows.fillna("-")
+        markers = table_to_dict(huts_with_windows)
+        for marker in markers:
+            marker["windows"] = windows_per_hut[marker["id"]]
+        return jsonify({"status": "success", "markers": markers})
+
+
+@app.route("/api/watches", methods=["POST"])
+def register_watch():
+    """
+    Register a watch for a hut (hutId) or a region (latitude, longitude, maxDistance) on a date range.
 
-    return jsonify({"status": "success", "routes": json_dicts, "markers": table_to_dict(filtered_huts)})
+    The response contains the token of the watch, which has to be sent in the X-Watch-Token header to read or remove
+    the watch. The contact is not returned.
+    """
+    data = request.json
+    date_list = generate_date_range(data["startDate"], data["endDate"])
+    if data.get("hutId") is not None:
+        hut_ids, region = [int(data["hutId"])], None
+    else:
+        region = {
+            "latitude": float(data["latitude"]),
+            "longitude": float(data["longitude"]),
+            "maxDistance": float(data["maxDistance"]),
+        }
+        hut_ids = filter_huts(
+            huts, start_lat=region["latitude"], start_lon=region["longitude"], max_distance=region["maxDistance"]
+        )["id"]
+    try:
+        watch_id, token = get_watch_store().add(
+            str(data["contact"]), hut_ids, date_list, min_places=int(data.get("minSpaces", 1)), region=region
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    registered_watch = public_watch(get_watch_store().get(watch_id, token))
+    return jsonify({"status": "success", "watch": registered_watch, "token": token})
+
+
+@app.route("/api/watches/<int:watch_id>", methods=["GET", "DELETE"])
+def watch(watch_id: int):
+    """Get or remove a watch with its token (X-Watch-Token header), unknown watches and wrong tokens give 404."""
+    token = request.headers.get(WATCH_TOKEN_HEADER)
+    if request.method == "DELETE":
+        if not get_watch_store().remove(watch_id, token):
+            return jsonify({"status": "error", "message": "Watch not found"}), 404
+        return jsonify({"status": "success"})
+    registered_watch = get_watch_store().get(watch_id, token)
+    if registered_watch is None:
+        return jsonify({"status": "error", "message": "Watch not found"}), 404
+    return jsonify({"status": "success", "watch": public_watch(registered_watch)})
+
+
+def after_fork() -> None:
+    """Reset the connections of a worker process that was forked after loading the app (see serve.py)."""
+    global watch_store
+    # the pooled connections belong to the parent process and must not be used by the worker
+    engine.dispose(close=False)
+    # the worker opens its own watch store on first use
+    watch_store = None
 
 
 def create_app():
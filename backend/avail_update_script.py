@@ -1,6 +1,7 @@
 """Script to check the availability of huts and write to database."""
 
 import datetime
+import functools
 import json
 import logging
 import os
@@ -14,7 +15,20 @@ from slack import WebClient
 from slack.errors import SlackApiError
 from sqlalchemy import create_engine
 
+import availability_db
+import availability_snapshot
+import route_precompute
+import watches
 from check_availability import AvailabilityChecker
+from scrape_cache import DEFAULT_CACHE_PATH, ScrapeCache, month_key_from_offset
+from scrape_telemetry import (
+    DEFAULT_LOG_PATH,
+    FAILURE_DB,
+    FAILURE_NOT_IN_SYSTEM,
+    FAILURE_UNKNOWN,
+    ScrapeTelemetry,
+    classify_failure,
+)
 
 logging.basicConfig(
     stream=sys.stdout,
@@ -39,6 +53,13 @@ SKIP_NOT_IN_SYSTEM = True
 PATH_NOT_IN_SYSTEM = os.path.join("data", "not_in_system.json")
 DAYS_TO_PROCESS = 31 * 8
 SAVE_TO_CSV = False
+# JSONL run log with timings and failures per hut (see scrape_telemetry.py for the report)
+TELEMETRY_LOG_PATH = DEFAULT_LOG_PATH
+# cache of scraped months: months scraped within the freshness window are not scraped again (e.g. after a crash)
+SCRAPE_CACHE_PATH = DEFAULT_CACHE_PATH
+CACHE_FRESHNESS_SECONDS = 12 * 60 * 60
+# notifier of the availability watches: "slack" or "log" (local stand-in, appends to a JSONL file)
+WATCH_NOTIFIER = os.environ.get("HUTFINDER_NOTIFIER", "slack")
 CLIENT = WebClient(token=os.environ["SLACK_TOKEN"])
 
 # Set up database connection
@@ -54,41 +75,39 @@ def get_con():
 # create engine
 engine = create_engine("postgresql+psycopg2://", creator=get_con)
 
-# # Create table in database - only run once
-# CREATE TABLE hut_availability (
-#     hut_id INT NOT NULL,
-#     date TEXT NOT NULL,
-#     places_avail INT NOT NULL,
-#     last_updated TIMESTAMP DEFAULT NOW(),
-#     UNIQUE (hut_id, date)
-# );
+# the (partitioned) hut_availability table is created and maintained in availability_db.py
 
 
 # Insert/update function
-def update_hut_availability(hut_data: tuple) -> None:
+def update_hut_availability(hut_data: tuple) -> Exception:
     """
     Inserts or updates hut availability in the database.
 
-    hut_data is a list of tuples: [(hut_id, date, places_avail), ...]
-    """
-    query = """
-    INSERT INTO hut_availability (hut_id, date, places_avail, last_updated)
-    VALUES %s
-    ON CONFLICT (hut_id, date)
-    DO UPDATE SET
-        places_avail = EXCLUDED.places_avail,
-        last_updated = CURRENT_DATE;
+    hut_data is a list of tuples: [(hut_id, date, places_avail, last_updated), ...]
+    Every row is also appended to the history table (only changed places are passed, see scrape_cache.py).
+
+    Returns the database error, or None if the update was successful.
     """
+    rows = [
+        (hut_id, date, availability_db.to_avail_date(date), places_avail, last_updated)
+        for hut_id, date, places_avail, last_updated in hut_data
+    ]
+    history_rows = [
+        (hut_id, avail_date, places_avail, last_updated) for hut_id, _, avail_date, places_avail, last_updated in rows
+    ]
     try:
         conn = psycopg2.connect(**db_credentials)
         cur = conn.cursor()
-        execute_values(cur, query, hut_data)
+        execute_values(cur, availability_db.UPSERT_QUERY, rows)
+        execute_values(cur, availability_db.HISTORY_INSERT_QUERY, history_rows)
         conn.commit()
         cur.close()
         conn.close()
         logger.info(f"Updated {len(hut_data)} records.")
     except Exception as e:
         logger.error(f"Database error: {e}")
+        return e
+    return None
 
 
 def post_to_slack(message: str) -> None:
@@ -102,7 +121,9 @@ def post_to_slack(message: str) -> None:
 
 
 # create driver for scraping
-checker = AvailabilityChecker()
+scrape_cache = ScrapeCache(SCRAPE_CACHE_PATH)
+telemetry = ScrapeTelemetry(TELEMETRY_LOG_PATH)
+checker = AvailabilityChecker(telemetry=telemetry)
 
 # set start and end date
 today = datetime.datetime.today()
@@ -112,6 +133,11 @@ end_date = today + datetime.timedelta(days=DAYS_TO_PROCESS)
 
 tic_start = time.time()
 
+# create partitions for the upcoming months and drop (or archive) the partitions of past months
+maintenance_conn = get_con()
+availability_db.maintain(maintenance_conn, today_date)
+maintenance_conn.close()
+
 if os.path.exists(PATH_NOT_IN_SYSTEM):
     with open(PATH_NOT_IN_SYSTEM, "r") as infile:
         huts_not_in_system = json.load(infile)
@@ -120,6 +146,8 @@ else:
 
 # result lists
 all_avail = []
+# changed cells (hut_id, date, previous places, new places) for matching the availability watches
+changed_cells = []
 total_errors, successful_updates = 0, 0
 
 post_to_slack("Starting availability check...")
@@ -134,16 +162,35 @@ for hut_id in range(1, 673):
         logger.info(f"Not in system - skip hut {hut_id}")
         continue
 
+    # skip months that were scraped recently (e.g. before the previous run crashed)
+    num_months = DAYS_TO_PROCESS // 31
+    fresh_months = scrape_cache.fresh_months(hut_id, CACHE_FRESHNESS_SECONDS)
+    skip_months = {m for m in range(num_months) if month_key_from_offset(today_date, m) in fresh_months}
+
     # call availability checker
+    telemetry.start_hut(hut_id)
+    telemetry.count("cached_months", len(skip_months))
     try:
-        # result_for_hut, status = checker(hut_id, start_date, end_date)
-        result_for_hut, status = checker.retrieve_from_calendar(hut_id, num_months=DAYS_TO_PROCESS // 31)
+        if len(skip_months) < num_months:
+            # result_for_hut, status = checker(hut_id, start_date, end_date)
+            result_for_hut, status = checker.retrieve_from_calendar(
+                hut_id,
+                num_months=num_months,
+                skip_months=skip_months,
+                on_month=functools.partial(scrape_cache.store_scraped, hut_id),
+            )
+        else:
+            logger.info(f"All months of hut {hut_id} are cached")
+            result_for_hut, status = {}, "Success"
     except Exception as e:
+        # the driver is restarted because of this hut, so the restart is counted in its record
+        telemetry.count("driver_restarts")
+        telemetry.finish_hut("failed", classify_failure(e))
         checker.quit()
         del checker
         logger.error(f"Uncaught error! {e}")
         time.sleep(10)  # sleep 10 seconds to recover
-        checker = AvailabilityChecker()  # reinitialize checker
+        checker = AvailabilityChecker(telemetry=telemetry)  # reinitialize checker
         logger.info("Reinstated checker, continuing...")
         total_errors += 1
         if total_errors > 5:
@@ -153,20 +200,33 @@ for hut_id in range(1, 673):
 
     # check if an error was returned
     if status == "Error: Not in system!":
+        telemetry.finish_hut("failed", FAILURE_NOT_IN_SYSTEM)
         huts_not_in_system.append(hut_id)
         continue
     elif status != "Success":
+        telemetry.finish_hut("failed", FAILURE_UNKNOWN)
         logger.error(f"{hut_id} failed with error {status}")
         continue
 
-    # update the database
+    # update the database with the dates whose places changed since the last write
+    pending_diff = scrape_cache.pending_diff(hut_id)
     result_for_hut_tuple = [
         (hut_id, date, int(places_avail), today_date)
-        for date, places_avail in result_for_hut.items()
+        for date, (_, places_avail) in pending_diff.items()
         if isinstance(places_avail, int) or places_avail.isdigit()
     ]
-    update_hut_availability(result_for_hut_tuple)
-    successful_updates += 1
+    db_error = update_hut_availability(result_for_hut_tuple) if len(result_for_hut_tuple) > 0 else None
+    if db_error is not None:
+        telemetry.finish_hut("failed", FAILURE_DB)
+    else:
+        scrape_cache.mark_written(hut_id, {date: places_avail for date, (_, places_avail) in pending_diff.items()})
+        changed_cells.extend(
+            (hut_id, date, watches.to_places(previous_places), watches.to_places(places_avail))
+            for date, (previous_places, places_avail) in pending_diff.items()
+            if watches.to_places(places_avail) is not None
+        )
+        telemetry.finish_hut("success", nr_records=len(result_for_hut_tuple))
+        successful_updates += 1
 
     if hut_id % 10 == 0:
         # Save the huts that are not in system
@@ -184,14 +244,43 @@ for hut_id in range(1, 673):
 
     logger.info(f"Time for hut {hut_id}: {time.time() - tic}")
 
+# publish the new availability as snapshot for the API (read without database access)
+try:
+    snapshot_path = availability_snapshot.publish_from_database(engine, today_date, availability_snapshot.SNAPSHOT_DIR)
+    logger.info(f"Published availability snapshot {snapshot_path}")
+except Exception as e:
+    logger.error(f"Publishing the availability snapshot failed: {e}")
+    # the API reads from the database instead of the snapshot of the previous run
+    availability_snapshot.withdraw_snapshot(availability_snapshot.SNAPSHOT_DIR)
+
+# precompute the routes of common multi-day queries on the new availability (served by /api/multi_day)
+try:
+    manifest = route_precompute.refresh(engine, today_date)
+    logger.info(f"Precomputed {sum(manifest['entries'].values())} routes in {len(manifest['entries'])} entries")
+except Exception as e:
+    logger.error(f"Precomputation of routes failed: {e}")
+
+# notify the users whose watched huts and dates became available
+try:
+    watch_notifier = watches.SlackNotifier(CLIENT) if WATCH_NOTIFIER == "slack" else watches.LogNotifier()
+    watch_store = watches.WatchStore(watches.WATCH_DB_PATH)
+    watch_matches = watches.notify_changes(changed_cells, watch_store, watch_notifier, today_date)
+    watch_store.close()
+    logger.info(f"Matched {len(changed_cells)} changed cells to {len(watch_matches)} watches")
+except Exception as e:
+    logger.error(f"Notifying the availability watches failed: {e}")
+
 logger.info(f"Total runtime {time.time() - tic_start}")
+telemetry.finish_run(time.time() - tic_start)
 # quit checker
 checker.quit()
+scrape_cache.close()
 
 post_to_slack(
     f"Finished availability check! Total runtime: {time.time() - tic_start:.2f} seconds.\
     \n{len(huts_not_in_system)} huts not in system.\
     \nTotal errors: {total_errors}.\
+    \nFailures by type: {telemetry.failure_summary()}.\
     \nTotal huts checked: {successful_updates}."
 )
 
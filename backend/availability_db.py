@@ -0,0 +1,213 @@
+"""
+Storage layout of the hut_availability table: partitioned by month, with retention and an append-only history.
+
+The table is range-partitioned on avail_date (one partition per month), so queries for a few dates only scan the
+partitions of these dates and past months can be dropped as a whole. Every change of places is additionally appended
+to the compact hut_availability_history table for trend analysis. Run from the backend folder:
+
+    python availability_db.py migrate   # convert an existing unpartitioned table (run once)
+    python availability_db.py maintain  # create upcoming partitions and apply the retention policy
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import sys
+from typing import List, Text
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+DB_LOGIN_PATH = "db_login.json"
+TABLE = "hut_availability"
+HISTORY_TABLE = "hut_availability_history"
+ARCHIVE_SCHEMA = "availability_archive"
+# number of months (including the current one) for which partitions are created in advance
+MONTHS_AHEAD = 10
+# what to do with partitions of past months: "drop" or "archive" (detach and move to ARCHIVE_SCHEMA)
+RETENTION_ACTION = "drop"
+DATE_FORMAT_DB = "%d.%m.%Y"
+
+CREATE_TABLE_QUERY = f"""
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    hut_id INT NOT NULL,
+    date TEXT NOT NULL,
+    avail_date DATE NOT NULL,
+    places_avail INT NOT NULL,
+    last_updated TIMESTAMP DEFAULT NOW(),
+    UNIQUE (hut_id, avail_date)
+) PARTITION BY RANGE (avail_date);
+"""
+
+CREATE_HISTORY_QUERY = f"""
+CREATE TABLE IF NOT EXISTS {HISTORY_TABLE} (
+    hut_id SMALLINT NOT NULL,
+    avail_date DATE NOT NULL,
+    places_avail SMALLINT NOT NULL,
+    snapshot_date DATE NOT NULL DEFAULT CURRENT_DATE
+);
+CREATE INDEX IF NOT EXISTS {HISTORY_TABLE}_hut_date ON {HISTORY_TABLE} (hut_id, avail_date);
+"""
+
+# rows: (hut_id, date, avail_date, places_avail, last_updated)
+UPSERT_QUERY = f"""
+INSERT INTO {TABLE} (hut_id, date, avail_date, places_avail, last_updated)
+VALUES %s
+ON CONFLICT (hut_id, avail_date)
+DO UPDATE SET
+    places_avail = EXCLUDED.places_avail,
+    last_updated = CURRENT_DATE;
+"""
+
+# rows: (hut_id, avail_date, places_avail, snapshot_date)
+HISTORY_INSERT_QUERY = f"INSERT INTO {HISTORY_TABLE} (hut_id, avail_date, places_avail, snapshot_date) VALUES %s"
+
+
+def to_avail_date(date: Text) -> datetime.date:
+    """Convert a date string of the date column (dd.mm.yyyy) to a date."""
+    return datetime.datetime.strptime(date, DATE_FORMAT_DB).date()
+
+
+def month_start(date: datetime.date, offset: int = 0) -> datetime.date:
+    """First day of the month that is `offset` months after the month of date."""
+    month_index = date.year * 12 + date.month - 1 + offset
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(first_day: datetime.date) -> Text:
+    """Name of the partition of a month."""
+    return f"{TABLE}_y{first_day.year}m{first_day.month:02d}"
+
+
+def create_schema(conn: psycopg2.extensions.connection) -> None:
+    """Create the partitioned availability table and the history table if they do not exist."""
+    with conn.cursor() as cur:
+        cur.execute(CREATE_TABLE_QUERY)
+        cur.execute(CREATE_HISTORY_QUERY)
+    conn.commit()
+
+
+def ensure_partitions(conn: psycopg2.extensions.connection, today: datetime.date, months_ahead: int) -> List[Text]:
+    """
+    Create the monthly partitions from the current month up to `months_ahead` months.
+
+    Returns:
+        names of all partitions in the range
+    """
+    names = []
+    with conn.cursor() as cur:
+        for offset in range(months_ahead):
+            first_day, next_first_day = month_start(today, offset), month_start(today, offset + 1)
+            names.append(partition_name(first_day))
+            cur.execute(
+                f"CREATE TABLE IF NOT EXISTS {names[-1]} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM ('{first_day.isoformat()}') TO ('{next_first_day.isoformat()}')"
+            )
+    conn.commit()
+    return names
+
+
+def list_partitions(conn: psycopg2.extensions.connection) -> List[Text]:
+    """Names of all partitions attached to the availability table."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = %s ORDER BY child.relname",
+            (TABLE,),
+        )
+        return [name for (name,) in cur.fetchall()]
+
+
+def apply_retention(
+    conn: psycopg2.extensions.connection, today: datetime.date, action: Text = RETENTION_ACTION
+) -> List[Text]:
+    """
+    Drop or archive the partitions of all months before the current month.
+
+    Args:
+        conn: database connection
+        today: current date
+        action: "drop" or "archive" (detach and move to ARCHIVE_SCHEMA)
+
+    Returns:
+        names of the removed partitions
+    """
+    current_partition = partition_name(month_start(today))
+    # partition names sort chronologically (yYYYYmMM)
+    old_partitions = [name for name in list_partitions(conn) if name < current_partition]
+    with conn.cursor() as cur:
+        if action == "archive":
+            cur.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+        for name in old_partitions:
+            cur.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+            if action == "archive":
+                cur.execute(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}")
+            else:
+                cur.execute(f"DROP TABLE {name}")
+            logger.info(f"Retention: {action} partition {name}")
+    conn.commit()
+    return old_partitions
+
+
+def maintain(conn: psycopg2.extensions.connection, today: datetime.date = None) -> None:
+    """Create the tables and upcoming partitions and apply the retention policy (run before every update)."""
+    today = today or datetime.date.today()
+    create_schema(conn)
+    ensure_partitions(conn, today, MONTHS_AHEAD)
+    apply_retention(conn, today)
+
+
+def migrate(conn: psycopg2.extensions.connection, today: datetime.date = None) -> None:
+    """
+    Convert an unpartitioned hut_availability table (hut_id, date, places_avail, last_updated) to the new layout.
+
+    The old table is renamed to hut_availability_legacy, current and future rows are copied into the partitions and
+    all rows are copied to the history table.
+    """
+    today = today or datetime.date.today()
+    legacy_table = f"{TABLE}_legacy"
+    with conn.cursor() as cur:
+        cur.execute(f"ALTER TABLE {TABLE} RENAME TO {legacy_table}")
+    conn.commit()
+    create_schema(conn)
+    # create partitions for all future months that contain data
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT MAX(to_date(date, 'DD.MM.YYYY')) FROM {legacy_table}")
+        (max_date,) = cur.fetchone()
+    months_ahead = MONTHS_AHEAD
+    if max_date is not None:
+        months_ahead = max(months_ahead, (max_date.year - today.year) * 12 + max_date.month - today.month + 1)
+    ensure_partitions(conn, today, months_ahead)
+    with conn.cursor() as cur:
+        cur.execute(
+            f"INSERT INTO {TABLE} (hut_id, date, avail_date, places_avail, last_updated) "
+            f"SELECT hut_id, date, to_date(date, 'DD.MM.YYYY'), places_avail, last_updated FROM {legacy_table} "
+            "WHERE to_date(date, 'DD.MM.YYYY') >= %s",
+            (month_start(today),),
+        )
+        cur.execute(
+            f"INSERT INTO {HISTORY_TABLE} (hut_id, avail_date, places_avail, snapshot_date) "
+            f"SELECT hut_id, to_date(date, 'DD.MM.YYYY'), places_avail, COALESCE(last_updated::date, CURRENT_DATE) "
+            f"FROM {legacy_table}"
+        )
+    conn.commit()
+    logger.info(f"Migrated {legacy_table} to the partitioned table {TABLE}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Maintain the partitioned hut_availability table")
+    parser.add_argument("command", choices=["migrate", "maintain"])
+    args = parser.parse_args()
+
+    with open(DB_LOGIN_PATH, "r") as infile:
+        db_credentials = json.load(infile)
+    connection = psycopg2.connect(**db_credentials)
+    if args.command == "migrate":
+        migrate(connection)
+    maintain(connection)
+    connection.close()
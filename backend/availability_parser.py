@@ -0,0 +1,126 @@
+"""
+Parsing of the pages of the reservation website, separated from the browser that loads them.
+
+The AvailabilityChecker only acquires the HTML of the availability table, of the calendar and of the preamble from the
+browser; all parsing is done here with lxml on plain strings. So the parsers can be benchmarked and tested against
+the pages in fixtures/scraper (see benchmark.py and tests/test_availability_parser.py) without Chrome or network
+access.
+"""
+
+import datetime
+from typing import Dict, Optional, Text, Union
+
+from lxml import etree, html
+
+# XPath condition of an element with a css class (the class attribute may contain several classes)
+_HAS_CLASS = "contains(concat(' ', normalize-space(@class), ' '), ' {} ')"
+# the XPath expressions are compiled once at import
+_TABLE_ROWS = etree.XPath(f"//mat-row[{_HAS_CLASS.format('mat-mdc-row')}]")
+_ROW_DATE = etree.XPath(f".//td[{_HAS_CLASS.format('table_row_date')}]")
+_ROW_PLACES = etree.XPath(f".//td[{_HAS_CLASS.format('table_row_places')}]")
+_CALENDAR_CELLS = etree.XPath(f"//*[{_HAS_CLASS.format('mat-calendar-body-cell-content')}]")
+_FIRST_DAY_BUTTON = etree.XPath("//button[contains(@class, 'custom-date')]")
+_CELL_PREVIEW = etree.XPath("./following-sibling::div[contains(@class, 'custom-preview')]")
+_WELCOME_MESSAGES = etree.XPath(f"//app-check-availability-step//*[{_HAS_CLASS.format('welcomeMessage')}]")
+# years that are searched in the messages about the serviced and unserviced season
+SEASON_MESSAGE_YEARS = range(2025, 2030)
+
+
+def _text(element: html.HtmlElement) -> Text:
+    # same as BeautifulSoup's get_text(strip=True): stripped text pieces of all descendants, joined without separator
+    return "".join(piece.strip() for piece in element.itertext())
+
+
+def _parse(fragment: Text) -> html.HtmlElement:
+    return html.fragment_fromstring(fragment, create_parent="div")
+
+
+def parse_availability_table(table_html: Text) -> Dict[Text, Text]:
+    """
+    Available places per date of the availability table (the outer HTML of the table of the booking wizard).
+
+    Args:
+        table_html: HTML of the table with aria-label "Date Availability Table"
+
+    Returns:
+        places by date as shown in the table (warning markers "!" removed)
+    """
+    avail_on_date = {}
+    for row in _TABLE_ROWS(_parse(table_html)):
+        date_cells = _ROW_DATE(row)
+        places_cells = _ROW_PLACES(row)
+        if date_cells and places_cells:
+            avail_on_date[_text(date_cells[0])] = _text(places_cells[0]).replace("!", "")
+    return avail_on_date
+
+
+def parse_calendar_month(calendar_html: Text) -> Dict[Text, Union[Text, int]]:
+    """
+    Available places per date of the month that is shown in the calendar.
+
+    The date of the first day is taken from the class of the first day button ("custom-date dd.mm.yyyy"), the dates
+    of the other days from their day number. Days without a preview of the places get -1.
+
+    Args:
+        calendar_html: HTML of the opened calendar (mat-calendar)
+
+    Returns:
+        places (text) by date (dd.mm.yyyy), -1 if unknown
+    """
+    root = _parse(calendar_html)
+    avail_in_month = {}
+    date_text = ""
+    for i, cell in enumerate(_CALENDAR_CELLS(root)):
+        date_number_text = cell.text_content().strip()
+        if i == 0:
+            first_day_button = _FIRST_DAY_BUTTON(root)[0]
+            date_text = first_day_button.get("class").split("custom-date ")[-1]
+        else:
+            date_text = date_number_text.zfill(2) + date_text[2:]
+        previews = _CELL_PREVIEW(cell)
+        avail_in_month[date_text] = previews[0].text_content().strip() if previews else -1
+    return avail_in_month
+
+
+def parse_preamble(page_html: Text) -> Text:
+    """Text of the welcome messages of the availability step (empty if there are none), whitespace normalized."""
+    messages = _WELCOME_MESSAGES(html.document_fromstring(page_html))
+    return " ".join(" ".join(message.text_content().split()) for message in messages)
+
+
+def convert_message_to_date(message: Text) -> Optional[datetime.datetime]:
+    """
+    Find the date in a preamble or error message, e.g. the start of the season or the end of a closure.
+
+    Args:
+        message: text of the message
+
+    Returns:
+        the date of the message, None if the message has no known format
+    """
+    try:
+        if "Sommersaisonstart" in message:
+            hut_open_date = message.split("Sommersaisonstart")[-1]
+            dd, mm, yy = hut_open_date.split(".")
+            return datetime.datetime(int(yy), int(mm), int(dd))
+        elif "geschlossen" in message:
+            error_parts = message.split(" ")
+            dd, mm, yy = error_parts[-2].split(".")
+            return datetime.datetime(int(yy), int(mm), int(dd))
+        elif "closed until" in message or "fino al" in message:
+            error_parts = message[:-1].split(" ")  # delete dot and divide
+            dd, mm, yy = error_parts[-1].split(".")
+            return datetime.datetime(int(yy), int(mm), int(dd))
+        elif ("bewarteten" in message and "unbewarteten" in message) or (
+            "unserviced" in message and "serviced" in message
+        ):
+            # iterate over all years to make it work also for the next years
+            for yy in SEASON_MESSAGE_YEARS:
+                str_yy = f".{yy}"
+                if str_yy in message:
+                    date_part = (message.split(str_yy)[0]).split(" ")[-1]
+                    dd, mm = date_part.split(".")
+                    return datetime.datetime(int(yy), int(mm), int(dd))
+    except ValueError:
+        pass
+    return None
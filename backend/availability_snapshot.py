@@ -0,0 +1,194 @@
+"""
+Immutable, versioned snapshots of the availability table for a read path without database access.
+
+The updater publishes a snapshot at the end of every run. A snapshot is a single file with a JSON header (hut ids,
+first date, number of days) followed by a raw int16 matrix of free places (huts x days, -1 if unknown). A new
+version is written to a temporary file and renamed into place, then the LATEST pointer file is replaced, also by
+rename. Readers memory-map the file that LATEST points to and switch to a new version on their next read, so
+several workers share one copy in the page cache and no reader ever sees a partially written snapshot. Requests
+for dates outside of the snapshot and requests while the snapshot is older than MAX_SNAPSHOT_AGE are answered from
+the database.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Text
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+DEFAULT_SNAPSHOT_DIR = os.path.join("data", "snapshots")
+# directory that the updater publishes to and the app reads from
+SNAPSHOT_DIR = os.environ.get("HUTFINDER_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+LATEST_FILE = "LATEST"
+MAGIC = b"HUTSNAP1"
+# the matrix starts at a multiple of this offset
+HEADER_ALIGNMENT = 64
+# number of old versions that are kept (readers may still map them)
+KEEP_VERSIONS = 3
+DATE_FORMAT_DB = "%d.%m.%Y"
+VERSION_FORMAT = "%Y%m%d%H%M%S%f"
+# snapshots older than this are not used (the availability is updated daily, so a failed publish or update is not
+# served for more than a day)
+MAX_SNAPSHOT_AGE = datetime.timedelta(hours=26)
+
+
+def _write_snapshot(path: Text, header: Dict, places: np.ndarray) -> None:
+    header_bytes = json.dumps(header).encode("utf-8")
+    offset = len(MAGIC) + 8 + len(header_bytes)
+    padding = (-offset) % HEADER_ALIGNMENT
+    with open(path, "wb") as outfile:
+        outfile.write(MAGIC)
+        outfile.write((len(header_bytes) + padding).to_bytes(8, "little"))
+        outfile.write(header_bytes + b" " * padding)
+        outfile.write(np.ascontiguousarray(places, dtype="<i2").tobytes())
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+
+def publish_snapshot(availability: pd.DataFrame, directory: Text = DEFAULT_SNAPSHOT_DIR) -> Text:
+    """
+    Publish a new snapshot version of the availability.
+
+    Args:
+        availability: available places with columns hut_id, date (dd.mm.yyyy) and places_avail
+        directory: snapshot directory
+
+    Returns:
+        path of the new snapshot
+    """
+    os.makedirs(directory, exist_ok=True)
+    dates = pd.to_datetime(availability["date"], format=DATE_FORMAT_DB)
+    first_date = dates.min().date() if len(availability) > 0 else datetime.date.today()
+    day_index = (dates - pd.Timestamp(first_date)).dt.days.to_numpy()
+    hut_ids, hut_index = np.unique(availability["hut_id"].to_numpy(), return_inverse=True)
+
+    places = np.full((len(hut_ids), int(day_index.max()) + 1 if len(day_index) > 0 else 0), -1, dtype=np.int16)
+    places[hut_index, day_index] = availability["places_avail"].clip(-1, np.iinfo(np.int16).max).to_numpy()
+
+    version = datetime.datetime.now().strftime(VERSION_FORMAT)
+    header = {
+        "version": version,
+        "first_date": first_date.isoformat(),
+        "nr_days": places.shape[1],
+        "hut_ids": hut_ids.tolist(),
+    }
+    file_name = f"availability_{version}.snap"
+    path = os.path.join(directory, file_name)
+    _write_snapshot(path + ".tmp", header, places)
+    os.replace(path + ".tmp", path)
+
+    # switch the pointer to the new version
+    latest_path = os.path.join(directory, LATEST_FILE)
+    with open(latest_path + ".tmp", "w") as outfile:
+        outfile.write(file_name)
+    os.replace(latest_path + ".tmp", latest_path)
+
+    # remove old versions (processes that still map them keep their copy until they switch)
+    versions = sorted(f for f in os.listdir(directory) if f.startswith("availability_") and f.endswith(".snap"))
+    for old_file in versions[:-KEEP_VERSIONS]:
+        os.remove(os.path.join(directory, old_file))
+    return path
+
+
+def withdraw_snapshot(directory: Text = DEFAULT_SNAPSHOT_DIR) -> None:
+    """Remove the pointer to the latest version, so that the API reads from the database (e.g. if publishing failed)."""
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(directory, LATEST_FILE))
+
+
+def publish_from_database(
+    engine: sqlalchemy.engine.Engine, today: datetime.date, directory: Text = DEFAULT_SNAPSHOT_DIR
+) -> Text:
+    """Publish a snapshot of the availability from today onwards (run at the end of every update)."""
+    query = sqlalchemy.text("SELECT hut_id, date, places_avail FROM hut_availability WHERE avail_date >= :today")
+    availability = pd.read_sql(query, engine, params={"today": today.isoformat()})
+    return publish_snapshot(availability, directory)
+
+
+class AvailabilitySnapshot:
+    """One memory-mapped snapshot version."""
+
+    def __init__(self, path: Text) -> None:
+        with open(path, "rb") as infile:
+            if infile.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not an availability snapshot")
+            header_length = int.from_bytes(infile.read(8), "little")
+            header = json.loads(infile.read(header_length))
+        self.path = path
+        self.version = header["version"]
+        self.created = datetime.datetime.strptime(self.version, VERSION_FORMAT)
+        self.first_date = datetime.date.fromisoformat(header["first_date"])
+        self.hut_ids = np.array(header["hut_ids"], dtype=np.int64)
+        shape = (len(self.hut_ids), header["nr_days"])
+        offset = len(MAGIC) + 8 + header_length
+        if shape[0] * shape[1] == 0:
+            self.places = np.empty(shape, dtype="<i2")
+        else:
+            self.places = np.memmap(path, dtype="<i2", mode="r", offset=offset, shape=shape)
+
+    def is_fresh(self, max_age: datetime.timedelta = MAX_SNAPSHOT_AGE) -> bool:
+        """Whether the snapshot was published within max_age."""
+        return datetime.datetime.now() - self.created <= max_age
+
+    def covers(self, dates: List[Text]) -> bool:
+        """Whether all dates (dd.mm.yyyy) lie within the dates of the snapshot."""
+        last_date = self.first_date + datetime.timedelta(days=self.places.shape[1])
+        return all(
+            self.first_date <= datetime.datetime.strptime(date, DATE_FORMAT_DB).date() < last_date for date in dates
+        )
+
+    def availability_for_dates(self, dates: List[Text], min_places: int = 1) -> pd.DataFrame:
+        """
+        Available places of all huts on the given dates, in the format of the database query.
+
+        Args:
+            dates: dates (dd.mm.yyyy)
+            min_places: minimum number of free places
+
+        Returns:
+            pd.DataFrame with columns hut_id, date and places_avail
+        """
+        day_index = np.array(
+            [(datetime.datetime.strptime(d, DATE_FORMAT_DB).date() - self.first_date).days for d in dates], dtype=int
+        )
+        in_range = (day_index >= 0) & (day_index < self.places.shape[1])
+        dates_in_range = np.array(dates, dtype=object)[in_range]
+        places = np.asarray(self.places[:, day_index[in_range]])
+        hut_index, date_index = np.nonzero((places >= min_places) & (places >= 0))
+        return pd.DataFrame(
+            {
+                "hut_id": self.hut_ids[hut_index],
+                "date": dates_in_range[date_index],
+                "places_avail": places[hut_index, date_index].astype(int),
+            }
+        )
+
+
+class SnapshotReader:
+    """Access to the latest published snapshot, switching to new versions without blocking readers."""
+
+    def __init__(self, directory: Text = DEFAULT_SNAPSHOT_DIR) -> None:
+        self.directory = directory
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[AvailabilitySnapshot]:
+        """The latest snapshot, None if no snapshot was published yet."""
+        try:
+            with open(os.path.join(self.directory, LATEST_FILE), "r") as infile:
+                file_name = infile.read().strip()
+        except FileNotFoundError:
+            return None
+        snapshot = self._snapshot
+        if snapshot is None or os.path.basename(snapshot.path) != file_name:
+            with self._lock:
+                if self._snapshot is None or os.path.basename(self._snapshot.path) != file_name:
+                    # requests that hold the old snapshot keep using its mapping
+                    self._snapshot = AvailabilitySnapshot(os.path.join(self.directory, file_name))
+                snapshot = self._snapshot
+        return snapshot
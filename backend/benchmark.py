@@ -0,0 +1,309 @@
+"""
+Benchmark suite for hut filtering, name search, multi-day route finding, result serialization and scraper parsing.
+
+Runs fully offline on the checked-in files in data/, on synthetic datasets and on the pages of the reservation
+website in fixtures/scraper (the parsers are checked against fixtures/scraper/expected.json). Run from the backend
+folder:
+
+    python benchmark.py --out benchmarks/<commit>.json
+    python benchmark.py --out benchmarks/new.json --compare benchmarks/old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from typing import Any, Callable, Dict, List
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from bs4 import BeautifulSoup
+
+import availability_parser
+import synthetic_data
+from filtering import FEASIBLE_CONNECTIONS, filter_huts, multi_day_route_finding
+from name_search import NameIndex
+from serialization import routes_to_json, table_to_dict
+
+# synthetic dataset presets: number of huts, connections per hut and fraction of unavailable (hut, date) cells
+SYNTHETIC_PRESETS = {
+    "small": {"nr_huts": 300, "avg_degree": 4, "sparsity": 0.5},
+    "medium": {"nr_huts": 1000, "avg_degree": 5, "sparsity": 0.6},
+    "large": {"nr_huts": 3000, "avg_degree": 6, "sparsity": 0.7},
+}
+TRIP_LENGTHS = range(2, 8)
+# calendar, table and preamble pages of the reservation website with their expected parse results (hand-built from
+# the selectors of the scraper, pages captured with AvailabilityChecker(capture_dir=...) can be added)
+SCRAPER_FIXTURES = os.path.join("fixtures", "scraper")
+# relative slowdown above which a case is flagged in the comparison
+REGRESSION_THRESHOLD = 0.1
+
+
+def time_function(func: Callable, setup: Callable = None, rounds: int = 5, warmup: int = 1) -> Dict[str, Any]:
+    """
+    Time a function call.
+
+    Args:
+        func: function to time, called with the output of setup as arguments
+        setup: function returning a tuple of arguments for func (not timed, called before every round)
+        rounds: number of timed rounds
+        warmup: number of untimed rounds before timing
+
+    Returns:
+        dict with timing statistics in seconds and the length of the output of the last call
+    """
+    timings, output = [], None
+    for i in range(warmup + rounds):
+        args = setup() if setup is not None else ()
+        tic = time.perf_counter()
+        output = func(*args)
+        toc = time.perf_counter()
+        if i >= warmup:
+            timings.append(toc - tic)
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "rounds": rounds,
+        "output_len": len(output) if hasattr(output, "__len__") else None,
+    }
+
+
+def load_real_dataset() -> Dict[str, Any]:
+    """Load huts, connections and availability from the checked-in data files."""
+    huts = gpd.read_file(os.path.join("data", "huts_database.geojson"))
+    availability = synthetic_data.load_checked_in_availability()
+    return {
+        "huts": huts,
+        "connections": FEASIBLE_CONNECTIONS,
+        "avail_per_date": synthetic_data.pivot_availability(availability),
+        "date_list": sorted(availability["date"].unique(), key=lambda d: d.split(".")[::-1]),
+        "max_dist_between_huts": 10000,
+    }
+
+
+def make_synthetic_dataset(nr_huts: int, avg_degree: int, sparsity: float, seed: int = 0) -> Dict[str, Any]:
+    """Generate huts, connections and availability for a synthetic preset."""
+    huts = synthetic_data.make_huts(nr_huts, seed=seed)
+    date_list = synthetic_data.make_date_list(max(TRIP_LENGTHS))
+    availability = synthetic_data.make_availability(huts["id"].values, date_list, sparsity=sparsity, seed=seed)
+    return {
+        "huts": huts,
+        # the density is controlled by the number of neighbours, not by the distance
+        "connections": synthetic_data.make_connections(huts, avg_degree=avg_degree, max_distance=-1),
+        "avail_per_date": synthetic_data.pivot_availability(availability),
+        "date_list": date_list,
+        "max_dist_between_huts": -1,
+    }
+
+
+def benchmark_dataset(name: str, dataset: Dict[str, Any], rounds: int) -> Dict[str, Dict]:
+    """Run all benchmark cases on one dataset."""
+    huts = dataset["huts"]
+    id_to_hut_name = huts.set_index("id")["name"].to_dict()
+    huts_with_id = huts.set_index("id")
+    center_lat, center_lon = huts["latitude"].median(), huts["longitude"].median()
+    results = {}
+
+    # filtering: broad query around the center of the dataset
+    filter_attributes = {
+        "start_lat": center_lat,
+        "start_lon": center_lon,
+        "min_distance": 0,
+        "max_distance": 150,
+        "min_altitude": 1500,
+        "max_altitude": 3000,
+    }
+    results[f"{name}/filter_huts"] = time_function(lambda: filter_huts(huts, **filter_attributes), rounds=rounds)
+
+    # serialization of the single-day markers (table_to_dict modifies its input, so copy in the setup)
+    filtered_huts = filter_huts(huts, **filter_attributes)
+    results[f"{name}/table_to_dict"] = time_function(
+        table_to_dict, setup=lambda: (filtered_huts.copy(),), rounds=rounds
+    )
+
+    # typeahead name search: prefixes of increasing length of hut names (all prefixes per timed round)
+    name_index = NameIndex(huts)
+    prefixes = [hut_name[:length] for hut_name in huts["name"].head(20) for length in (1, 3, 6)]
+    results[f"{name}/name_search"] = time_function(
+        lambda: [name_index.search(prefix) for prefix in prefixes], rounds=rounds
+    )
+
+    # route finding and route serialization for trips of increasing length
+    for nr_days in TRIP_LENGTHS:
+        date_list = dataset["date_list"][:nr_days]
+        if len(date_list) < nr_days:
+            break
+
+        def find_routes(date_list: list = date_list) -> pd.DataFrame:
+            return multi_day_route_finding(
+                date_list,
+                dataset["avail_per_date"],
+                id_to_hut_name,
+                max_dist_between_huts=dataset["max_dist_between_huts"],
+                feasible_connections=dataset["connections"],
+            )
+
+        results[f"{name}/multi_day_route_finding/{nr_days}d"] = time_function(find_routes, rounds=rounds)
+        trip_options = find_routes()
+        results[f"{name}/routes_to_json/{nr_days}d"] = time_function(
+            lambda trip_options=trip_options, nr_days=nr_days: routes_to_json(trip_options, huts_with_id, nr_days),
+            rounds=rounds,
+        )
+    return results
+
+
+def parse_availability_table_bs4(table_html: str) -> Dict[str, str]:
+    """Table parsing as done by the scraper before availability_parser, the baseline of the lxml parser."""
+    avail_on_date = {}
+    for row in BeautifulSoup(table_html, "html.parser").find_all("mat-row", class_="mat-mdc-row"):
+        date_cell = row.find("td", class_="table_row_date")
+        places_cell = row.find("td", class_="table_row_places")
+        if date_cell and places_cell:
+            avail_on_date[date_cell.get_text(strip=True)] = places_cell.get_text(strip=True).replace("!", "")
+    return avail_on_date
+
+
+def load_scraper_fixtures(fixture_dir: str = SCRAPER_FIXTURES) -> Dict[str, Any]:
+    """Load the pages (by kind: calendar, table, preamble), the preamble messages and the expected results."""
+    pages = {"calendar": {}, "table": {}, "preamble": {}}
+    for file_name in sorted(os.listdir(fixture_dir)):
+        kind = file_name.split("_")[0]
+        if file_name.endswith(".html") and kind in pages:
+            with open(os.path.join(fixture_dir, file_name), "r", encoding="utf-8") as infile:
+                pages[kind][file_name] = infile.read()
+    with open(os.path.join(fixture_dir, "preamble_messages.json"), "r", encoding="utf-8") as infile:
+        messages = json.load(infile)
+    with open(os.path.join(fixture_dir, "expected.json"), "r", encoding="utf-8") as infile:
+        expected = json.load(infile)
+    return {"pages": pages, "messages": messages, "expected": expected}
+
+
+def check_scraper_fixtures(fixtures: Dict[str, Any]) -> List[str]:
+    """Return the fixtures whose parse result differs from the expected one."""
+    parsers = {
+        "calendar": availability_parser.parse_calendar_month,
+        "table": availability_parser.parse_availability_table,
+        "preamble": availability_parser.parse_preamble,
+    }
+    mismatches = []
+    for kind, pages in fixtures["pages"].items():
+        for file_name, page_html in pages.items():
+            if parsers[kind](page_html) != fixtures["expected"].get(file_name):
+                mismatches.append(file_name)
+    for message in fixtures["messages"]:
+        date = availability_parser.convert_message_to_date(message["message"])
+        if (date.date().isoformat() if date is not None else None) != message["date"]:
+            mismatches.append(f"preamble_messages.json: {message['message']}")
+    return mismatches
+
+
+def benchmark_scraper_parsing(fixtures: Dict[str, Any], rounds: int) -> Dict[str, Dict]:
+    """Time the parsers on all pages of a kind per round (the table also with the BeautifulSoup baseline)."""
+    pages = {kind: list(kind_pages.values()) for kind, kind_pages in fixtures["pages"].items()}
+    messages = [message["message"] for message in fixtures["messages"]]
+    cases = {
+        "parse_calendar_month": lambda: [availability_parser.parse_calendar_month(page) for page in pages["calendar"]],
+        "parse_availability_table": lambda: [
+            availability_parser.parse_availability_table(page) for page in pages["table"]
+        ],
+        "parse_availability_table_bs4": lambda: [parse_availability_table_bs4(page) for page in pages["table"]],
+        "parse_preamble": lambda: [availability_parser.parse_preamble(page) for page in pages["preamble"]],
+        "convert_message_to_date": lambda: [
+            availability_parser.convert_message_to_date(message) for message in messages
+        ],
+    }
+    return {f"scraper/{case}": time_function(func, rounds=rounds) for case, func in cases.items()}
+
+
+def get_commit() -> str:
+    """Return the current git commit hash (or "unknown" outside of a git checkout)."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare_reports(new_report: Dict, old_report: Dict, threshold: float = REGRESSION_THRESHOLD) -> int:
+    """
+    Print a comparison of the median timings of two reports.
+
+    Args:
+        new_report: report of the current run
+        old_report: report to compare against
+        threshold: relative slowdown above which a case is flagged as regression
+
+    Returns:
+        number of regressions
+    """
+    print(f"\nComparison {old_report['meta']['commit']} -> {new_report['meta']['commit']} (median seconds)")
+    if old_report["meta"].get("presets") != new_report["meta"].get("presets"):
+        print("Warning: the synthetic presets differ between the reports, synthetic cases are not comparable")
+    nr_regressions = 0
+    for case, new_stats in new_report["results"].items():
+        if case not in old_report["results"]:
+            print(f"{case:<55} {'-':>10} {new_stats['median']:>10.4f}   (new)")
+            continue
+        old_median = old_report["results"][case]["median"]
+        ratio = new_stats["median"] / old_median if old_median > 0 else np.inf
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "REGRESSION"
+            nr_regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "improved"
+        print(f"{case:<55} {old_median:>10.4f} {new_stats['median']:>10.4f} {ratio:>7.2f}x {flag}")
+    return nr_regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark filtering and route finding offline")
+    parser.add_argument("--out", default=None, help="path to save the json report")
+    parser.add_argument("--compare", default=None, help="json report of a previous run to compare against")
+    parser.add_argument("--rounds", type=int, default=5, help="timed rounds per case")
+    parser.add_argument(
+        "--presets", default="small,medium", help=f"synthetic presets to run ({', '.join(SYNTHETIC_PRESETS)})"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the synthetic data")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "commit": get_commit(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "rounds": args.rounds,
+            "seed": args.seed,
+            "presets": {preset: SYNTHETIC_PRESETS[preset] for preset in args.presets.split(",")},
+        },
+        "results": {},
+    }
+
+    scraper_fixtures = load_scraper_fixtures()
+    report["meta"]["scraper_fixture_mismatches"] = check_scraper_fixtures(scraper_fixtures)
+    for mismatch in report["meta"]["scraper_fixture_mismatches"]:
+        print(f"Scraper fixture parsed differently than expected: {mismatch}")
+    report["results"].update(benchmark_scraper_parsing(scraper_fixtures, args.rounds))
+
+    report["results"].update(benchmark_dataset("real", load_real_dataset(), args.rounds))
+    for preset in args.presets.split(","):
+        dataset = make_synthetic_dataset(**SYNTHETIC_PRESETS[preset], seed=args.seed)
+        report["results"].update(benchmark_dataset(f"synthetic_{preset}", dataset, args.rounds))
+
+    for case, stats in report["results"].items():
+        print(f"{case:<55} median {stats['median']:.4f}s (min {stats['min']:.4f}s, output {stats['output_len']})")
+
+    if args.out is not None:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as outfile:
+            json.dump(report, outfile, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as infile:
+            old_report = json.load(infile)
+        compare_reports(report, old_report)
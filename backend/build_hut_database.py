@@ -1,14 +1,21 @@
+import argparse
+import functools
 import json
 import os
-from typing import Text, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Text, Tuple
 import numpy as np
 from scipy.spatial.distance import cdist
 import geopandas as gpd
-import googlemaps
 import pandas as pd
 import requests
-from bs4 import BeautifulSoup
-from googlemaps import Client as GoogleMaps
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import geocoding
+from build_pipeline import Stage, run_stages
 
 PLACES_CODE = "total sleeping places: "
 WARDEN_CODE = "hut warden(s): "
@@ -17,41 +24,14 @@ COORDS_CODE = "coordinates: "
 PHONE_CODE = "Hut phone number: "
 ALPENVEREIN_SHORTCUTS = ["DAV", "SAC", "Genossenschaft", "Alpenverein", "AVS", "ÖAV", "CAS"]
 DATA_PATH = "data"
+CALENDAR_URL = "https://www.alpsonline.org/reservation/calendar?hut_id={hut_id}"
+MAX_CONCURRENT_REQUESTS = 8
+CRAWL_TIMEOUT = 30
+CRAWL_RETRIES = 3
+CRAWL_BACKOFF = 1
+# raw files of huts that were crawled within this time (in seconds) are reused
+RAW_MAX_AGE = 7 * 24 * 3600
 # os.makedirs(DATA_PATH, exist_ok=True)
-GM_CLIENT = GoogleMaps(open("gpc_api_key.keypair", "r").read())
-
-
-def get_coordinates(title: str, api: googlemaps.client.Client) -> Tuple[float, float]:
-    """
-    Perform geolocationing for a title and a subtitle.
-
-    Args:
-        title: Title of the penny machine.
-        subtitle: Subtitle of the penny machine.
-        api: google maps API object.
-
-    Returns:
-        Tuple[float, float]: Latitude and longitude
-    """
-
-    # Make GM request, default title and subtitle.
-    queries = [title]
-
-    for query in queries:
-        coordinates = api.geocode(query)
-
-        try:
-            lat = coordinates[0]["geometry"]["location"]["lat"]
-            lng = coordinates[0]["geometry"]["location"]["lng"]
-            break
-        except IndexError:
-            continue
-    try:
-        lat
-    except NameError:
-        print(f"Geolocation failed for: {title}")
-        lat, lng = pd.NA, pd.NA
-    return lat, lng
 
 
 def find_verein(hut: Text) -> Tuple:
@@ -69,177 +49,296 @@ def find_verein(hut: Text) -> Tuple:
     return hut_name_short, hut_verein, specific_verein
 
 
-def crawl_general_info(out_path: str, final_out_path: str):
+def parse_hut_page(html_content: Text, hut_id: int) -> Dict:
+    """
+    Parse the meta info of a hut from its calendar page.
+
+    Only the hut name (h4) and the info spans are parsed (with lxml), the rest of the page is skipped.
+
+    Args:
+        html_content: html of the calendar page
+        hut_id: hut id
+
+    Returns:
+        dict with the hut meta info, as saved in the raw json files
+    """
+    soup = BeautifulSoup(html_content, "lxml", parse_only=SoupStrainer(["h4", "span"]))
+    hut_name = soup.find("h4").text
+    hut_meta_info = {"id": hut_id, "name_original": hut_name}
+
+    # retrieve hut information
+    for span_elem in soup.find_all("span"):
+        info_text = span_elem.text.lower()
+        if "warden" in info_text:
+            hut_meta_info["hut_warden"] = info_text.replace(WARDEN_CODE, "")
+        elif "places" in info_text:
+            hut_meta_info["total_places"] = info_text.replace(PLACES_CODE, "")
+        elif "height" in info_text:
+            hut_meta_info["altitude"] = info_text.replace(ALT_CODE, "")
+        elif "coordinates" in info_text:
+            hut_meta_info["coordinates"] = info_text.replace(COORDS_CODE, "")
+        elif "phone" in info_text:
+            hut_meta_info["phone"] = info_text.replace(PHONE_CODE, "")
+
+    # get short hut name and alpenverein
+    hut_name_short, hut_verein, specific_verein = find_verein(hut_name)
+    hut_meta_info["name"] = hut_name_short
+    hut_meta_info["verein"] = hut_verein
+    hut_meta_info["sektion"] = specific_verein
+    return hut_meta_info
+
+
+def make_session(pool_size: int) -> requests.Session:
+    """Session with a connection pool of the given size and retries with exponential backoff."""
+    session = requests.Session()
+    retries = Retry(total=CRAWL_RETRIES, backoff_factor=CRAWL_BACKOFF, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def crawl_general_info(
+    out_path: str,
+    final_out_path: str,
+    hut_ids: Iterable[int] = range(680),
+    base_url: str = CALENDAR_URL,
+    max_age: float = RAW_MAX_AGE,
+    max_workers: int = MAX_CONCURRENT_REQUESTS,
+) -> pd.DataFrame:
+    """
+    Crawl the meta info of all huts concurrently and save them as raw json files and as csv.
+
+    Huts whose raw json file is younger than max_age are not downloaded again.
+
+    Args:
+        out_path: folder of the raw json files (one per hut)
+        final_out_path: path of the csv with the info of all huts
+        hut_ids: hut ids to crawl
+        base_url: url of the calendar page, with a placeholder for the hut id
+        max_age: maximum age of a raw file in seconds that is reused
+        max_workers: maximum number of concurrent requests
+
+    Returns:
+        pd.DataFrame with the info of all huts (index id)
+    """
     # path to save raw json files
     os.makedirs(out_path, exist_ok=True)
+    session = make_session(max_workers)
 
-    all_huts_info = []
-
-    for hut_id in range(680):
+    def crawl_hut(hut_id: int) -> Optional[Dict]:
         out_file = os.path.join(out_path, f"{hut_id}.json")
+        if os.path.exists(out_file) and time.time() - os.path.getmtime(out_file) < max_age:
+            with open(out_file, "r") as infile:
+                return json.load(infile)
+
         # First step: check if generally available
-        url = f"https://www.alpsonline.org/reservation/calendar?hut_id={hut_id}"
-        response = requests.get(url)
+        try:
+            response = session.get(base_url.format(hut_id=hut_id), timeout=CRAWL_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"hut {hut_id}: request failed ({e}) - skip")
+            return None
         if response.status_code != 200:
-            print(f"status code {response.status_code} - skip")
-            continue
-        html_content = response.text
-        soup = BeautifulSoup(html_content, "html.parser")  # , "lxml")
-
-        hut_name = soup.find("h4").text
-
-        hut_meta_info = {"id": hut_id, "name_original": hut_name}
-
-        # retrieve hut information
-        for span_elem in soup.find_all("span"):
-            info_text = span_elem.text.lower()
-            if "warden" in info_text:
-                hut_meta_info["hut_warden"] = info_text.replace(WARDEN_CODE, "")
-            elif "places" in info_text:
-                hut_meta_info["total_places"] = info_text.replace(PLACES_CODE, "")
-            elif "height" in info_text:
-                hut_meta_info["altitude"] = info_text.replace(ALT_CODE, "")
-            elif "coordinates" in info_text:
-                hut_meta_info["coordinates"] = info_text.replace(COORDS_CODE, "")
-            elif "phone" in info_text:
-                hut_meta_info["phone"] = info_text.replace(PHONE_CODE, "")
-
-        # get short hut name and alpenverein
-        hut_name_short, hut_verein, specific_verein = find_verein(hut_name)
-        hut_meta_info["name"] = hut_name_short
-        hut_meta_info["verein"] = hut_verein
-        hut_meta_info["sektion"] = specific_verein
+            print(f"hut {hut_id}: status code {response.status_code} - skip")
+            return None
+        hut_meta_info = parse_hut_page(response.text, hut_id)
 
         # save meta info
         with open(out_file, "w") as outf:
             json.dump(hut_meta_info, outf, ensure_ascii=False)
+        print(f"saved meta info of {hut_meta_info['name_original']}")
+        return hut_meta_info
 
-        all_huts_info.append(hut_meta_info)
-        print(f"saved meta info of {hut_name}")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        all_huts_info = [info for info in executor.map(crawl_hut, hut_ids) if info is not None]
+    session.close()
 
     all_huts_info = pd.DataFrame(all_huts_info).set_index("id")
     all_huts_info.to_csv(final_out_path)
+    return all_huts_info
 
 
-def call_maps_api(row):
-    hut_name = row["name"]
-    verein = row["verein"]
-    if pd.isna(hut_name):
-        row["latitude"] = None
-        row["longitude"] = None
-        return row
-    elif pd.isna(verein):
-        gm_input = hut_name
-    else:
-        gm_input = hut_name + ", " + verein
-    lat, lon = get_coordinates(gm_input, GM_CLIENT)
-    row["latitude"] = lat
-    row["longitude"] = lon
-    return row
+def geocoding_queries(hut_info: pd.DataFrame) -> pd.Series:
+    """Geocoding query per hut: the short hut name and the alpenverein if known (NaN without name)."""
+    return hut_info["name"].where(hut_info["verein"].isna(), hut_info["name"] + ", " + hut_info["verein"])
 
 
-def get_alt_meter(alt: Text) -> int:
+def add_coordinates(
+    hut_info: pd.DataFrame, geocoder: geocoding.Geocoder, cache: geocoding.GeocodeCache = None
+) -> pd.DataFrame:
     """
-    Retrieve altitude from NNNNm csv column.
+    Add latitude and longitude columns to the hut info.
+
+    Huts are geocoded by name (see geocoding_queries). If the geocoder does not find a hut, the coordinates field of
+    the hut page (Swiss grid or decimal degrees) is used instead.
 
     Args:
-        alt: altitude csv column test in format NNNNm
+        hut_info: crawled hut info with columns name, verein and coordinates
+        geocoder: geocoder for queries that are not cached
+        cache: persistent geocoding cache (optional)
 
     Returns:
-        alt_int: altitude converted to int
+        copy of hut_info with latitude and longitude columns (NaN if not found)
     """
+    queries = geocoding_queries(hut_info)
+    found = geocoding.geocode_queries(queries.dropna(), geocoder, cache)
+    latitudes, longitudes = [], []
+    for query, page_coordinates in zip(queries, hut_info["coordinates"], strict=True):
+        coordinates = None
+        if isinstance(query, str):
+            coordinates = found[geocoding.normalize_query(query)] or geocoding.parse_page_coordinates(page_coordinates)
+            if coordinates is None:
+                print(f"Geolocation failed for: {query}")
+        latitudes.append(coordinates[0] if coordinates is not None else pd.NA)
+        longitudes.append(coordinates[1] if coordinates is not None else pd.NA)
+
+    hut_info = hut_info.copy()
+    hut_info["latitude"] = latitudes
+    hut_info["longitude"] = longitudes
+    return hut_info
+
+
+def parse_altitude(altitude: pd.Series) -> pd.Series:
+    """
+    Parse the altitude column (format NNNN m) to meters.
+
+    Args:
+        altitude: altitude texts from the hut pages
 
-    try:
-        alt_int = float(alt.replace("m", ""))
-    except ValueError:
-        alt_int = pd.NA
-    except AttributeError:
-        alt_int = pd.NA
-    return alt_int
+    Returns:
+        altitude in meters as float, NaN if it cannot be parsed
+    """
+    return pd.to_numeric(altitude.astype("string").str.replace("m", "").str.strip(), errors="coerce").astype(float)
 
 
-def get_places_cleaned(places: Text) -> int:
+def parse_places(places: pd.Series) -> pd.Series:
     """
-    Clean places column and try to convert to int.
+    Parse the places column to int: the whole text if it is a number, otherwise its first number, otherwise 10.
 
     Args:
-        places: place text from csv
+        places: places texts from the hut pages
 
     Returns:
-        places_int: places column as int
+        places as int
+    """
+    places = places.astype("string")
+    whole = pd.to_numeric(places.str.strip(), errors="coerce")
+    first_word = pd.to_numeric(places.str.extract(r"(?:^| )\s*([+-]?\d+)\s*(?= |$)", expand=False), errors="coerce")
+    return whole.fillna(first_word).fillna(10).astype(int)
+
+
+def clean_huts(hut_info_with_coords: pd.DataFrame) -> gpd.GeoDataFrame:
     """
+    Convert the hut info with coordinates to a GeoDataFrame with parsed altitude and places.
 
-    try:
-        places_int = int(places)
-    except ValueError:
-        parts = places.split(" ")
-        places_int = 10
-        for p in parts:
-            try:
-                places_int = int(p)
-                break
-            except ValueError:
-                continue
-    return places_int
-
-
-def clean_huts(inp_path, out_path):
-    huts_gdf = gpd.read_file(inp_path, index_col="id").dropna(subset="name").drop("Unnamed: 0", axis=1)
-    huts_gdf["altitude_m"] = huts_gdf["altitude"].apply(get_alt_meter)
-    huts_gdf["total_places"] = huts_gdf["total_places"].apply(get_places_cleaned).astype(int)
-    huts_gdf_clean = huts_gdf.dropna(subset=["altitude_m"])
-    huts_gdf_clean["altitude_m"] = huts_gdf_clean["altitude_m"].astype(float)
-    huts_gdf_clean.to_file(out_path, driver="GeoJSON")
-
-
-def save_feasible_connections(max_distance: int = 13000):
+    Args:
+        hut_info_with_coords: hut info with latitude and longitude columns
+
+    Returns:
+        gpd.GeoDataFrame of all huts with name and altitude
+    """
+    huts_gdf = gpd.GeoDataFrame(
+        hut_info_with_coords,
+        geometry=gpd.points_from_xy(x=hut_info_with_coords["longitude"], y=hut_info_with_coords["latitude"]),
+        crs=4326,
+    ).dropna(subset="name")
+    huts_gdf["altitude_m"] = parse_altitude(huts_gdf["altitude"])
+    huts_gdf["total_places"] = parse_places(huts_gdf["total_places"])
+    return huts_gdf.dropna(subset=["altitude_m"])
+
+
+def save_feasible_connections(
+    max_distance: int = 13000,
+    huts_path: str = os.path.join(DATA_PATH, "huts_database.geojson"),
+    out_path: str = os.path.join(DATA_PATH, "feasible_connections.csv"),
+) -> None:
     """Generate all feasible connections between huts and save to csv."""
-    huts = gpd.read_file(os.path.join("data", "huts_database.geojson"))
+    huts = gpd.read_file(huts_path)
     huts.to_crs(2421, inplace=True)
     hut_coords = np.stack([huts.geometry.x, huts.geometry.y]).T
     pairwise_dist = cdist(hut_coords, hut_coords)
 
-    # create a mask for the distances
-    is_connected = (pairwise_dist <= max_distance) & (pairwise_dist > 0)
+    # all pairs within the maximum distance (row-major order, i.e. sorted by source)
+    source, target = np.nonzero((pairwise_dist <= max_distance) & (pairwise_dist > 0))
     ids = huts["id"].values
-    # iterate over combinations and add them to df
-    combs = []
-    nr_huts = len(is_connected)
-    for i in range(nr_huts):
-        for j in range(nr_huts):
-            if is_connected[i, j]:
-                combs.append({"id_source": ids[i], "id_target": ids[j], "distance": int(pairwise_dist[i, j])})
-    feasible_connections = pd.DataFrame(combs).set_index("id_source")
-    feasible_connections.to_csv(os.path.join("data", "feasible_connections.csv"))
+    feasible_connections = pd.DataFrame(
+        {"id_source": ids[source], "id_target": ids[target], "distance": pairwise_dist[source, target].astype(int)}
+    ).set_index("id_source")
+    feasible_connections.to_csv(out_path)
 
 
-if __name__ == "__main__":
-    # set paths
+def geocode_stage(hut_info_path: str, out_path: str) -> None:
+    """Geocode the crawled huts (see add_coordinates) and save them as csv."""
+    hut_info = pd.read_csv(hut_info_path)
+    geocode_cache = geocoding.GeocodeCache()
+    hut_info_with_coords = add_coordinates(hut_info, geocoding.GoogleMapsGeocoder(), geocode_cache)
+    geocode_cache.close()
+    hut_info_with_coords.to_csv(out_path, index=False)
+
+
+def clean_stage(hut_coords_path: str, out_path: str) -> None:
+    """Clean the geocoded huts (see clean_huts) and save them as GeoJSON."""
+    clean_huts(pd.read_csv(hut_coords_path)).to_file(out_path, driver="GeoJSON")
+
+
+def make_stages(pbf_path: str = None) -> List[Stage]:
+    """
+    Stages of the hut database build.
+
+    Args:
+        pbf_path: OSM extract for trail distances (see trail_network.py), beeline distances if None
+
+    Returns:
+        list of stages in the order of their dependencies
+    """
     raw_out_path = os.path.join(DATA_PATH, "raw")
     hut_info_out_path = os.path.join(DATA_PATH, "hut_info.csv")
     hut_coord_out_path = os.path.join(DATA_PATH, "hut_coords.csv")
-    hut_coord_geojson = os.path.join(DATA_PATH, "huts_gdf.geojson")
     hut_final_cleaned = os.path.join(DATA_PATH, "huts_database.geojson")
+    connections_path = os.path.join(DATA_PATH, "feasible_connections.csv")
 
-    # Crawl info
-    crawl_general_info(raw_out_path, hut_info_out_path)
-
-    # load hut info and use gogle maps API
-    hut_info = pd.read_csv(hut_info_out_path)
-    hut_info_with_coords = hut_info.apply(call_maps_api, axis=1)
-    hut_info_with_coords.to_csv(hut_coord_out_path)
+    if pbf_path is None:
+        connections_stage = Stage(
+            "connections", save_feasible_connections, inputs=[hut_final_cleaned], outputs=[connections_path]
+        )
+    else:
+        import trail_network
+
+        connections_stage = Stage(
+            "connections",
+            functools.partial(trail_network.build_trail_connections, pbf_path, connections_path),
+            inputs=[hut_final_cleaned, pbf_path],
+            outputs=[connections_path],
+        )
+
+    return [
+        # the crawler runs every time, but only downloads pages whose raw file is outdated
+        Stage(
+            "crawl",
+            functools.partial(crawl_general_info, raw_out_path, hut_info_out_path),
+            outputs=[hut_info_out_path],
+            always_run=True,
+        ),
+        Stage(
+            "geocode",
+            functools.partial(geocode_stage, hut_info_out_path, hut_coord_out_path),
+            inputs=[hut_info_out_path],
+            outputs=[hut_coord_out_path],
+        ),
+        Stage(
+            "clean",
+            functools.partial(clean_stage, hut_coord_out_path, hut_final_cleaned),
+            inputs=[hut_coord_out_path],
+            outputs=[hut_final_cleaned],
+        ),
+        connections_stage,
+    ]
 
-    # transform into geojson
-    hut_info_with_coords = pd.read_csv(hut_coord_out_path)
-    huts_gdf = gpd.GeoDataFrame(
-        hut_info_with_coords,
-        geometry=gpd.points_from_xy(x=hut_info_with_coords["longitude"], y=hut_info_with_coords["latitude"]),
-    )
-    huts_gdf.crs = "4326"
-    huts_gdf.to_file(hut_coord_geojson, driver="GeoJSON")
 
-    # clean ups
-    clean_huts(hut_coord_geojson, hut_final_cleaned)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the hut database (only stages with changed inputs are run)")
+    parser.add_argument("--force", action="store_true", help="run all stages")
+    parser.add_argument("--pbf", default=None, help="OSM extract for trail distances (default: beeline distances)")
+    args = parser.parse_args()
 
-    # save feasible connections
-    save_feasible_connections()
+    run_stages(make_stages(args.pbf), force=args.force)
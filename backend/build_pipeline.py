@@ -0,0 +1,130 @@
+"""Incremental build: stages declare their input and output files and are skipped when nothing changed."""
+
+import hashlib
+import inspect
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Text
+
+BUILD_STATE_PATH = os.path.join("data", "build_state.json")
+
+
+def content_hash(path: Text) -> Optional[Text]:
+    """
+    Hash of the content of a file or of all files in a directory.
+
+    Returns:
+        sha1 hex digest, None if the path does not exist
+    """
+    if os.path.isdir(path):
+        digest = hashlib.sha1()
+        for root, _, files in sorted(os.walk(path)):
+            for file_name in sorted(files):
+                file_path = os.path.join(root, file_name)
+                digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+                digest.update(content_hash(file_path).encode("utf-8"))
+        return digest.hexdigest()
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha1()
+    with open(path, "rb") as infile:
+        for block in iter(lambda: infile.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Stage:
+    """One step of the build that reads input files and writes output files."""
+
+    def __init__(
+        self,
+        name: Text,
+        func: Callable[[], None],
+        inputs: Sequence[Text] = (),
+        outputs: Sequence[Text] = (),
+        params: Dict = None,
+        always_run: bool = False,
+    ) -> None:
+        """
+        Initialize a stage.
+
+        Args:
+            name: unique name of the stage
+            func: function without arguments that runs the stage
+            inputs: files or directories that the stage reads
+            outputs: files that the stage writes
+            params: parameters of the stage, a change of them triggers a rebuild
+            always_run: run the stage in every build (e.g. for stages that download data)
+        """
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.always_run = always_run
+
+    def fingerprint(self) -> Text:
+        """Hash of the input contents, the parameters and the code of the stage function."""
+        func = getattr(self.func, "func", self.func)  # unwrap functools.partial
+        try:
+            code = inspect.getsource(func)
+        except (OSError, TypeError):
+            code = func.__qualname__
+        fingerprint = {
+            "inputs": {path: content_hash(path) for path in self.inputs},
+            "params": self.params,
+            "code": code,
+        }
+        return hashlib.sha1(json.dumps(fingerprint, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _save_state(state: Dict, state_path: Text) -> None:
+    os.makedirs(os.path.dirname(state_path) or ".", exist_ok=True)
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as outfile:
+        json.dump(state, outfile, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def run_stages(stages: List[Stage], state_path: Text = BUILD_STATE_PATH, force: bool = False) -> List[Text]:
+    """
+    Run the stages in order, skipping stages whose fingerprint and outputs are unchanged since their last run.
+
+    Args:
+        stages: stages in the order of their dependencies
+        state_path: json file with the fingerprints and output hashes of the last run of each stage
+        force: run all stages
+
+    Returns:
+        names of the stages that were run
+    """
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, "r") as infile:
+            state = json.load(infile)
+
+    executed = []
+    for stage in stages:
+        fingerprint = stage.fingerprint()
+        record = state.get(stage.name)
+        up_to_date = (
+            record is not None
+            and record["fingerprint"] == fingerprint
+            and all(content_hash(path) == record["outputs"].get(path) for path in stage.outputs)
+        )
+        if up_to_date and not (force or stage.always_run):
+            print(f"[{stage.name}] up to date - skip")
+            continue
+
+        tic = time.time()
+        stage.func()
+        state[stage.name] = {
+            "fingerprint": fingerprint,
+            "outputs": {path: content_hash(path) for path in stage.outputs},
+            "seconds": time.time() - tic,
+        }
+        _save_state(state, state_path)
+        executed.append(stage.name)
+        print(f"[{stage.name}] done in {time.time() - tic:.1f}s")
+    return executed
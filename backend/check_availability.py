@@ -1,13 +1,11 @@
-"""Scrapes alpsonline.org for availability."""
+"""Scrapes alpsonline.org for availability (the pages are parsed by availability_parser)."""
 
 import datetime
 import logging
 import os
 import time
-from typing import Any, Text
+from typing import Any, Callable, Optional, Text
 
-import numpy as np
-from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.chrome.options import Options
@@ -17,10 +15,15 @@ from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
+import availability_parser
+from scrape_telemetry import ScrapeTelemetry
+
 BASE_URL = "https://www.hut-reservation.org/reservation/book-hut/"
 CHROMEDRIVER_PATH = "/usr/local/bin/chromedriver"
 
 SERVICE = Service(CHROMEDRIVER_PATH) if os.path.exists(CHROMEDRIVER_PATH) else None
+# attempts to open the calendar and to extract a calendar month (sometimes the page does not load directly)
+CALENDAR_ATTEMPTS = 2
 
 # set up logger
 logger = logging.getLogger(__name__)
@@ -29,8 +32,16 @@ logger = logging.getLogger(__name__)
 class AvailabilityChecker:
     """AvailabilityChecker handles scraping alpsonline.org and parsing results into Pandas DataFrames."""
 
-    def __init__(self, base_url: Text = BASE_URL) -> None:
-        """Initialize driver."""
+    def __init__(self, base_url: Text = BASE_URL, telemetry: ScrapeTelemetry = None, capture_dir: Text = None) -> None:
+        """
+        Initialize driver.
+
+        Args:
+            base_url: url of the reservation page, the hut id is appended
+            telemetry: collects page load, calendar and extraction timings (default: in-memory only)
+            capture_dir: if given, the HTML of every parsed table, calendar month and preamble is saved there (e.g.
+                to add pages to the parser fixtures in fixtures/scraper)
+        """
         chrome_options = Options()
         chrome_options.add_argument("--headless=new")
         chrome_options.add_argument("--no-sandbox")  # Required for some Linux environments
@@ -39,6 +50,10 @@ class AvailabilityChecker:
         self.driver = webdriver.Chrome(service=SERVICE, options=chrome_options)
         self.base_url = base_url
         self.wait = WebDriverWait(self.driver, 3)
+        self.telemetry = telemetry if telemetry is not None else ScrapeTelemetry()
+        self.capture_dir = capture_dir
+        if capture_dir is not None:
+            os.makedirs(capture_dir, exist_ok=True)
         logger.info("Initialized Checker")
 
     def quit(self):
@@ -60,13 +75,14 @@ class AvailabilityChecker:
         """
         # get url for this hut
         url = self.base_url + str(hut_id) + "/wizard"
-        self.driver.get(url)
+        with self.telemetry.timer("page_load"):
+            self.driver.get(url)
 
         # initialize prev table
         old_table_html = ""
 
         # read preamble
-        preamble = self.get_preamble()
+        preamble = self.get_preamble(hut_id)
         # check if there is a start date in the preamble
         date_from_msg = self.convert_message_to_date(preamble)
 
@@ -146,6 +162,7 @@ class AvailabilityChecker:
                 self.clear_input_field(date_input_end)
 
                 # Try again (two attempts in total, in the first one, just try the same date again)
+                self.telemetry.count("retries")
                 if attempt_count == 0:
                     # try second time because sometimes issue that doesn't load directly
                     attempt_count += 1
@@ -163,22 +180,11 @@ class AvailabilityChecker:
             table_html = self.driver.find_element(
                 By.CSS_SELECTOR, 'table[aria-label="Date Availability Table"]'
             ).get_attribute("outerHTML")
+            self.capture(f"table_{hut_id}_{current_start_date.strftime('%Y-%m-%d')}", table_html)
 
-            # Parse the table HTML using BeautifulSoup
-            soup = BeautifulSoup(table_html, "html.parser")
-            # Find all rows in the table
-            rows = soup.find_all("mat-row", class_="mat-mdc-row")
-            # Extract data from each row
-            for row in rows:
-                # Extract date and available seats
-                date_cell = row.find("td", class_="table_row_date")
-                places_cell = row.find("td", class_="table_row_places")
-
-                if date_cell and places_cell:
-                    date = date_cell.get_text(strip=True)  # Extract and clean the date text
-                    places = places_cell.get_text(strip=True)  # Extract and clean the available seats text
-                    avail_on_date[date] = places.replace("!", "")
-                    logger.info(f"-found availability at {date}: {places}")
+            for date, places in availability_parser.parse_availability_table(table_html).items():
+                avail_on_date[date] = places
+                logger.info(f"-found availability at {date}: {places}")
 
             self.clear_input_field(date_input)
             self.clear_input_field(date_input_end)
@@ -193,32 +199,47 @@ class AvailabilityChecker:
 
         return avail_on_date, "Success"
 
-    def retrieve_from_calendar(self, hut_id: int, num_months: int = 8):
+    def retrieve_from_calendar(
+        self, hut_id: int, num_months: int = 8, skip_months: set = None, on_month: Callable = None
+    ):
         """
         Retrieve availability from the calendar.
 
         Args:
             hut_id: hut id that is used to check BASE_URL + hut_id
             num_months: how many months to process
+            skip_months: indices of months (0 = current month) that are not extracted, e.g. because they are cached
+            on_month: called with the availability of each extracted month (e.g. to cache partial results)
 
         Returns:
             pd.DataFrame containing availability info
             status (whether the request was successful)
 
         """
+        skip_months = skip_months or set()
+
         # get url for this hut
         url = self.base_url + str(hut_id) + "/wizard"
-        self.driver.get(url)
-
-        # click on calendar
-        try:
-            calendar_button = WebDriverWait(self.driver, 5).until(
-                EC.element_to_be_clickable((By.ID, "cy-datePicker__toggle"))
-            )
-            self.driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", calendar_button)
-            time.sleep(1)
-            calendar_button.click()
-        except TimeoutException:
+        for attempt in range(CALENDAR_ATTEMPTS):
+            if attempt > 0:
+                self.telemetry.count("retries")
+                logger.info(f"Calendar of hut {hut_id} did not load, reloading the page")
+            with self.telemetry.timer("page_load"):
+                self.driver.get(url)
+
+            # click on calendar
+            try:
+                with self.telemetry.timer("calendar_wait"):
+                    calendar_button = WebDriverWait(self.driver, 5).until(
+                        EC.element_to_be_clickable((By.ID, "cy-datePicker__toggle"))
+                    )
+                    self.driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", calendar_button)
+                    time.sleep(1)
+                    calendar_button.click()
+                break
+            except TimeoutException:
+                continue
+        else:
             logger.info("Hut not found (no calendar), break")
             return None, "Error: Not in system!"
 
@@ -226,37 +247,21 @@ class AvailabilityChecker:
         avail_on_date = {}
 
         for month in range(num_months):
-            # Wait for the calendar to load
-            self.wait.until(EC.presence_of_all_elements_located((By.CLASS_NAME, "mat-calendar-body-cell-content")))
-
-            # Extract calendar data
-            calendar_cells = self.driver.find_elements(By.CLASS_NAME, "mat-calendar-body-cell-content")
-
-            for i, cell in enumerate(calendar_cells):
-                date_number_text = cell.text.strip()
-
-                if i == 0:
-                    date_text = (
-                        cell.find_element(By.XPATH, "//button[contains(@class, 'custom-date')]")
-                        .get_attribute("class")
-                        .split("custom-date ")[-1]
-                    )
-                else:
-                    date_text = date_number_text.zfill(2) + date_text[2:]
-
-                try:
-                    availability_count_cell = cell.find_element(
-                        By.XPATH, "./following-sibling::div[contains(@class, 'custom-preview')]"
-                    )
-                    availability_count = availability_count_cell.text.strip()
-
-                except Exception:
-                    availability_count = -1
-
-                # save in dictionary
-                avail_on_date[date_text] = availability_count
-
-                logger.debug(f"{date_text}: {availability_count}")
+            if month not in skip_months:
+                tic_month = time.perf_counter()
+                for attempt in range(CALENDAR_ATTEMPTS):
+                    try:
+                        avail_in_month = self.extract_calendar_month(capture_name=f"calendar_{hut_id}_{month}")
+                        break
+                    except TimeoutException:
+                        if attempt == CALENDAR_ATTEMPTS - 1:
+                            raise
+                        self.telemetry.count("retries")
+                        logger.info(f"Calendar month {month} of hut {hut_id} did not load, retrying")
+                self.telemetry.record_month(time.perf_counter() - tic_month, len(avail_in_month))
+                avail_on_date.update(avail_in_month)
+                if on_month is not None:
+                    on_month(avail_in_month)
 
             if month < num_months - 1:
                 # Click the 'Next month' button
@@ -267,6 +272,27 @@ class AvailabilityChecker:
 
         return avail_on_date, "Success"
 
+    def extract_calendar_month(self, capture_name: Text = "calendar") -> dict:
+        """
+        Extract the availability of all days of the month that is currently shown in the calendar.
+
+        Args:
+            capture_name: file name (without extension) of the calendar HTML in the capture_dir
+
+        Returns:
+            places by date (dd.mm.yyyy), -1 for days without places shown
+        """
+        # Wait for the calendar to load
+        self.wait.until(EC.presence_of_all_elements_located((By.CLASS_NAME, "mat-calendar-body-cell-content")))
+
+        # one round trip to the browser for the whole month, the cells are parsed locally
+        calendar_html = self.driver.find_element(By.TAG_NAME, "mat-calendar").get_attribute("outerHTML")
+        self.capture(capture_name, calendar_html)
+        avail_in_month = availability_parser.parse_calendar_month(calendar_html)
+        for date_text, availability_count in avail_in_month.items():
+            logger.debug(f"{date_text}: {availability_count}")
+        return avail_in_month
+
     def wait_for_table_update(self, old_html: Any):
         """Wait until the table content changes compared to the previous iteration."""
         # Wait until the table content changes compared to the previous iteration
@@ -284,52 +310,29 @@ class AvailabilityChecker:
             EC.presence_of_element_located((By.CSS_SELECTOR, 'table[aria-label="Date Availability Table"]'))
         )
 
-    def get_preamble(self):
+    def get_preamble(self, hut_id: Optional[int] = None) -> Text:
         """Load preamble text from the page."""
         try:
-            # Locate all preamble sections (multiple spans)
-            preamble_elements = self.wait.until(
+            # Wait for the preamble sections (multiple spans)
+            self.wait.until(
                 EC.presence_of_all_elements_located((By.CSS_SELECTOR, "app-check-availability-step .welcomeMessage"))
             )
-
-            # Concatenate all the text content from the preamble spans
-            preamble_text = " ".join([element.text for element in preamble_elements])
-            return preamble_text
         except TimeoutException:  # Double check
             return ""
-
-    def convert_message_to_date(self, message: str):
-        """Find date in message if possible."""
-        try:
-            if "Sommersaisonstart" in message:
-                hut_open_date = message.split("Sommersaisonstart")[-1]
-                dd, mm, yy = hut_open_date.split(".")
-                date_from_msg = datetime.datetime(int(yy), int(mm), int(dd))
-                return date_from_msg
-            elif "geschlossen" in message:
-                error_parts = message.split(" ")
-                dd, mm, yy = error_parts[-2].split(".")
-                date_from_msg = datetime.datetime(int(yy), int(mm), int(dd))
-                return date_from_msg
-            elif "closed until" in message or "fino al" in message:
-                error_parts = message[:-1].split(" ")  # delete dot and divide
-                dd, mm, yy = error_parts[-1].split(".")
-                date_from_msg = datetime.datetime(int(yy), int(mm), int(dd))
-                return date_from_msg
-            elif ("bewarteten" in message and "unbewarteten" in message) or (
-                "unserviced" in message and "serviced" in message
-            ):
-                for yy in np.arange(2025, 2030, 1):
-                    str_yy = f".{yy}"
-                    # iterate over all years to make it work also for the next years
-                    if str_yy in message:
-                        date_part = (message.split(str_yy)[0]).split(" ")[-1]
-                        dd, mm = date_part.split(".")
-                        date_from_msg = datetime.datetime(int(yy), int(mm), int(dd))
-                        return date_from_msg
-        except ValueError:
-            pass
-        return None
+        step_html = self.driver.find_element(By.TAG_NAME, "app-check-availability-step").get_attribute("outerHTML")
+        self.capture(f"preamble_{hut_id}", step_html)
+        return availability_parser.parse_preamble(step_html)
+
+    def convert_message_to_date(self, message: str) -> Optional[datetime.datetime]:
+        """Find date in message if possible (see availability_parser.convert_message_to_date)."""
+        return availability_parser.convert_message_to_date(message)
+
+    def capture(self, name: Text, page_html: Text) -> None:
+        """Save acquired HTML to the capture_dir (if set) as <name>.html."""
+        if self.capture_dir is None:
+            return
+        with open(os.path.join(self.capture_dir, f"{name}.html"), "w", encoding="utf-8") as outfile:
+            outfile.write(page_html)
 
     def clear_input_field(self, element: Any):
         """Clears the input field by selecting all text and deleting it."""
@@ -46,14 +46,16 @@ if __name__ == "__main__":
         hut_name = row["name"]
         hut_id = row["id"]
 
-        out_df = checker(hut_id, start_date, biweeks_ahead=num_weeks_to_process)
-        if len(out_df) > 0:
-            out_df.index.name = "room_type"
-            out_df.reset_index(inplace=True)
-            out_df["hut_name"] = hut_name
+        end_date = start_date + datetime.timedelta(weeks=num_weeks_to_process)
+        result_for_hut, status = checker(hut_id, start_date, end_date)
+        if status != "Success":
+            print(f"{hut_name}: {status}")
+            continue
+        out_df = pd.DataFrame(result_for_hut, index=[hut_id])
+        out_df["hut_name"] = hut_name
         # # uncomment to save hut results as separate files
         # out_df.to_csv(f"outputs_new/{hut_id}.csv")
         all_avail.append(out_df)
     all_avail = pd.concat(all_avail)
     all_avail.to_csv(os.path.join("data", "demo_result.csv"))
-    checker.close()
+    checker.quit()
@@ -6,7 +6,9 @@ from datetime import datetime, timedelta
 import geopandas as gpd
 import numpy as np
 import pandas as pd
-from haversine import haversine
+from haversine import haversine, haversine_vector
+
+from metrics import METRICS
 
 DATE_FORMAT_IN, DATE_FORMAT_OUT = "%Y-%m-%d", "%d.%m.%Y"
 
@@ -85,19 +87,105 @@ def filter_huts(
     return huts_filtered
 
 
+def filter_huts_batch(huts: gpd.GeoDataFrame, queries: list[dict]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluate the filters of many queries at once on the hut arrays (same conditions as filter_huts).
+
+    Args:
+        huts: gpd.GeoDataFrame containing all hut information
+        queries: keyword arguments of filter_huts per query (start_lat, start_lon, min_distance, max_distance,
+            min_altitude, max_altitude, min_places, max_places)
+
+    Returns:
+        boolean mask (queries x huts) of the huts that pass the filters of each query, and the beeline distances
+        in km (queries x huts) from the start of each query, NaN for queries without a distance filter
+    """
+    nr_queries = len(queries)
+
+    def query_column(key: str, default: float) -> np.ndarray:
+        return np.array([query.get(key, default) for query in queries], dtype=float)[:, None]
+
+    altitude = huts["altitude_m"].to_numpy(dtype=float)[None, :]
+    places = huts["total_places"].to_numpy(dtype=float)[None, :]
+    with np.errstate(invalid="ignore"):
+        mask = (
+            (altitude >= query_column("min_altitude", 0))
+            & (altitude < query_column("max_altitude", np.inf))
+            & (places >= query_column("min_places", 0))
+            & (places < query_column("max_places", np.inf))
+        )
+
+    distances = np.full((nr_queries, len(huts)), np.nan)
+    min_distance, max_distance = query_column("min_distance", 0), query_column("max_distance", np.inf)
+    with_distance = np.array(
+        [
+            query.get("start_lat") is not None and (min_distance[i, 0] > 0 or max_distance[i, 0] < np.inf)
+            for i, query in enumerate(queries)
+        ],
+        dtype=bool,
+    )
+    if with_distance.any():
+        starts = np.array([[queries[i]["start_lat"], queries[i]["start_lon"]] for i in np.nonzero(with_distance)[0]])
+        hut_coordinates = huts[["latitude", "longitude"]].to_numpy(dtype=float)
+        distances[with_distance] = haversine_vector(hut_coordinates, starts, comb=True)
+        with np.errstate(invalid="ignore"):
+            in_range = (distances <= max_distance) & (distances >= min_distance)
+        mask[with_distance] &= in_range[with_distance]
+    return mask, distances
+
+
 def multi_day_route_finding(
     date_list: list[str],
     avail_per_date: pd.DataFrame,
     id_to_hut: dict,
     require_unique_huts: bool = True,
     max_dist_between_huts: int = -1,
+    feasible_connections: pd.DataFrame = None,
+    start_hut_id: int = None,
+    end_hut_id: int = None,
+    round_trip: bool = False,
 ) -> pd.DataFrame:
-    """Find all possible combinations of huts for multiple days."""
+    """
+    Find all possible combinations of huts for multiple days.
+
+    Args:
+        date_list: list of dates of the trip (in DATE_FORMAT_OUT)
+        avail_per_date: available places per hut (index) and date (columns), NaN if not available
+        id_to_hut: mapping from hut id to hut name
+        require_unique_huts: whether to remove routes that visit the same hut twice
+        max_dist_between_huts: maximum distance (in meters) between two consecutive huts, -1 for no limit
+        feasible_connections: connection table (index id_source, columns id_target and distance).
+            Defaults to the connections in data/feasible_connections.csv
+        start_hut_id: hut of the first night (optional)
+        end_hut_id: hut of the last night (optional)
+        round_trip: whether the last night is in the start hut (requires start_hut_id)
+
+    Returns:
+        pd.DataFrame with one row per possible route
+    """
+    if feasible_connections is None:
+        feasible_connections = FEASIBLE_CONNECTIONS
+    # only the distance is used for the search (trail connections also have an ascent column)
+    feasible_connections = feasible_connections[["id_target", "distance"]]
     # filter feasible connections by the ones that are short enough
     if max_dist_between_huts > 0:
-        feasible_connections = FEASIBLE_CONNECTIONS[FEASIBLE_CONNECTIONS["distance"] <= max_dist_between_huts]
+        feasible_connections = feasible_connections[feasible_connections["distance"] <= max_dist_between_huts]
     else:
-        feasible_connections = FEASIBLE_CONNECTIONS.copy()
+        feasible_connections = feasible_connections.copy()
+
+    if round_trip:
+        assert start_hut_id is not None, "A round trip requires a start hut"
+        end_hut_id = start_hut_id
+    if start_hut_id is not None or end_hut_id is not None:
+        return constrained_route_finding(
+            date_list,
+            avail_per_date,
+            id_to_hut,
+            feasible_connections,
+            start_hut_id=start_hut_id,
+            end_hut_id=end_hut_id,
+            require_unique_huts=require_unique_huts,
+        )
 
     col_names, trip_options = [], pd.DataFrame()
     for i, current_date in enumerate(date_list):
@@ -108,7 +196,8 @@ def multi_day_route_finding(
         avail_current_day = avail_per_date[[current_date]].dropna().rename({current_date: f"places_day{i}"}, axis=1)
         # print(f"Avail on day {i}: {len(avail_current_day)}")
 
-        avail_current_day[f"name_day{i}"] = id_to_hut
+        # map instead of assigning the dict (assigning a dict to an empty frame adds one row per hut)
+        avail_current_day[f"name_day{i}"] = avail_current_day.index.map(id_to_hut)
 
         # for last hut: special case, just filter availability, then stop
         if i == len(date_list) - 1:
@@ -131,17 +220,253 @@ def multi_day_route_finding(
         # rename columns
         trip_options.rename({"id_target": f"day{i+1}", "distance": f"distance_day{i+1}"}, axis=1, inplace=True)
         col_names.append(f"distance_day{i+1}")
-        # print(f"Total options after day {i}: {len(trip_options)}")
+        if require_unique_huts:
+            # drop partial routes that go back to a hut of an earlier night before they are expanded further, so that
+            # the search only expands routes with unique huts (at most the routes counted in route_planner.py)
+            next_huts = trip_options[f"day{i+1}"].to_numpy()
+            revisits = np.zeros(len(trip_options), dtype=bool)
+            for j in range(i + 1):
+                revisits |= trip_options[f"day{j}"].to_numpy() == next_huts
+            trip_options = trip_options[~revisits]
+        METRICS.observe_rows("trip_options", len(trip_options), day=str(i))
     trip_options = trip_options[col_names]
 
     if require_unique_huts:
         trip_options = trip_options[
             trip_options[[c for c in col_names if c.startswith("day")]].nunique(axis=1) == len(date_list)
         ]
+    METRICS.observe_rows("trip_options", len(trip_options), day="final")
 
     return trip_options
 
 
+def constrained_route_finding(
+    date_list: list[str],
+    avail_per_date: pd.DataFrame,
+    id_to_hut: dict,
+    feasible_connections: pd.DataFrame,
+    start_hut_id: int = None,
+    end_hut_id: int = None,
+    require_unique_huts: bool = True,
+) -> pd.DataFrame:
+    """
+    Find all routes with a fixed start and/or end hut by meet-in-the-middle search.
+
+    Routes are expanded forward from the start hut and backward from the end hut over the connections between huts
+    that are available on consecutive days, and the two partial routes are joined on the hut of the middle day.
+    Each side only enumerates routes that are reachable from its fixed hut, instead of all routes of the trip.
+
+    Args:
+        date_list: list of dates of the trip (in DATE_FORMAT_OUT)
+        avail_per_date: available places per hut (index) and date (columns), NaN if not available
+        id_to_hut: mapping from hut id to hut name
+        feasible_connections: connection table (index id_source, columns id_target and distance)
+        start_hut_id: hut of the first night (None: any hut)
+        end_hut_id: hut of the last night (None: any hut), equal to start_hut_id for round trips
+        require_unique_huts: whether to remove routes that visit the same hut twice (except for the return to the
+            start hut of a round trip)
+
+    Returns:
+        pd.DataFrame with one row per route, with the same columns as multi_day_route_finding
+    """
+    nr_days = len(date_list)
+    places = avail_per_date.reindex(columns=date_list)
+    available = [set(places.index[places[date].notna()]) for date in date_list]
+    connections = feasible_connections.reset_index(names="id_source")[["id_source", "id_target", "distance"]]
+
+    def transitions(i: int) -> pd.DataFrame:
+        """Connections from a hut available on day i to a hut available on day i + 1."""
+        edges = connections[
+            connections["id_source"].isin(available[i]) & connections["id_target"].isin(available[i + 1])
+        ]
+        return edges.rename(
+            {"id_source": f"day{i}", "id_target": f"day{i + 1}", "distance": f"distance_day{i + 1}"}, axis=1
+        )
+
+    # the side with a fixed hut expands towards the middle, if both are fixed they meet at the middle day
+    if start_hut_id is not None and end_hut_id is not None:
+        middle_day = (nr_days - 1) // 2
+    elif start_hut_id is not None:
+        middle_day = nr_days - 1
+    else:
+        middle_day = 0
+
+    if start_hut_id is not None:
+        forward = pd.DataFrame({"day0": [start_hut_id] if start_hut_id in available[0] else []}, dtype=int)
+    else:
+        forward = pd.DataFrame({"day0": sorted(available[0])}, dtype=int)
+    for i in range(middle_day):
+        forward = forward.merge(transitions(i), on=f"day{i}", how="inner")
+
+    last_day = nr_days - 1
+    if end_hut_id is not None:
+        backward = pd.DataFrame(
+            {f"day{last_day}": [end_hut_id] if end_hut_id in available[last_day] else []}, dtype=int
+        )
+    else:
+        backward = pd.DataFrame({f"day{last_day}": sorted(available[last_day])}, dtype=int)
+    for i in range(last_day - 1, middle_day - 1, -1):
+        backward = transitions(i).merge(backward, on=f"day{i + 1}", how="inner")
+
+    trip_options = forward.merge(backward, on=f"day{middle_day}", how="inner")
+    METRICS.observe_rows("trip_options", len(trip_options), day="final")
+
+    # add names and places
+    for i, date in enumerate(date_list):
+        trip_options[f"name_day{i}"] = trip_options[f"day{i}"].map(id_to_hut)
+        trip_options[f"places_day{i}"] = trip_options[f"day{i}"].map(places[date])
+
+    col_names = []
+    for i in range(nr_days):
+        col_names.extend([f"day{i}", f"name_day{i}", f"places_day{i}"])
+        if i < nr_days - 1:
+            col_names.append(f"distance_day{i + 1}")
+    trip_options = trip_options[col_names]
+
+    if require_unique_huts:
+        day_cols = [f"day{i}" for i in range(nr_days)]
+        if start_hut_id is not None and start_hut_id == end_hut_id:
+            # round trip: the last hut is the start hut, all others must be unique
+            day_cols = day_cols[:-1]
+        trip_options = trip_options[trip_options[day_cols].nunique(axis=1) == len(day_cols)]
+    return trip_options
+
+
+def flexible_start_route_finding(
+    date_list: list[str],
+    avail_per_date: pd.DataFrame,
+    id_to_hut: dict,
+    nr_days: int,
+    require_unique_huts: bool = True,
+    max_dist_between_huts: int = -1,
+    feasible_connections: pd.DataFrame = None,
+) -> pd.DataFrame:
+    """
+    Find all routes of nr_days consecutive days that start on any date of date_list and end within it.
+
+    The connections between huts available on consecutive dates are computed once and shared by all start dates.
+    A dynamic program over (date, remaining days) then marks the huts from which a route can still be completed,
+    so that the routes of every start date are expanded only along connections that lead to a complete route.
+
+    Args:
+        date_list: consecutive dates (in DATE_FORMAT_OUT) in which the trips take place
+        avail_per_date: available places per hut (index) and date (columns), NaN if not available
+        id_to_hut: mapping from hut id to hut name
+        nr_days: number of days (nights) of the trip
+        require_unique_huts: whether to remove routes that visit the same hut twice
+        max_dist_between_huts: maximum distance (in meters) between two consecutive huts, -1 for no limit
+        feasible_connections: connection table (index id_source, columns id_target and distance).
+            Defaults to the connections in data/feasible_connections.csv
+
+    Returns:
+        pd.DataFrame with one row per route, with a column start_date and the columns of multi_day_route_finding
+    """
+    if feasible_connections is None:
+        feasible_connections = FEASIBLE_CONNECTIONS
+    connections = feasible_connections.reset_index(names="id_source")[["id_source", "id_target", "distance"]]
+    if max_dist_between_huts > 0:
+        connections = connections[connections["distance"] <= max_dist_between_huts]
+
+    col_names = ["start_date"]
+    for i in range(nr_days):
+        col_names.extend([f"day{i}", f"name_day{i}", f"places_day{i}"])
+        if i < nr_days - 1:
+            col_names.append(f"distance_day{i + 1}")
+    nr_dates = len(date_list)
+    if nr_days < 1 or nr_days > nr_dates:
+        return pd.DataFrame(columns=col_names)
+
+    places = avail_per_date.reindex(columns=date_list)
+    available = [places.index[places[date].notna()] for date in date_list]
+    # connections between huts that are available on two consecutive dates, shared by all overlapping trips
+    transitions = [
+        connections[connections["id_source"].isin(available[d]) & connections["id_target"].isin(available[d + 1])]
+        for d in range(nr_dates - 1)
+    ]
+    # completable[(d, k)]: huts available on date d from which the route can be continued for k more nights
+    completable = {(d, 0): available[d] for d in range(nr_dates)}
+    for k in range(1, nr_days):
+        for d in range(nr_dates - k):
+            edges = transitions[d]
+            completable[(d, k)] = pd.Index(edges["id_source"][edges["id_target"].isin(completable[(d + 1, k - 1)])])
+
+    all_routes = []
+    for start in range(nr_dates - nr_days + 1):
+        trip_options = pd.DataFrame({"day0": completable[(start, nr_days - 1)].unique()})
+        for i in range(nr_days - 1):
+            edges = transitions[start + i]
+            edges = edges[
+                edges["id_source"].isin(completable[(start + i, nr_days - 1 - i)])
+                & edges["id_target"].isin(completable[(start + i + 1, nr_days - 2 - i)])
+            ]
+            trip_options = trip_options.merge(
+                edges.rename(
+                    {"id_source": f"day{i}", "id_target": f"day{i + 1}", "distance": f"distance_day{i + 1}"}, axis=1
+                ),
+                on=f"day{i}",
+                how="inner",
+            )
+        for i in range(nr_days):
+            trip_options[f"name_day{i}"] = trip_options[f"day{i}"].map(id_to_hut)
+            trip_options[f"places_day{i}"] = trip_options[f"day{i}"].map(places[date_list[start + i]])
+        trip_options["start_date"] = date_list[start]
+        all_routes.append(trip_options[col_names])
+
+    trip_options = pd.concat(all_routes, ignore_index=True)
+    if require_unique_huts:
+        day_cols = [f"day{i}" for i in range(nr_days)]
+        trip_options = trip_options[trip_options[day_cols].nunique(axis=1) == nr_days]
+    METRICS.observe_rows("trip_options", len(trip_options), day="final")
+    return trip_options
+
+
+def find_stay_windows(
+    avail_per_date: pd.DataFrame,
+    date_list: list[str],
+    nr_nights: int,
+    min_places: int = 1,
+    start_weekdays: list[int] = None,
+) -> pd.DataFrame:
+    """
+    Find all windows of consecutive nights in which a hut has enough free places on every night.
+
+    Args:
+        avail_per_date: available places per hut (index) and date (columns), NaN if not available
+        date_list: consecutive dates (in DATE_FORMAT_OUT) that are searched
+        nr_nights: number of consecutive nights to stay in the same hut
+        min_places: minimum number of free places on every night
+        start_weekdays: only return windows starting on these weekdays (0 = Monday), e.g. [4, 5] for weekends
+
+    Returns:
+        pd.DataFrame with columns hut_id, first_night, last_night and places (minimum over the nights)
+    """
+    columns = ["hut_id", "first_night", "last_night", "places"]
+    if nr_nights < 1 or nr_nights > len(date_list) or len(avail_per_date) == 0:
+        return pd.DataFrame(columns=columns)
+
+    # hut x date array of free places (0 if not available)
+    places = avail_per_date.reindex(columns=date_list).fillna(0).to_numpy()
+    # minimum over each window of nr_nights consecutive dates: hut x window start
+    window_min = np.lib.stride_tricks.sliding_window_view(places, nr_nights, axis=1).min(axis=2)
+    feasible = window_min >= min_places
+
+    if start_weekdays is not None:
+        start_dates = [datetime.strptime(d, DATE_FORMAT_OUT) for d in date_list[: window_min.shape[1]]]
+        feasible &= np.isin([d.weekday() for d in start_dates], start_weekdays)[np.newaxis, :]
+
+    hut_index, start_index = np.nonzero(feasible)
+    dates = np.array(date_list)
+    return pd.DataFrame(
+        {
+            "hut_id": avail_per_date.index.values[hut_index],
+            "first_night": dates[start_index],
+            "last_night": dates[start_index + nr_nights - 1],
+            "places": window_min[hut_index, start_index].astype(int),
+        },
+        columns=columns,
+    )
+
+
 def generate_date_range(start_date_str: str, end_date_str: str) -> list[str]:
     """Generate all dates between a start and end date."""
 
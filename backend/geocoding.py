@@ -0,0 +1,313 @@
+"""Geocoding of huts with a persistent cache, bounded concurrent lookups and parsing of the hut page coordinates."""
+
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Text, Tuple
+
+from pyproj import Transformer
+
+DEFAULT_CACHE_PATH = os.path.join("data", "geocode_cache.db")
+GM_KEY_PATH = "gpc_api_key.keypair"
+MAX_CONCURRENT_LOOKUPS = 8
+# queries per SELECT of cached results (below the SQLite limit of 999 variables of older versions)
+CACHE_LOOKUP_CHUNK = 500
+
+Coordinates = Tuple[float, float]
+
+CREATE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS geocode_cache (
+    query TEXT PRIMARY KEY,
+    latitude REAL,
+    longitude REAL,
+    geocoded_at REAL NOT NULL
+);
+"""
+
+# swiss grid (CH1903/LV03 and CH1903+/LV95) to WGS84, always_xy: (east, north) -> (lon, lat)
+LV03_TO_WGS84 = Transformer.from_crs(21781, 4326, always_xy=True)
+LV95_TO_WGS84 = Transformer.from_crs(2056, 4326, always_xy=True)
+# bounding box of the huts of the alpine clubs (Alps and German low mountain ranges) for plausibility checks
+LAT_RANGE, LON_RANGE = (43, 55), (4, 18)
+# quote-like characters that are used as minute and second signs or as thousands separators on the hut pages
+QUOTE_TABLE = str.maketrans({c: "'" for c in "′‘’´`?*"} | {c: '"' for c in "″“”"})
+# labels of latitude and longitude, a coordinate of degrees, minutes and seconds starts or ends at a label
+_LABEL = r"(?<![a-zä])(?:n|e|o|nord|ost|lat|lon|long|log|breitengrad|längengrad)(?![a-zä])"
+_ANGLE_TOKEN = re.compile(rf"(\d+(?:[.,]\d+)?)|(°)|({_LABEL})")
+# degrees, minutes and seconds separated by dots ("47.03.18 12.17.53")
+_DOTTED_ANGLE = re.compile(r"(?<![\d.])(\d{1,2})\.(\d{2})\.(\d{2}(?:,\d+)?)(?![\d.])")
+# grid numbers with apostrophes or dots as thousands separators ("2'628'518.938", "5.231.585") or plain numbers
+_GRID_NUMBER = re.compile(r"\d{1,3}(?:'\d{3})+(?:[.,]\d+)?|\d{1,3}(?:\.\d{3})+(?!\d)|\d+(?:[.,]\d+)?")
+# UTM zone, e.g. "32t" or "33 t"
+_UTM_ZONE = re.compile(r"(?<!\d)(3[1-4]) ?[tu](?![a-z])")
+
+
+def normalize_query(query: Text) -> Text:
+    """Normalize a geocoding query (unicode, case, whitespace, separators), used as cache key."""
+    query = unicodedata.normalize("NFC", query).lower()
+    query = re.sub(r"\s*,\s*", ", ", query)
+    return re.sub(r"\s+", " ", query).strip(" ,")
+
+
+class Geocoder(ABC):
+    """Interface of geocoders: map a query to coordinates."""
+
+    @abstractmethod
+    def geocode(self, query: Text) -> Optional[Coordinates]:
+        """
+        Geocode a query.
+
+        Args:
+            query: place name
+
+        Returns:
+            tuple of latitude and longitude, None if the place was not found
+        """
+
+
+class GoogleMapsGeocoder(Geocoder):
+    """Geocoder using the Google Maps API. The client (and the API key) is only loaded on the first lookup."""
+
+    def __init__(self, key_path: Text = GM_KEY_PATH) -> None:
+        self.key_path = key_path
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> object:
+        """Google Maps client, created on first use."""
+        with self._lock:
+            if self._client is None:
+                from googlemaps import Client as GoogleMaps
+
+                with open(self.key_path, "r") as infile:
+                    self._client = GoogleMaps(infile.read().strip())
+        return self._client
+
+    def geocode(self, query: Text) -> Optional[Coordinates]:
+        """Geocode a query with the Google Maps API."""
+        results = self.client.geocode(query)
+        if len(results) == 0:
+            return None
+        location = results[0]["geometry"]["location"]
+        return location["lat"], location["lng"]
+
+
+class StaticGeocoder(Geocoder):
+    """Local stand-in geocoder with fixed coordinates per query, for offline builds and tests."""
+
+    def __init__(self, coordinates: Dict[Text, Coordinates]) -> None:
+        self.coordinates = {normalize_query(query): coords for query, coords in coordinates.items()}
+        self.nr_lookups = 0
+
+    def geocode(self, query: Text) -> Optional[Coordinates]:
+        """Look up the coordinates of a query."""
+        self.nr_lookups += 1
+        return self.coordinates.get(normalize_query(query))
+
+
+class GeocodeCache:
+    """SQLite cache of geocoding results by normalized query. Queries that were not found are cached as well."""
+
+    def __init__(self, path: Text = DEFAULT_CACHE_PATH) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(CREATE_TABLE_QUERY)
+        self.conn.commit()
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self.conn.close()
+
+    def get_many(self, queries: Iterable[Text]) -> Dict[Text, Optional[Coordinates]]:
+        """
+        Cached results of normalized queries.
+
+        Returns:
+            coordinates by query (None if the query was not found), only for queries that are in the cache
+        """
+        queries = list(dict.fromkeys(queries))
+        results = {}
+        for start in range(0, len(queries), CACHE_LOOKUP_CHUNK):
+            chunk = queries[start : start + CACHE_LOOKUP_CHUNK]
+            rows = self.conn.execute(
+                "SELECT query, latitude, longitude FROM geocode_cache "
+                f"WHERE query IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            for query, lat, lng in rows:
+                results[query] = None if lat is None else (lat, lng)
+        return results
+
+    def put(self, query: Text, coordinates: Optional[Coordinates]) -> None:
+        """Store the result of a normalized query."""
+        lat, lng = coordinates if coordinates is not None else (None, None)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO geocode_cache (query, latitude, longitude, geocoded_at) VALUES (?, ?, ?, ?)",
+            (query, lat, lng, time.time()),
+        )
+        self.conn.commit()
+
+
+def geocode_queries(
+    queries: Iterable[Text],
+    geocoder: Geocoder,
+    cache: GeocodeCache = None,
+    max_workers: int = MAX_CONCURRENT_LOOKUPS,
+) -> Dict[Text, Optional[Coordinates]]:
+    """
+    Geocode queries, using cached results and at most `max_workers` concurrent lookups for the others.
+
+    Failed lookups (exceptions, e.g. network errors) are not cached, so that they are retried in the next run.
+
+    Args:
+        queries: place names
+        geocoder: geocoder for queries that are not cached
+        cache: persistent cache (optional)
+        max_workers: maximum number of concurrent lookups
+
+    Returns:
+        coordinates by normalized query, None if not found
+    """
+    unique_queries = sorted({normalize_query(query) for query in queries})
+    results = cache.get_many(unique_queries) if cache is not None else {}
+    missing = [query for query in unique_queries if query not in results]
+
+    def lookup(query: Text) -> Tuple[Optional[Coordinates], bool]:
+        try:
+            return geocoder.geocode(query), True
+        except Exception as e:
+            print(f"Geocoding failed for {query}: {e}")
+            return None, False
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for query, (coordinates, succeeded) in zip(missing, executor.map(lookup, missing), strict=True):
+            results[query] = coordinates
+            if succeeded and cache is not None:
+                cache.put(query, coordinates)
+    return results
+
+
+def _plausible(first: float, second: float) -> Optional[Coordinates]:
+    """Latitude and longitude of two decimal degrees in either order, None if neither order lies in the region."""
+    for lat, lon in [(first, second), (second, first)]:
+        if LAT_RANGE[0] <= lat <= LAT_RANGE[1] and LON_RANGE[0] <= lon <= LON_RANGE[1]:
+            return lat, lon
+    return None
+
+
+def _angle(numbers: List[Text]) -> Optional[float]:
+    """Decimal degrees of degrees and optional (decimal) minutes and seconds, None if they are not valid."""
+    if not 1 <= len(numbers) <= 3:
+        return None
+    parts = [float(number.replace(",", ".")) for number in numbers]
+    if any(part >= 60 for part in parts[1:]):
+        return None
+    return sum(part / 60**i for i, part in enumerate(parts))
+
+
+def _parse_angles(text: Text) -> Optional[Coordinates]:
+    """Parse decimal degrees or degrees, minutes and seconds, labeled (n/e/o, lat/lon, ...) or not, in any order."""
+    text = _DOTTED_ANGLE.sub(r"\1°\2'\3", text)
+    # split at the labels, then before the degrees of each coordinate ("47°41'35.2"n 12°58'50.3"e")
+    segments, current = [], []
+    for number, degree_sign, label in _ANGLE_TOKEN.findall(text):
+        if label:
+            segments.append(current)
+            current = []
+        elif degree_sign:
+            current.append("°")
+        else:
+            current.append(number)
+    segments.append(current)
+    groups = []
+    for segment in segments:
+        if "°" not in segment:
+            # without labels and degree signs, two plain numbers are decimal degrees ("46.510228 / 7.771708")
+            groups.extend([[number] for number in segment] if len(segments) == 1 and len(segment) == 2 else [segment])
+            continue
+        # numbers before the first degrees (e.g. "wgs84") are dropped
+        starts = [i - 1 for i, token in enumerate(segment) if token == "°" and i > 0]
+        for start, end in zip(starts, starts[1:] + [len(segment)], strict=True):
+            groups.append([token for token in segment[start:end] if token != "°"])
+    groups = [group for group in groups if len(group) > 0]
+    if len(groups) < 2:
+        return None
+    first, second = _angle(groups[0]), _angle(groups[1])
+    if first is None or second is None:
+        return None
+    return _plausible(first, second)
+
+
+@functools.lru_cache(maxsize=None)
+def _utm_to_wgs84(zone: int) -> Transformer:
+    # WGS84 / UTM zone <zone>N, always_xy: (east, north) -> (lon, lat)
+    return Transformer.from_crs(32600 + zone, 4326, always_xy=True)
+
+
+def _parse_grid(text: Text) -> Optional[Coordinates]:
+    """Parse Swiss grid (LV03, LV95) or UTM coordinates with a zone, in either order."""
+    # remove spaces used as thousands separators ("767 325 / 131 325")
+    text = re.sub(r"(?<=\d) (?=\d{3}\b)", "", text)
+    values = []
+    for number in _GRID_NUMBER.findall(text):
+        if "'" in number:
+            number = number.replace("'", "")
+        elif re.fullmatch(r"\d{1,3}(\.\d{3})+", number):
+            number = number.replace(".", "")
+        values.append(float(number.replace(",", ".")))
+    grid = [value for value in values if value >= 10_000][:2]
+    if len(grid) < 2:
+        return None
+    low, high = min(grid), max(grid)
+    # in the swiss grids, the east coordinate is the larger one
+    if 480_000 <= high <= 840_000 and 70_000 <= low <= 300_000:
+        lon, lat = LV03_TO_WGS84.transform(high, low)
+        return lat, lon
+    if 2_480_000 <= high <= 2_840_000 and 1_070_000 <= low <= 1_300_000:
+        lon, lat = LV95_TO_WGS84.transform(high, low)
+        return lat, lon
+    # UTM: the easting has the zone given separately ("32t") or as prefix ("32.687.070"), the northing is larger
+    zone_match = _UTM_ZONE.search(text)
+    zone = int(zone_match.group(1)) if zone_match is not None else None
+    east, north = low, high
+    if 31_000_000 <= high < 35_000_000:
+        zone, east, north = int(high // 1_000_000), high % 1_000_000, low
+    if not 4_800_000 <= north <= 5_900_000:
+        return None
+    # the zone cannot be guessed: eastings of Austrian huts are valid in zone 32 and 33
+    if zone is None or not 100_000 <= east <= 900_000:
+        return None
+    lon, lat = _utm_to_wgs84(zone).transform(east, north)
+    return _plausible(lat, lon)
+
+
+def parse_page_coordinates(text: Text) -> Optional[Coordinates]:
+    """
+    Parse the coordinates field of a hut page.
+
+    Recognized are decimal degrees and degrees with (decimal) minutes and seconds, with or without hemisphere and
+    lat/lon labels before or after the numbers, Swiss grid (LV03 and LV95, with apostrophes, dots or spaces as
+    thousands separators) and UTM with a zone. UTM without a zone and placeholders ("xxx.xxx / yyy.yyy") give None.
+
+    Args:
+        text: coordinates field, e.g. "625.565 / 151.040", "2'628'518.938 / 1'151'333.890", "46.510228 / 7.771708",
+            "47.509660 n / 10.057730 e", "n 47° 42' 16", e 12° 14' 36"" or "utm 32t ost: 0639041, utm nord: 5190514"
+
+    Returns:
+        tuple of latitude and longitude, None if the format is not recognized
+    """
+    if not isinstance(text, str):
+        return None
+    text = unicodedata.normalize("NFC", text).lower().translate(QUOTE_TABLE)
+    if "utm" not in text:
+        coordinates = _parse_angles(text)
+        if coordinates is not None:
+            return coordinates
+    return _parse_grid(text)
@@ -0,0 +1,104 @@
+"""Multi-resolution grid over the hut coordinates for viewport queries with marker clustering."""
+
+from typing import Dict, List, Text, Tuple
+
+import numpy as np
+import pandas as pd
+
+# size of a grid cell in screen pixels (256 pixels per web mercator tile)
+CELL_PIXELS = 64
+# up to this zoom level, huts are clustered per cell; above it single huts are returned
+MAX_CLUSTER_ZOOM = 10
+# fields of the slim per-hut records
+HUT_FIELDS = ["id", "name", "latitude", "longitude", "altitude_m"]
+
+
+def mercator_cells(latitude: np.ndarray, longitude: np.ndarray, zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Grid cell (x, y) of coordinates in the web mercator grid of a zoom level.
+
+    Args:
+        latitude: latitudes in degrees
+        longitude: longitudes in degrees
+        zoom: zoom level (as in the map tiles)
+
+    Returns:
+        tuple of cell x and cell y indices (y increases towards the south)
+    """
+    cells_per_axis = 2**zoom * (256 // CELL_PIXELS)
+    lat_rad = np.radians(np.clip(latitude, -85.05, 85.05))
+    x = (np.asarray(longitude) + 180) / 360 * cells_per_axis
+    y = (1 - np.log(np.tan(lat_rad) + 1 / np.cos(lat_rad)) / np.pi) / 2 * cells_per_axis
+    return np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+
+
+class HutGrid:
+    """Clusters of huts per grid cell for every zoom level, precomputed once for the hut database."""
+
+    def __init__(self, huts: pd.DataFrame, max_cluster_zoom: int = MAX_CLUSTER_ZOOM) -> None:
+        """
+        Precompute the clusters of all zoom levels.
+
+        Args:
+            huts: hut database with columns id, name, latitude, longitude and altitude_m
+            max_cluster_zoom: highest zoom level with clusters
+        """
+        self.max_cluster_zoom = max_cluster_zoom
+        huts = huts.dropna(subset=["latitude", "longitude"])
+        self.huts = pd.DataFrame(huts[HUT_FIELDS]).reset_index(drop=True)
+        self.huts["altitude_m"] = self.huts["altitude_m"].astype(float)
+        latitude, longitude = self.huts["latitude"].to_numpy(), self.huts["longitude"].to_numpy()
+
+        self.levels: Dict[int, pd.DataFrame] = {}
+        for zoom in range(max_cluster_zoom + 1):
+            cell_x, cell_y = mercator_cells(latitude, longitude, zoom)
+            cells = pd.DataFrame(
+                {
+                    "cell_x": cell_x,
+                    "cell_y": cell_y,
+                    "latitude": latitude,
+                    "longitude": longitude,
+                    "hut": self.huts.index,
+                }
+            )
+            self.levels[zoom] = (
+                cells.groupby(["cell_x", "cell_y"])
+                .agg(
+                    count=("hut", "size"),
+                    latitude=("latitude", "mean"),
+                    longitude=("longitude", "mean"),
+                    hut=("hut", "first"),
+                )
+                .reset_index()
+            )
+
+    def query(self, south: float, west: float, north: float, east: float, zoom: int) -> Dict[Text, List[Dict]]:
+        """
+        Clusters and huts within a bounding box.
+
+        Args:
+            south: southern latitude of the viewport
+            west: western longitude of the viewport
+            north: northern latitude of the viewport
+            east: eastern longitude of the viewport
+            zoom: zoom level of the map
+
+        Returns:
+            dict with "clusters" (latitude, longitude and count of cells with several huts) and "markers" (slim
+            records of single huts). Above the highest cluster zoom, all huts in the viewport are markers.
+        """
+        zoom = max(int(zoom), 0)
+        if zoom > self.max_cluster_zoom:
+            huts = self.huts
+            in_box = huts["latitude"].between(south, north) & huts["longitude"].between(west, east)
+            return {"clusters": [], "markers": huts[in_box].to_dict(orient="records")}
+
+        cells = self.levels[zoom]
+        (x_min, x_max), (y_max, y_min) = mercator_cells(np.array([south, north]), np.array([west, east]), zoom)
+        visible = cells[cells["cell_x"].between(x_min, x_max) & cells["cell_y"].between(y_min, y_max)]
+        clusters = visible[visible["count"] > 1]
+        singles = visible[visible["count"] == 1]
+        return {
+            "clusters": clusters[["latitude", "longitude", "count"]].to_dict(orient="records"),
+            "markers": self.huts.loc[singles["hut"]].to_dict(orient="records"),
+        }
@@ -0,0 +1,229 @@
+"""
+Load test for the flask API against a local SQLite stand-in of the hut_availability table.
+
+The stand-in is seeded from data/availability.csv, the app is served by a single waitress server and a replayable
+request mix is sent to /api/submit and /api/multi_day with a configurable number of concurrent clients. Run from
+the backend folder:
+
+    python load_test.py --requests 500 --concurrency 8 --mix-file load_test_mix.jsonl
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+
+import geopandas as gpd
+import numpy as np
+import requests
+
+import synthetic_data
+from filtering import DATE_FORMAT_IN, DATE_FORMAT_OUT
+
+# same columns as the postgres table (see availability_db.py), without partitioning
+CREATE_TABLE_QUERY = """
+CREATE TABLE hut_availability (
+    hut_id INT NOT NULL,
+    date TEXT NOT NULL,
+    avail_date TEXT NOT NULL,
+    places_avail INT NOT NULL,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (hut_id, avail_date)
+);
+"""
+# share of each request type in the generated mix
+REQUEST_MIX_WEIGHTS = {"submit_date": 0.6, "submit": 0.2, "multi_day": 0.2}
+PERCENTILES = (50, 95, 99)
+
+
+def seed_sqlite_store(db_path: str) -> List[str]:
+    """
+    Create a SQLite hut_availability table seeded with the checked-in availability.
+
+    Args:
+        db_path: path of the SQLite file (overwritten if it exists)
+
+    Returns:
+        Sorted list of dates (DATE_FORMAT_OUT) that are contained in the table
+    """
+    availability = synthetic_data.load_checked_in_availability()
+    availability["avail_date"] = [
+        datetime.strptime(d, DATE_FORMAT_OUT).date().isoformat() for d in availability["date"]
+    ]
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(CREATE_TABLE_QUERY)
+        conn.executemany(
+            "INSERT INTO hut_availability (hut_id, date, avail_date, places_avail) VALUES (?, ?, ?, ?)",
+            availability[["hut_id", "date", "avail_date", "places_avail"]].itertuples(index=False, name=None),
+        )
+    return sorted(availability["date"].unique(), key=lambda d: datetime.strptime(d, DATE_FORMAT_OUT))
+
+
+def make_request_mix(nr_requests: int, dates: List[str], seed: int = 0) -> List[Dict]:
+    """
+    Generate a random mix of API requests around the huts in the database.
+
+    Args:
+        nr_requests: number of requests
+        dates: dates (DATE_FORMAT_OUT) for which availability is stored
+        seed: random seed
+
+    Returns:
+        List of dicts with the endpoint and the json payload of each request
+    """
+    rng = np.random.default_rng(seed)
+    huts = gpd.read_file(os.path.join("data", "huts_database.geojson")).dropna(subset=["latitude", "longitude"])
+    dates_in = [datetime.strptime(d, DATE_FORMAT_OUT).strftime(DATE_FORMAT_IN) for d in dates]
+    kinds = rng.choice(list(REQUEST_MIX_WEIGHTS), size=nr_requests, p=list(REQUEST_MIX_WEIGHTS.values()))
+
+    request_mix = []
+    for kind in kinds:
+        start_hut = huts.iloc[rng.integers(len(huts))]
+        payload = {
+            "latitude": float(start_hut["latitude"]),
+            "longitude": float(start_hut["longitude"]),
+            "minDistance": 0,
+            "maxDistance": int(rng.choice([20, 50, 100, 200])),
+            "minAltitude": int(rng.choice([0, 1000, 1500])),
+            "maxAltitude": int(rng.choice([2500, 3000, 5000])),
+        }
+        if kind == "multi_day":
+            nr_days = int(rng.integers(2, 5))
+            start_index = int(rng.integers(len(dates_in) - nr_days + 1))
+            payload.update(
+                {
+                    "startDate": dates_in[start_index],
+                    "endDate": dates_in[start_index + nr_days - 1],
+                    "minSpaces": int(rng.choice([1, 2, 4])),
+                    "maxHutDistance": int(rng.choice([8, 10, 13])),
+                }
+            )
+            request_mix.append({"endpoint": "/api/multi_day", "payload": payload})
+        else:
+            if kind == "submit_date":
+                payload["date"] = dates_in[rng.integers(len(dates_in))]
+            request_mix.append({"endpoint": "/api/submit", "payload": payload})
+    return request_mix
+
+
+def load_or_create_request_mix(mix_file: str, nr_requests: int, dates: List[str], seed: int) -> List[Dict]:
+    """Replay the request mix from a jsonl file if it exists, otherwise generate it and save it there."""
+    if mix_file is not None and os.path.exists(mix_file):
+        with open(mix_file, "r") as infile:
+            return [json.loads(line) for line in infile]
+    request_mix = make_request_mix(nr_requests, dates, seed=seed)
+    if mix_file is not None:
+        with open(mix_file, "w") as outfile:
+            for entry in request_mix:
+                outfile.write(json.dumps(entry) + "\n")
+    return request_mix
+
+
+def start_server(threads: int) -> tuple:
+    """
+    Serve the app with waitress on a free local port in a background thread.
+
+    The app module is imported here so that the database url in the environment is set beforehand.
+
+    Returns:
+        tuple of the waitress server and the base url
+    """
+    from waitress import create_server
+
+    from app import app
+
+    server = create_server(app, host="127.0.0.1", port=0, threads=threads)
+    threading.Thread(target=server.run, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.effective_port}"
+
+
+def run_load(base_url: str, request_mix: List[Dict], concurrency: int) -> tuple:
+    """
+    Send all requests of the mix with a fixed number of concurrent clients.
+
+    Returns:
+        tuple of the list of (endpoint, latency in seconds, status code) and the total wall time in seconds
+    """
+    sessions = threading.local()
+
+    def send(entry: Dict) -> tuple:
+        if not hasattr(sessions, "session"):
+            sessions.session = requests.Session()
+        tic = time.perf_counter()
+        try:
+            status = sessions.session.post(base_url + entry["endpoint"], json=entry["payload"]).status_code
+        except requests.RequestException:
+            status = -1
+        return entry["endpoint"], time.perf_counter() - tic, status
+
+    tic = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, request_mix))
+    return results, time.perf_counter() - tic
+
+
+def summarize(results: List[tuple], wall_time: float) -> Dict[str, Dict]:
+    """Compute throughput, latency percentiles (ms) and errors in total and per endpoint."""
+    summary = {}
+    endpoints = sorted({endpoint for endpoint, _, _ in results})
+    for group in ["total"] + endpoints:
+        group_results = [r for r in results if group == "total" or r[0] == group]
+        latencies = np.array([latency for _, latency, _ in group_results]) * 1000
+        summary[group] = {
+            "requests": len(group_results),
+            "errors": sum(status != 200 for _, _, status in group_results),
+            "throughput": len(group_results) / wall_time,
+            "mean_ms": float(latencies.mean()),
+            **{f"p{p}_ms": float(np.percentile(latencies, p)) for p in PERCENTILES},
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the API against a local SQLite stand-in")
+    parser.add_argument("--requests", type=int, default=300, help="number of requests in a generated mix")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of concurrent clients")
+    parser.add_argument("--threads", type=int, default=4, help="number of waitress threads (waitress default: 4)")
+    parser.add_argument("--mix-file", default=None, help="jsonl file to replay (created if it does not exist)")
+    parser.add_argument("--db-path", default=None, help="SQLite file for the stand-in (default: temporary file)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for generating the request mix")
+    parser.add_argument("--out", default=None, help="path to save the summary as json")
+    args = parser.parse_args()
+
+    db_path = args.db_path or os.path.join(tempfile.mkdtemp(), "hut_availability.db")
+    dates = seed_sqlite_store(db_path)
+    os.environ["HUTFINDER_DB_URL"] = f"sqlite:///{db_path}"
+    # empty snapshot directory, so that the app reads from the stand-in and not from a published snapshot
+    os.environ["HUTFINDER_SNAPSHOT_DIR"] = tempfile.mkdtemp()
+    # no precomputed routes (the weekend queries would be answered from the routes of the real availability)
+    os.environ["HUTFINDER_PRECOMPUTED_ROUTES"] = os.path.join(tempfile.mkdtemp(), "precomputed_routes.npz")
+
+    request_mix = load_or_create_request_mix(args.mix_file, args.requests, dates, args.seed)
+    server, base_url = start_server(args.threads)
+    # warm up (first requests pay for lazy initialization)
+    run_load(base_url, request_mix[: args.concurrency], args.concurrency)
+
+    results, wall_time = run_load(base_url, request_mix, args.concurrency)
+    server.close()
+
+    summary = summarize(results, wall_time)
+    print(f"{len(results)} requests in {wall_time:.2f}s with {args.concurrency} clients, {args.threads} threads")
+    print(
+        f"{'endpoint':<16} {'requests':>8} {'errors':>6} {'req/s':>8} "
+        + " ".join(f"{'p' + str(p):>8}" for p in PERCENTILES)
+    )
+    for group, stats in summary.items():
+        percentiles = " ".join(f"{stats[f'p{p}_ms']:>8.1f}" for p in PERCENTILES)
+        print(f"{group:<16} {stats['requests']:>8} {stats['errors']:>6} {stats['throughput']:>8.2f} {percentiles}")
+
+    if args.out is not None:
+        with open(args.out, "w") as outfile:
+            json.dump({"config": vars(args), "wall_time": wall_time, "summary": summary}, outfile, indent=2)
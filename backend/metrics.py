@@ -0,0 +1,152 @@
+"""Lightweight timing and row count instrumentation, exported in the Prometheus text format."""
+
+import contextlib
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Text, Tuple
+
+# enable collection of metrics (exposed at /metrics) and the Server-Timing response header
+METRICS_ENABLED = os.environ.get("HUTFINDER_METRICS", "0") == "1"
+SERVER_TIMING_ENABLED = os.environ.get("HUTFINDER_SERVER_TIMING", "0") == "1"
+
+PREFIX = "hutfinder"
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10_000, 100_000, 1_000_000)
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, as in the Prometheus data model."""
+
+    def __init__(self, buckets: Tuple[float]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Add a value to the histogram."""
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Thread-safe registry of histograms, keyed by metric name and labels."""
+
+    def __init__(self, enabled: bool = METRICS_ENABLED, server_timing: bool = SERVER_TIMING_ENABLED) -> None:
+        self.enabled = enabled or server_timing
+        self.export = enabled
+        self.server_timing = server_timing
+        self._histograms: Dict[Tuple[Text, Tuple], Histogram] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, name: Text, value: float, labels: Dict = None, buckets: Tuple = SECONDS_BUCKETS) -> None:
+        """
+        Add an observation to a histogram.
+
+        Args:
+            name: metric name (without prefix)
+            value: observed value
+            labels: label names and values of the series
+            buckets: upper bounds of the buckets, only used when the series is created
+        """
+        if not self.export:
+            return
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def observe_rows(self, kind: Text, nr_rows: int, **labels: Text) -> None:
+        """Record the number of rows of an intermediate result (e.g. trip options per day)."""
+        if self.export:
+            self.observe("rows", nr_rows, {"kind": kind, **labels}, buckets=ROWS_BUCKETS)
+
+    def span(self, stage: Text) -> contextlib.AbstractContextManager:
+        """
+        Context manager that times a stage of the current request.
+
+        Returns a shared no-op context manager if instrumentation is disabled.
+        """
+        if not self.enabled:
+            return _NO_SPAN
+        return self._timed_span(stage)
+
+    @contextlib.contextmanager
+    def _timed_span(self, stage: Text) -> Iterator[None]:
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - tic
+            self.observe("stage_seconds", duration, {"stage": stage})
+            if self.server_timing:
+                self.request_spans().append((stage, duration))
+
+    def start_request(self) -> None:
+        """Reset the spans that are collected for the Server-Timing header of the current thread."""
+        self._local.spans = []
+
+    def request_spans(self) -> List[Tuple[Text, float]]:
+        """Spans (stage, seconds) recorded in the current request."""
+        if not hasattr(self._local, "spans"):
+            self._local.spans = []
+        return self._local.spans
+
+    def server_timing_header(self) -> Text:
+        """Format the spans of the current request as Server-Timing header value (durations in ms)."""
+        return ", ".join(f"{stage};dur={duration * 1000:.1f}" for stage, duration in self.request_spans())
+
+    def render(self, gauges: Dict[Text, float] = None) -> Text:
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Args:
+            gauges: additional gauge values (e.g. database pool stats) by metric name
+
+        Returns:
+            text of the /metrics page
+        """
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            snapshots = [(key, list(h.buckets), list(h.counts), h.sum, h.count) for key, h in histograms]
+
+        written_types = set()
+        for (name, labels), buckets, counts, total, count in snapshots:
+            metric = f"{PREFIX}_{name}"
+            if metric not in written_types:
+                lines.append(f"# TYPE {metric} histogram")
+                written_types.add(metric)
+            label_str = ",".join(f'{key}="{value}"' for key, value in labels)
+            sep = "," if label_str else ""
+            for upper_bound, bucket_count in zip(buckets, counts, strict=True):
+                lines.append(f'{metric}_bucket{{{label_str}{sep}le="{upper_bound}"}} {bucket_count}')
+            lines.append(f'{metric}_bucket{{{label_str}{sep}le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum{{{label_str}}} {total}")
+            lines.append(f"{metric}_count{{{label_str}}} {count}")
+
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def pool_stats(engine: object) -> Dict[Text, float]:
+    """Connection pool gauges of a SQLAlchemy engine (only the stats that the pool class provides)."""
+    stats = {}
+    for stat in ["size", "checkedin", "checkedout", "overflow"]:
+        func = getattr(engine.pool, stat, None)
+        if callable(func):
+            stats[f"db_pool_{stat}"] = func()
+    return stats
+
+
+METRICS = Metrics()
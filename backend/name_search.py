@@ -0,0 +1,165 @@
+"""
+In-memory search index over hut names, vereine and sections for typeahead lookups.
+
+Texts are accent-folded ("Blüemlisalp" -> "bluemlisalp") and split into words. The words of all huts are kept in a
+sorted array, so that the words starting with a typed prefix are one contiguous range found by binary search, and a
+boolean matrix (word x hut) gives the huts of a range with one vectorized reduction. A query matches a hut if every
+query word is a prefix of one of its words (name, original name, verein or section). If fewer huts match than
+requested, huts whose names share enough trigrams with the query are appended, so that typos still find a hut.
+"""
+
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Text
+
+import numpy as np
+import pandas as pd
+
+# columns that are searched, the name column additionally ranks the matches
+SEARCH_COLUMNS = ["name", "name_original", "verein", "sektion"]
+# fields of the returned hut records
+RESULT_FIELDS = ["id", "name", "verein", "sektion", "latitude", "longitude", "altitude_m"]
+DEFAULT_LIMIT = 10
+# minimum trigram similarity (shared / all trigrams) of a fuzzy match
+FUZZY_MIN_SIMILARITY = 0.3
+# generic words of section names ("Sektion Bern" is "SAC Bern" in the data), not required to match if the query has
+# other words
+OPTIONAL_WORDS = {"sektion", "section", "sezione", "sekcija", "ev"}
+# characters that are not split into base letter and accent by the unicode decomposition
+FOLD_TABLE = str.maketrans({"ß": "ss", "æ": "ae", "ø": "o", "œ": "oe", "ł": "l", "đ": "d"})
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def fold(text: Text) -> Text:
+    """Lower case text without accents ("Capanna Basòdino" -> "capanna basodino")."""
+    decomposed = unicodedata.normalize("NFKD", str(text).lower().translate(FOLD_TABLE))
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: Text) -> List[Text]:
+    """Accent-folded words of a text."""
+    return _WORD_PATTERN.findall(fold(text))
+
+
+def trigrams(text: Text) -> set:
+    """Trigrams of the words of a text, padded at the word boundaries."""
+    return {f"  {word} "[i : i + 3] for word in tokenize(text) for i in range(len(word) + 1)}
+
+
+class NameIndex:
+    """Prefix and trigram index over the hut names, vereine and sections, built once for the hut database."""
+
+    def __init__(self, huts: pd.DataFrame) -> None:
+        """
+        Build the index.
+
+        Args:
+            huts: hut database with the columns of SEARCH_COLUMNS and RESULT_FIELDS
+        """
+        self.huts = pd.DataFrame(huts[RESULT_FIELDS]).reset_index(drop=True)
+        self.huts["altitude_m"] = self.huts["altitude_m"].astype(float)
+        self.huts = self.huts.astype(object).where(self.huts.notna(), None)
+        for column in ["name", "verein", "sektion"]:
+            self.huts[column] = [text.strip() if isinstance(text, str) else text for text in self.huts[column]]
+        self.records = self.huts.to_dict(orient="records")
+        self.positions = {hut_id: i for i, hut_id in enumerate(self.huts["id"])}
+        nr_huts = len(self.huts)
+
+        word_huts, name_word_huts = defaultdict(set), defaultdict(set)
+        for column in SEARCH_COLUMNS:
+            for i, text in enumerate(huts[column]):
+                if text is None or (isinstance(text, float) and np.isnan(text)):
+                    continue
+                for word in tokenize(text):
+                    word_huts[word].add(i)
+                    if column == "name":
+                        name_word_huts[word].add(i)
+        self.words = np.array(sorted(word_huts), dtype=object)
+        # hut i contains word w (in any column / in its name)
+        self.word_matrix = np.zeros((len(self.words), nr_huts), dtype=bool)
+        self.name_word_matrix = np.zeros((len(self.words), nr_huts), dtype=bool)
+        for w, word in enumerate(self.words):
+            self.word_matrix[w, list(word_huts[word])] = True
+            self.name_word_matrix[w, list(name_word_huts.get(word, ()))] = True
+
+        self.folded_names = [fold(name) for name in self.huts["name"]]
+        self.name_lengths = np.array([len(name) for name in self.folded_names])
+        name_trigrams = [trigrams(name) for name in self.huts["name"]]
+        self.nr_trigrams = np.array([len(grams) for grams in name_trigrams])
+        postings = defaultdict(list)
+        for i, grams in enumerate(name_trigrams):
+            for gram in grams:
+                postings[gram].append(i)
+        self.trigram_postings = {gram: np.array(huts_of_gram) for gram, huts_of_gram in postings.items()}
+
+    def _prefix_range(self, prefix: Text) -> slice:
+        start = np.searchsorted(self.words, prefix, side="left")
+        end = np.searchsorted(self.words, prefix + "\uffff", side="left")
+        return slice(start, end)
+
+    def search(self, query: Text, limit: int = DEFAULT_LIMIT, candidates: np.ndarray = None) -> List[Dict]:
+        """
+        Find huts by name, verein or section.
+
+        Args:
+            query: typed text, every word is matched as a prefix
+            limit: maximum number of results
+            candidates: boolean mask of the huts that may be returned (e.g. from the distance filter), default all
+
+        Returns:
+            hut records (RESULT_FIELDS) with "match" ("prefix" or "fuzzy"), the best matches first: names starting
+            with the query, then more words matched in the name, more complete words and shorter names
+        """
+        query_words = tokenize(query)
+        if len(query_words) == 0 or limit <= 0:
+            return []
+        nr_huts = len(self.huts)
+        allowed = candidates if candidates is not None else np.ones(nr_huts, dtype=bool)
+
+        matched = allowed.copy()
+        name_hits = np.zeros(nr_huts, dtype=int)
+        exact_hits = np.zeros(nr_huts, dtype=int)
+        required_words = [word for word in query_words if word not in OPTIONAL_WORDS] or query_words
+        for word in query_words:
+            words = self._prefix_range(word)
+            if word in required_words:
+                matched &= self.word_matrix[words].any(axis=0)
+            name_hits += self.name_word_matrix[words].any(axis=0)
+            exact = np.searchsorted(self.words, word)
+            if exact < len(self.words) and self.words[exact] == word:
+                exact_hits += self.word_matrix[exact]
+        folded_query = " ".join(query_words)
+        hits = np.flatnonzero(matched)
+        starts = np.array([self.folded_names[i].startswith(folded_query) for i in hits], dtype=int)
+        # sorted by the last key first: starts with the query, name hits, exact words, name length, name
+        order = np.lexsort(
+            (
+                np.array([self.folded_names[i] for i in hits], dtype=object),
+                self.name_lengths[hits],
+                -exact_hits[hits],
+                -name_hits[hits],
+                -starts,
+            )
+        )
+        results = [(i, "prefix") for i in hits[order][:limit]]
+
+        if len(results) < limit:
+            query_trigrams = trigrams(folded_query)
+            shared = np.zeros(nr_huts, dtype=int)
+            for gram in query_trigrams:
+                if gram in self.trigram_postings:
+                    shared[self.trigram_postings[gram]] += 1
+            similarity = shared / (len(query_trigrams) + self.nr_trigrams - shared)
+            fuzzy = np.flatnonzero((similarity >= FUZZY_MIN_SIMILARITY) & allowed & ~matched)
+            fuzzy = fuzzy[np.argsort(-similarity[fuzzy], kind="stable")]
+            results += [(i, "fuzzy") for i in fuzzy[: limit - len(results)]]
+
+        return [{**self.records[i], "match": match} for i, match in results]
+
+    def mask(self, hut_ids: List[int]) -> np.ndarray:
+        """Boolean mask of the huts with the given ids (for the candidates of a search)."""
+        candidates = np.zeros(len(self.huts), dtype=bool)
+        candidates[[self.positions[hut_id] for hut_id in hut_ids if hut_id in self.positions]] = True
+        return candidates
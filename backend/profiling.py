@@ -0,0 +1,170 @@
+"""
+On-demand sampling profiler for single API requests, exported in the speedscope format.
+
+Profiling is off unless an admin token is configured (HUTFINDER_PROFILE_TOKEN). A request that sends the token in
+the X-Profile-Token header is profiled by a sampler thread that records the stack of the request thread every few
+milliseconds. The profile is stored with the request parameters in data/profiles and can be downloaded with the same
+token (GET /api/profiles/<id>) and opened at https://www.speedscope.app. Requests without the header only pay for one
+header lookup, and nothing is done at all if no token is configured.
+"""
+
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Text, Tuple
+
+# admin token that enables profiling (off if not set)
+PROFILE_TOKEN = os.environ.get("HUTFINDER_PROFILE_TOKEN")
+DEFAULT_PROFILE_DIR = os.path.join("data", "profiles")
+PROFILE_HEADER = "X-Profile-Token"
+# seconds between two samples of the request thread
+SAMPLE_INTERVAL = 0.002
+# number of stored profiles, older ones are removed
+KEEP_PROFILES = 50
+# endpoints that can be profiled
+PROFILED_ENDPOINTS = {"submit", "submit_batch", "multi_day_planning", "stay_windows", "reachability"}
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+def is_authorized(token: Optional[Text], profile_token: Optional[Text] = None) -> bool:
+    """Whether a token matches the configured admin token (always False if profiling is off)."""
+    profile_token = profile_token if profile_token is not None else PROFILE_TOKEN
+    if profile_token is None or token is None:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), profile_token.encode("utf-8"))
+
+
+class SamplingProfiler:
+    """Records the stack of one thread at a fixed interval in a background thread."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.frames: List[Tuple[Text, Text, int]] = []
+        self._frame_index: Dict[Tuple[Text, Text, int], int] = {}
+        self.samples: List[List[int]] = []
+        self.weights: List[float] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        """Start sampling."""
+        self.start_time = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> float:
+        """Stop sampling (if it is still running), returns the profiled duration in seconds."""
+        if not self._stop.is_set():
+            self._stop.set()
+            self._thread.join()
+            self.duration = time.perf_counter() - self.start_time
+        return self.duration
+
+    def _run(self) -> None:
+        last_sample = self.start_time
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                if key not in self._frame_index:
+                    self._frame_index[key] = len(self.frames)
+                    self.frames.append(key)
+                stack.append(self._frame_index[key])
+                frame = frame.f_back
+            # speedscope expects the stacks from the root to the leaf
+            self.samples.append(stack[::-1])
+            self.weights.append(now - last_sample)
+            last_sample = now
+
+    def to_speedscope(self, name: Text) -> Dict:
+        """Profile in the speedscope file format (one sampled profile, weights in seconds)."""
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "exporter": "hutfinder",
+            "shared": {"frames": [{"name": n, "file": f, "line": line} for n, f, line in self.frames]},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(self.weights),
+                    "samples": self.samples,
+                    "weights": self.weights,
+                }
+            ],
+        }
+
+
+class ProfileStore:
+    """Directory of profiles: <id>.speedscope.json with the profile and <id>.json with the request infos."""
+
+    def __init__(self, directory: Text = DEFAULT_PROFILE_DIR, keep: int = KEEP_PROFILES) -> None:
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, profiler: SamplingProfiler, request_info: Dict) -> Text:
+        """
+        Store a profile.
+
+        Args:
+            profiler: stopped profiler
+            request_info: endpoint, parameters and status of the profiled request
+
+        Returns:
+            id of the profile
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        name = f"{request_info.get('endpoint')} {profile_id}"
+        with open(os.path.join(self.directory, f"{profile_id}.speedscope.json"), "w") as outfile:
+            json.dump(profiler.to_speedscope(name), outfile)
+        info = {
+            "id": profile_id,
+            "created": time.time(),
+            "duration": profiler.duration,
+            "nr_samples": len(profiler.samples),
+            **request_info,
+        }
+        with open(os.path.join(self.directory, f"{profile_id}.json"), "w") as outfile:
+            json.dump(info, outfile, default=str)
+
+        profile_ids = sorted(
+            f[: -len(".json")]
+            for f in os.listdir(self.directory)
+            if f.endswith(".json") and not f.endswith(".speedscope.json")
+        )
+        for old_id in profile_ids[: -self.keep]:
+            for suffix in [".json", ".speedscope.json"]:
+                path = os.path.join(self.directory, old_id + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+        return profile_id
+
+    def list(self) -> List[Dict]:
+        """Infos of all stored profiles, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        infos = []
+        for file_name in sorted(os.listdir(self.directory), reverse=True):
+            if file_name.endswith(".json") and not file_name.endswith(".speedscope.json"):
+                with open(os.path.join(self.directory, file_name), "r") as infile:
+                    infos.append(json.load(infile))
+        return infos
+
+    def path(self, profile_id: Text) -> Optional[Text]:
+        """Path of the speedscope file of a profile, None if it does not exist."""
+        if not all(c.isalnum() or c == "-" for c in profile_id):
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.speedscope.json")
+        return path if os.path.exists(path) else None
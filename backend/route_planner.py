@@ -0,0 +1,462 @@
+"""
+Query planner for the multi-day route search: count the candidate routes first, then pick an execution strategy.
+
+The connections between the huts that are available on consecutive days form a layered graph. Propagating the number
+of partial routes along its connections (one weighted bincount per day, without going back to the hut of the previous
+night) gives the number of candidate routes per day before the search runs, exact for up to three days and an upper
+bound of the routes with unique huts for longer trips. Small searches are enumerated exhaustively with the merge-based
+search, larger ones return the top-K shortest routes of a beam search, and very broad ones a uniform random sample of
+the candidate routes. Both bounded strategies only cost O(K x degree) per day, independent of the number of routes.
+Propagating boolean frontiers instead of counts gives the huts that are reachable on each day and the huts on any
+route (the markers).
+"""
+
+from typing import Dict, List, Optional, Text, Tuple
+
+import numpy as np
+import pandas as pd
+
+from filtering import FEASIBLE_CONNECTIONS, flexible_start_route_finding, multi_day_route_finding
+
+PLAN_AUTO, PLAN_EXHAUSTIVE, PLAN_BEAM, PLAN_SAMPLED = "auto", "exhaustive", "beam", "sampled"
+PLANS = (PLAN_AUTO, PLAN_EXHAUSTIVE, PLAN_BEAM, PLAN_SAMPLED)
+# searches with at most this many candidate routes are enumerated exhaustively (about 3 s on a dense graph, the
+# enumeration only expands routes with unique huts, so the estimate bounds its partial routes)
+EXHAUSTIVE_MAX_ROUTES = 200_000
+# above this many candidate routes, the shortest routes are not representative and a sample is returned instead
+BEAM_MAX_ROUTES = 50_000_000
+# beam width and sample size
+MAX_RESULTS = 500
+# rounds of draws that replace dropped samples (duplicates, routes that visit a hut twice)
+SAMPLING_ROUNDS = 5
+
+
+class RouteGraph:
+    """Connections between the available huts of a search as arrays, sorted by source hut (CSR layout)."""
+
+    def __init__(
+        self,
+        date_list: List[Text],
+        avail_per_date: pd.DataFrame,
+        feasible_connections: pd.DataFrame = None,
+        max_dist_between_huts: float = -1,
+    ) -> None:
+        """
+        Build the graph of a search.
+
+        Args:
+            date_list: dates of the search (in DATE_FORMAT_OUT)
+            avail_per_date: available places per hut (index) and date (columns) of the filtered huts
+            feasible_connections: connection table (index id_source, columns id_target and distance)
+            max_dist_between_huts: maximum distance (in meters) between two consecutive huts, -1 for no limit
+        """
+        if feasible_connections is None:
+            feasible_connections = FEASIBLE_CONNECTIONS
+        self.date_list = list(date_list)
+        places = avail_per_date.reindex(columns=self.date_list)
+        self.hut_ids = places.index.to_numpy()
+        self.places = places.to_numpy(dtype=float)
+        self.available = ~np.isnan(self.places)
+
+        connections = feasible_connections[feasible_connections.index.isin(self.hut_ids)]
+        connections = connections[connections["id_target"].isin(self.hut_ids)]
+        if max_dist_between_huts > 0:
+            connections = connections[connections["distance"] <= max_dist_between_huts]
+        hut_index = pd.Series(np.arange(len(self.hut_ids)), index=self.hut_ids)
+        sources = hut_index[connections.index].to_numpy()
+        order = np.argsort(sources, kind="stable")
+        self.sources = sources[order]
+        self.targets = hut_index[connections["id_target"]].to_numpy()[order]
+        self.distances = connections["distance"].to_numpy()[order]
+        self.indptr = np.searchsorted(self.sources, np.arange(len(self.hut_ids) + 1))
+        # index of the reverse connection v -> u of every connection u -> v (-1 if there is none)
+        keys = self.sources * len(self.hut_ids) + self.targets
+        reverse_keys = self.targets * len(self.hut_ids) + self.sources
+        order = np.argsort(keys, kind="stable")
+        position = np.minimum(np.searchsorted(keys, reverse_keys, sorter=order), max(len(keys) - 1, 0))
+        self.reverse = np.where(keys[order][position] == reverse_keys, order[position], -1) if len(keys) else keys
+
+    @property
+    def nr_huts(self) -> int:
+        """Number of huts in the graph."""
+        return len(self.hut_ids)
+
+    def forward_counts(self, start: int, nr_days: int, start_huts: np.ndarray = None) -> np.ndarray:
+        """
+        Number of partial routes (from the start date) that end in each hut, per day (nr_days x huts).
+
+        The routes are counted per connection of the last night change, so that routes that go back to the hut of the
+        previous night (A -> B -> A) are not counted, as in forward_edges. Routes with longer cycles (A -> B -> C -> A)
+        are counted, so the counts are exact for up to three days and an upper bound of the routes with unique huts
+        for longer trips.
+        """
+        counts = np.zeros((nr_days, self.nr_huts))
+        counts[0] = self.available[:, start] if start_huts is None else self.available[:, start] & start_huts
+        edge_counts = counts[0][self.sources]
+        for i in range(1, nr_days):
+            if i > 1:
+                edge_counts = counts[i - 1][self.sources] - self._turns(edge_counts)
+            edge_counts = edge_counts * self.available[self.targets, start + i]
+            counts[i] = np.bincount(self.targets, weights=edge_counts, minlength=self.nr_huts)
+        return counts
+
+    def completion_counts(self, start: int, nr_days: int) -> np.ndarray:
+        """Number of ways to complete a route from each hut, per day of the trip (nr_days x huts)."""
+        counts = np.zeros((nr_days, self.nr_huts))
+        counts[-1] = self.available[:, start + nr_days - 1]
+        for i in range(nr_days - 2, -1, -1):
+            counts[i] = np.bincount(self.sources, weights=counts[i + 1][self.targets], minlength=self.nr_huts)
+            counts[i][~self.available[:, start + i]] = 0
+        return counts
+
+    def forward_edges(self, start: int, nr_days: int, start_huts: np.ndarray = None) -> np.ndarray:
+        """
+        Connections that can be taken on each night change of a trip, propagated as boolean frontiers.
+
+        A connection u -> v is taken on a day if an earlier connection into u is taken that does not come from v, so
+        walks that go back to the hut of the previous night (A -> B -> A) are not propagated. The cost is linear in
+        the number of connections per day.
+
+        Args:
+            start: index of the start date
+            nr_days: number of days of the trip
+            start_huts: boolean mask of the huts the trip may start at (default: all available huts)
+
+        Returns:
+            boolean array (nr_days - 1 x connections), row i for the connections from day i to day i + 1
+        """
+        frontiers = np.zeros((nr_days - 1, len(self.sources)), dtype=bool)
+        first_huts = self.available[:, start] if start_huts is None else self.available[:, start] & start_huts
+        for i in range(nr_days - 1):
+            if i == 0:
+                frontiers[i] = first_huts[self.sources]
+            else:
+                arrivals = np.bincount(self.targets, weights=frontiers[i - 1], minlength=self.nr_huts)
+                frontiers[i] = arrivals[self.sources] - self._turns(frontiers[i - 1]) > 0
+            frontiers[i] &= self.available[self.targets, start + i + 1]
+        return frontiers
+
+    def backward_edges(self, start: int, nr_days: int, end_huts: np.ndarray = None) -> np.ndarray:
+        """Connections from which a trip can be completed without going back (see forward_edges)."""
+        frontiers = np.zeros((nr_days - 1, len(self.sources)), dtype=bool)
+        last_huts = self.available[:, start + nr_days - 1]
+        last_huts = last_huts if end_huts is None else last_huts & end_huts
+        for i in range(nr_days - 2, -1, -1):
+            if i == nr_days - 2:
+                frontiers[i] = last_huts[self.targets]
+            else:
+                departures = np.bincount(self.sources, weights=frontiers[i + 1], minlength=self.nr_huts)
+                frontiers[i] = departures[self.targets] - self._turns(frontiers[i + 1]) > 0
+            frontiers[i] &= self.available[self.sources, start + i]
+        return frontiers
+
+    def _turns(self, frontier: np.ndarray) -> np.ndarray:
+        # value (frontier flag or route count) of the reverse connection v -> u of every connection u -> v (a turn back)
+        return np.where(self.reverse >= 0, frontier[self.reverse], False)
+
+    def reachable(self, start: int, nr_days: int, start_huts: np.ndarray = None) -> np.ndarray:
+        """
+        Huts that can be reached on each day of a trip (without going back to the hut of the previous night).
+
+        Returns:
+            boolean array (nr_days x huts), True where a hut is available and reachable on that day
+        """
+        reached = np.zeros((nr_days, self.nr_huts), dtype=bool)
+        reached[0] = self.available[:, start] if start_huts is None else self.available[:, start] & start_huts
+        for i, frontier in enumerate(self.forward_edges(start, nr_days, start_huts)):
+            reached[i + 1, self.targets[frontier]] = True
+        return reached
+
+    def route_huts(self, nr_days: int, start_huts: np.ndarray = None, end_huts: np.ndarray = None) -> np.ndarray:
+        """
+        Huts on at least one candidate route of any start date (boolean vector over the huts).
+
+        A connection is on a route if it can be reached and the trip can be completed from it. Walks that go back to
+        the hut of the previous night are excluded, longer cycles (A -> B -> C -> A) are not, so the huts are a
+        superset of the huts on routes with unique huts: a hut is included if it is only on routes that visit another
+        hut twice, which is common for long trips in dense regions.
+        """
+        on_route = np.zeros(self.nr_huts, dtype=bool)
+        for start in range(len(self.date_list) - nr_days + 1):
+            if nr_days == 1:
+                first_huts = self.available[:, start] if start_huts is None else self.available[:, start] & start_huts
+                on_route |= first_huts if end_huts is None else first_huts & end_huts
+                continue
+            edges = self.forward_edges(start, nr_days, start_huts) & self.backward_edges(start, nr_days, end_huts)
+            edges = edges.any(axis=0)
+            on_route[self.sources[edges]] = True
+            on_route[self.targets[edges]] = True
+        return on_route
+
+    def mask(self, hut_ids: List[int]) -> np.ndarray:
+        """Boolean mask of the huts with the given ids."""
+        return np.isin(self.hut_ids, hut_ids)
+
+    def routes_per_day(self, nr_days: int, start_huts: np.ndarray = None, end_huts: np.ndarray = None) -> np.ndarray:
+        """
+        Number of candidate (partial) routes after each day, summed over all start dates (see forward_counts).
+
+        Args:
+            nr_days: number of days of the trip
+            start_huts: boolean mask of the huts the trip may start at (default: all available huts)
+            end_huts: boolean mask of the huts the trip may end at (default: all available huts)
+        """
+        routes_per_day = np.zeros(nr_days)
+        for start in range(len(self.date_list) - nr_days + 1):
+            counts = self.forward_counts(start, nr_days, start_huts)
+            if end_huts is not None:
+                counts[-1] *= end_huts
+            routes_per_day += counts.sum(axis=1)
+        return routes_per_day
+
+
+def choose_plan(estimated_routes: float, requested_plan: Text = PLAN_AUTO) -> Text:
+    """
+    Execution strategy of a search.
+
+    Args:
+        estimated_routes: number of candidate routes
+        requested_plan: plan requested by the client, PLAN_AUTO to choose by the number of routes
+
+    Returns:
+        PLAN_EXHAUSTIVE, PLAN_BEAM or PLAN_SAMPLED
+    """
+    if requested_plan != PLAN_AUTO:
+        return requested_plan
+    if estimated_routes <= EXHAUSTIVE_MAX_ROUTES:
+        return PLAN_EXHAUSTIVE
+    if estimated_routes <= BEAM_MAX_ROUTES:
+        return PLAN_BEAM
+    return PLAN_SAMPLED
+
+
+def _expand(graph: RouteGraph, last_huts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Indices of the partial routes and of the edges of all extensions of partial routes by one connection."""
+    degrees = graph.indptr[last_huts + 1] - graph.indptr[last_huts]
+    route_index = np.repeat(np.arange(len(last_huts)), degrees)
+    offsets = np.arange(len(route_index)) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+    return route_index, graph.indptr[last_huts][route_index] + offsets
+
+
+def beam_search(
+    graph: RouteGraph, start: int, nr_days: int, width: int = MAX_RESULTS, require_unique_huts: bool = True
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Short routes (by total distance) of one start date, keeping the `width` shortest partial routes per day.
+
+    The result approximates the `width` shortest routes (a partial route that is cut may have led to a short route).
+
+    Partial routes are only extended to huts from which the route can still be completed, so no partial route in the
+    beam is a dead end.
+
+    Returns:
+        hut indices (routes x nr_days) and distances (routes x nr_days - 1)
+    """
+    completable = graph.completion_counts(start, nr_days) > 0
+    route_huts = np.nonzero(completable[0])[0][:, None]
+    route_distances = np.zeros((len(route_huts), 0))
+    for i in range(1, nr_days):
+        route_index, edges = _expand(graph, route_huts[:, -1])
+        targets = graph.targets[edges]
+        keep = completable[i][targets]
+        if require_unique_huts:
+            keep &= (route_huts[route_index] != targets[:, None]).all(axis=1)
+        route_index, edges, targets = route_index[keep], edges[keep], targets[keep]
+        route_huts = np.column_stack([route_huts[route_index], targets])
+        route_distances = np.column_stack([route_distances[route_index], graph.distances[edges]])
+        if len(route_huts) > width:
+            best = np.argsort(route_distances.sum(axis=1), kind="stable")[:width]
+            route_huts, route_distances = route_huts[best], route_distances[best]
+    return route_huts, route_distances
+
+
+def _draw_routes(
+    graph: RouteGraph, completions: np.ndarray, nr_routes: int, rng: np.random.Generator
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Draw routes uniformly from all candidate routes (including routes that visit a hut twice)."""
+    nr_days = len(completions)
+    route_huts = np.zeros((nr_routes, nr_days), dtype=int)
+    route_distances = np.zeros((nr_routes, nr_days - 1), dtype=graph.distances.dtype)
+    route_huts[:, 0] = rng.choice(graph.nr_huts, size=nr_routes, p=completions[0] / completions[0].sum())
+    for i in range(1, nr_days):
+        # choose the next hut with probability proportional to its number of completions
+        cumulative = np.concatenate([[0.0], np.cumsum(completions[i][graph.targets])])
+        current = route_huts[:, i - 1]
+        low, high = cumulative[graph.indptr[current]], cumulative[graph.indptr[current + 1]]
+        edges = np.searchsorted(cumulative, low + rng.random(nr_routes) * (high - low), side="right") - 1
+        edges = np.clip(edges, graph.indptr[current], graph.indptr[current + 1] - 1)
+        route_huts[:, i] = graph.targets[edges]
+        route_distances[:, i - 1] = graph.distances[edges]
+    return route_huts, route_distances
+
+
+def sample_routes(
+    graph: RouteGraph,
+    start: int,
+    nr_days: int,
+    nr_samples: int = MAX_RESULTS,
+    rng: np.random.Generator = None,
+    require_unique_huts: bool = True,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Uniform random sample of the routes of one start date, drawn with the completion counts of every hut.
+
+    Duplicates and routes that visit a hut twice are dropped and replaced by new draws for up to SAMPLING_ROUNDS
+    rounds, so fewer than nr_samples routes are only returned if the search has few routes.
+
+    Returns:
+        hut indices (routes x nr_days) and distances (routes x nr_days - 1)
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    completions = graph.completion_counts(start, nr_days)
+    sampled = {}
+    if completions[0].sum() > 0:
+        for _ in range(SAMPLING_ROUNDS):
+            missing = nr_samples - len(sampled)
+            if missing <= 0:
+                break
+            route_huts, route_distances = _draw_routes(graph, completions, 2 * missing, rng)
+            for route, distances in zip(route_huts.tolist(), route_distances, strict=True):
+                if len(sampled) < nr_samples and (not require_unique_huts or len(set(route)) == nr_days):
+                    sampled.setdefault(tuple(route), distances)
+    if len(sampled) == 0:
+        return np.zeros((0, nr_days), dtype=int), np.zeros((0, nr_days - 1), dtype=graph.distances.dtype)
+    return np.array(list(sampled.keys())), np.array(list(sampled.values()))
+
+
+def routes_to_frame(
+    graph: RouteGraph, start: int, route_huts: np.ndarray, route_distances: np.ndarray, id_to_hut: Dict
+) -> pd.DataFrame:
+    """Routes (hut indices) in the format of multi_day_route_finding."""
+    columns = {}
+    nr_days = route_huts.shape[1]
+    for i in range(nr_days):
+        columns[f"day{i}"] = graph.hut_ids[route_huts[:, i]]
+        columns[f"name_day{i}"] = pd.Series(columns[f"day{i}"]).map(id_to_hut).to_numpy()
+        columns[f"places_day{i}"] = graph.places[route_huts[:, i], start + i]
+        if i < nr_days - 1:
+            columns[f"distance_day{i + 1}"] = route_distances[:, i].astype(graph.distances.dtype)
+    return pd.DataFrame(columns)
+
+
+class RoutePlanner:
+    """Planner of a multi-day search: counts the candidate routes on construction and runs the chosen plan."""
+
+    def __init__(
+        self,
+        date_list: List[Text],
+        avail_per_date: pd.DataFrame,
+        id_to_hut: Dict,
+        nr_days: int,
+        max_dist_between_huts: float = -1,
+        feasible_connections: pd.DataFrame = None,
+        flexible_start: bool = False,
+        start_hut_id: int = None,
+        end_hut_id: int = None,
+        round_trip: bool = False,
+    ) -> None:
+        """
+        Count the candidate routes of a search.
+
+        Args:
+            date_list: dates of the trip, or all dates of a flexible-start search
+            avail_per_date: available places per hut (index) and date (columns) of the filtered huts
+            id_to_hut: mapping from hut id to hut name
+            nr_days: number of days of the trip
+            max_dist_between_huts: maximum distance (in meters) between two consecutive huts, -1 for no limit
+            feasible_connections: connection table (default: data/feasible_connections.csv)
+            flexible_start: whether the trip may start on any date of date_list (routes get a start_date column)
+            start_hut_id: hut of the first night (optional, only for the exhaustive plan)
+            end_hut_id: hut of the last night (optional, only for the exhaustive plan)
+            round_trip: whether the last night is in the start hut (requires start_hut_id), the estimate does not count
+                the routes of three days that go back to the start hut (A -> B -> A)
+        """
+        self.date_list = date_list
+        self.avail_per_date = avail_per_date
+        self.id_to_hut = id_to_hut
+        self.nr_days = nr_days
+        self.max_dist_between_huts = max_dist_between_huts
+        self.feasible_connections = feasible_connections
+        self.flexible_start = flexible_start
+        self.start_hut_id = start_hut_id
+        self.end_hut_id = start_hut_id if round_trip else end_hut_id
+        self.round_trip = round_trip
+        self.graph = RouteGraph(date_list, avail_per_date, feasible_connections, max_dist_between_huts)
+        self.start_huts = None if start_hut_id is None else self.graph.mask([start_hut_id])
+        self.end_huts = None if self.end_hut_id is None else self.graph.mask([self.end_hut_id])
+        self.routes_per_day = self.graph.routes_per_day(nr_days, self.start_huts, self.end_huts)
+
+    @property
+    def estimated_routes(self) -> int:
+        """Number of candidate routes, an upper bound of the routes with unique huts (see RouteGraph.forward_counts)."""
+        return int(self.routes_per_day[-1])
+
+    def info(self, plan: Text) -> Dict:
+        """Plan and estimates for the response."""
+        return {
+            "plan": plan,
+            "estimatedRoutes": self.estimated_routes,
+            "estimatedRoutesPerDay": [int(count) for count in self.routes_per_day],
+        }
+
+    def route_hut_ids(self) -> np.ndarray:
+        """Ids of the huts on at least one candidate route (the markers of the search), see RouteGraph.route_huts."""
+        return self.graph.hut_ids[self.graph.route_huts(self.nr_days, self.start_huts, self.end_huts)]
+
+    def run(self, plan: Text, max_results: int = MAX_RESULTS, seed: Optional[int] = None) -> pd.DataFrame:
+        """
+        Run the search with a plan.
+
+        Args:
+            plan: PLAN_EXHAUSTIVE, PLAN_BEAM or PLAN_SAMPLED
+            max_results: beam width and sample size
+            seed: random seed of the sampled plan
+
+        Returns:
+            routes in the format of multi_day_route_finding (with a start_date column for a flexible start)
+        """
+        if plan == PLAN_EXHAUSTIVE:
+            if self.flexible_start:
+                return flexible_start_route_finding(
+                    self.date_list,
+                    self.avail_per_date,
+                    self.id_to_hut,
+                    self.nr_days,
+                    max_dist_between_huts=self.max_dist_between_huts,
+                    feasible_connections=self.feasible_connections,
+                )
+            return multi_day_route_finding(
+                self.date_list,
+                self.avail_per_date,
+                self.id_to_hut,
+                max_dist_between_huts=self.max_dist_between_huts,
+                feasible_connections=self.feasible_connections,
+                start_hut_id=self.start_hut_id,
+                end_hut_id=self.end_hut_id,
+                round_trip=self.round_trip,
+            )
+
+        graph, nr_days = self.graph, self.nr_days
+        starts = range(len(self.date_list) - nr_days + 1)
+        rng = np.random.default_rng(seed)
+        if plan == PLAN_SAMPLED:
+            # samples per start date in proportion to its number of routes
+            routes_per_start = np.array([graph.forward_counts(start, nr_days)[-1].sum() for start in starts])
+            nr_samples = rng.multinomial(max_results, routes_per_start / max(routes_per_start.sum(), 1))
+        frames = []
+        for start in starts:
+            if plan == PLAN_BEAM:
+                route_huts, route_distances = beam_search(graph, start, nr_days, max_results)
+            else:
+                route_huts, route_distances = sample_routes(graph, start, nr_days, nr_samples[start], rng)
+            frame = routes_to_frame(graph, start, route_huts, route_distances, self.id_to_hut)
+            if self.flexible_start:
+                frame.insert(0, "start_date", self.date_list[start])
+            frames.append(frame)
+        trip_options = pd.concat(frames, ignore_index=True)
+        if plan == PLAN_BEAM and len(frames) > 1:
+            # shortest routes over all start dates
+            total_distance = trip_options[[f"distance_day{i}" for i in range(1, nr_days)]].sum(axis=1)
+            trip_options = trip_options.loc[total_distance.sort_values(kind="stable").index[:max_results]]
+            trip_options = trip_options.reset_index(drop=True)
+        return trip_options
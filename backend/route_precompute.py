@@ -0,0 +1,232 @@
+"""
+Precomputed multi-day routes for common queries (popular regions, weekend trips), refreshed after every update.
+
+Routes are computed for the widest query of each region and trip (all huts of the region, at least one free place,
+all feasible connections) and stored in one compressed npz file together with the hut ids of the region. A request
+whose filtered huts all lie within a region and whose dates match a precomputed trip is answered by filtering these
+routes by huts, places and distances, which gives the same routes as the search on the database.
+"""
+
+import argparse
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Text
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+from filtering import DATE_FORMAT_OUT, filter_huts, multi_day_route_finding
+
+DEFAULT_PRECOMPUTED_ROUTES_PATH = os.path.join("data", "precomputed_routes.npz")
+# store that the updater writes and the app reads
+PRECOMPUTED_ROUTES_PATH = os.environ.get("HUTFINDER_PRECOMPUTED_ROUTES", DEFAULT_PRECOMPUTED_ROUTES_PATH)
+# popular regions: name -> (latitude, longitude, radius in km)
+POPULAR_REGIONS = {
+    "berner_oberland": (46.55, 7.95, 40),
+    "wallis": (46.05, 7.65, 45),
+    "graubuenden": (46.6, 9.8, 45),
+    "oetztal_stubai": (46.95, 11.0, 40),
+    "zillertal_tauern": (47.05, 12.0, 45),
+    "dolomiten": (46.5, 11.85, 40),
+    "allgaeu_lechtal": (47.3, 10.4, 35),
+}
+# trips of 2-4 days that end on a Sunday (Sat-Sun, Fri-Sun, Thu-Sun)
+TRIP_LENGTHS = (2, 3, 4)
+NR_WEEKENDS = 8
+# entries with more routes are not stored (these queries are computed on request)
+MAX_ROUTES_PER_ENTRY = 200_000
+
+
+def weekend_trips(today: date, nr_weekends: int = NR_WEEKENDS, trip_lengths: tuple = TRIP_LENGTHS) -> List[List[Text]]:
+    """
+    Date lists of all weekend trips in the next weeks.
+
+    Args:
+        today: first possible start date
+        nr_weekends: number of weekends
+        trip_lengths: number of days (nights) of the trips, all trips end on a Sunday
+
+    Returns:
+        list of date lists (in DATE_FORMAT_OUT)
+    """
+    first_sunday = today + timedelta(days=(6 - today.weekday()) % 7)
+    trips = []
+    for week in range(nr_weekends):
+        sunday = first_sunday + timedelta(weeks=week)
+        for nr_days in trip_lengths:
+            start = sunday - timedelta(days=nr_days - 1)
+            if start >= today:
+                trips.append([(start + timedelta(days=i)).strftime(DATE_FORMAT_OUT) for i in range(nr_days)])
+    return trips
+
+
+def entry_key(region: Text, date_list: List[Text]) -> Text:
+    """Key of the routes of a region and trip in the store."""
+    return f"{region}|{date_list[0]}|{len(date_list)}"
+
+
+def precompute_routes(
+    availability: pd.DataFrame,
+    huts: gpd.GeoDataFrame,
+    today: date,
+    out_path: Text = PRECOMPUTED_ROUTES_PATH,
+    regions: Dict = None,
+) -> Dict:
+    """
+    Compute the routes of all popular regions and weekend trips and replace the store.
+
+    Args:
+        availability: available places with columns hut_id, date (DATE_FORMAT_OUT) and places_avail
+        huts: hut database
+        today: first possible start date of the trips
+        out_path: path of the npz store (written to a temporary file and renamed)
+        regions: regions to precompute (default: POPULAR_REGIONS)
+
+    Returns:
+        manifest of the store (regions and entries with their number of routes)
+    """
+    regions = regions or POPULAR_REGIONS
+    id_to_hut = huts.set_index("id")["name"].to_dict()
+    avail_per_date = availability[availability["places_avail"] >= 1].pivot(
+        index="hut_id", columns="date", values="places_avail"
+    )
+    manifest = {"created": datetime.now().isoformat(timespec="seconds"), "regions": regions, "entries": {}}
+    arrays = {}
+    for region, (lat, lon, radius) in regions.items():
+        region_hut_ids = filter_huts(huts, start_lat=lat, start_lon=lon, max_distance=radius)["id"]
+        region_avail = avail_per_date[avail_per_date.index.isin(region_hut_ids)]
+        arrays[f"{region}|region_huts"] = region_hut_ids.to_numpy(dtype=np.int32)
+        for date_list in weekend_trips(today):
+            trip_options = multi_day_route_finding(date_list, region_avail.reindex(columns=date_list), id_to_hut)
+            if len(trip_options) > MAX_ROUTES_PER_ENTRY:
+                continue
+            key = entry_key(region, date_list)
+            nr_days = len(date_list)
+            arrays[f"{key}|huts"] = trip_options[[f"day{i}" for i in range(nr_days)]].to_numpy(dtype=np.int32)
+            arrays[f"{key}|places"] = trip_options[[f"places_day{i}" for i in range(nr_days)]].to_numpy(np.int32)
+            arrays[f"{key}|distances"] = trip_options[[f"distance_day{i}" for i in range(1, nr_days)]].to_numpy(
+                dtype=np.int32
+            )
+            manifest["entries"][key] = len(trip_options)
+
+    tmp_path = out_path + ".tmp.npz"
+    np.savez_compressed(tmp_path, manifest=np.array(json.dumps(manifest)), **arrays)
+    os.replace(tmp_path, out_path)
+    return manifest
+
+
+def refresh(engine: sqlalchemy.engine.Engine, today: date, out_path: Text = PRECOMPUTED_ROUTES_PATH) -> Dict:
+    """Load the availability of the next weekends from the database and precompute the routes (run after updates)."""
+    last_date = today + timedelta(weeks=NR_WEEKENDS + 1)
+    query = sqlalchemy.text(
+        "SELECT hut_id, date, places_avail FROM hut_availability "
+        "WHERE places_avail >= 1 AND avail_date >= :first_date AND avail_date <= :last_date"
+    )
+    availability = pd.read_sql(
+        query, engine, params={"first_date": today.isoformat(), "last_date": last_date.isoformat()}
+    )
+    huts = gpd.read_file(os.path.join("data", "huts_database.geojson"))
+    return precompute_routes(availability, huts, today, out_path)
+
+
+class PrecomputedRoutes:
+    """Read access to the precomputed routes. The store is reloaded when the file was replaced."""
+
+    def __init__(self, path: Text = PRECOMPUTED_ROUTES_PATH) -> None:
+        self.path = path
+        self._mtime = None
+        self._manifest = {"regions": {}, "entries": {}}
+        self._arrays = {}
+        self._lock = threading.Lock()
+
+    def _reload_if_changed(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime != self._mtime:
+                with np.load(self.path) as store:
+                    self._arrays = {key: store[key] for key in store.files if key != "manifest"}
+                    self._manifest = json.loads(str(store["manifest"]))
+                self._mtime = mtime
+
+    def find(self, hut_ids: pd.Series, date_list: List[Text]) -> Optional[Text]:
+        """
+        Find the precomputed entry that contains all routes of a query.
+
+        A query is covered if all of its filtered huts are huts of the region, so that the stored routes (over all
+        huts of the region) contain every route of the query.
+
+        Args:
+            hut_ids: ids of the huts that match the hut filters of the query
+            date_list: dates of the trip (DATE_FORMAT_OUT)
+
+        Returns:
+            key of the entry, None if the query is not covered
+        """
+        self._reload_if_changed()
+        manifest = self._manifest
+        for region in manifest["regions"]:
+            key = entry_key(region, date_list)
+            # stores written before the hut ids of the regions were stored cover no queries
+            region_huts = self._arrays.get(f"{region}|region_huts")
+            if key in manifest["entries"] and region_huts is not None and np.isin(hut_ids, region_huts).all():
+                return key
+        return None
+
+    def routes(
+        self,
+        key: Text,
+        hut_ids: pd.Series,
+        id_to_hut: Dict,
+        min_places: int = 1,
+        max_dist_between_huts: float = -1,
+    ) -> pd.DataFrame:
+        """
+        Routes of an entry that satisfy the remaining constraints of a query.
+
+        Args:
+            key: entry key (see find)
+            hut_ids: ids of the huts that match the hut filters of the query
+            id_to_hut: mapping from hut id to hut name
+            min_places: minimum number of free places on every night
+            max_dist_between_huts: maximum distance (in meters) between two consecutive huts, -1 for no limit
+
+        Returns:
+            pd.DataFrame with the same columns as multi_day_route_finding
+        """
+        route_huts = self._arrays[f"{key}|huts"]
+        places = self._arrays[f"{key}|places"]
+        distances = self._arrays[f"{key}|distances"]
+        keep = np.isin(route_huts, hut_ids).all(axis=1) & (places >= min_places).all(axis=1)
+        if max_dist_between_huts > 0:
+            keep &= (distances <= max_dist_between_huts).all(axis=1)
+
+        columns = {}
+        nr_days = route_huts.shape[1]
+        for i in range(nr_days):
+            columns[f"day{i}"] = route_huts[keep, i]
+            columns[f"name_day{i}"] = pd.Series(route_huts[keep, i]).map(id_to_hut).to_numpy()
+            columns[f"places_day{i}"] = places[keep, i]
+            if i < nr_days - 1:
+                columns[f"distance_day{i + 1}"] = distances[keep, i]
+        return pd.DataFrame(columns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the routes of common multi-day queries")
+    parser.add_argument("--out", default=PRECOMPUTED_ROUTES_PATH, help="path of the npz store")
+    args = parser.parse_args()
+
+    with open("db_login.json", "r") as infile:
+        db_credentials = json.load(infile)
+    db_engine = sqlalchemy.create_engine("postgresql+psycopg2://", connect_args=db_credentials)
+    manifest = refresh(db_engine, date.today(), args.out)
+    print(f"Precomputed {sum(manifest['entries'].values())} routes in {len(manifest['entries'])} entries")
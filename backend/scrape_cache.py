@@ -0,0 +1,149 @@
+"""Durable on-disk cache of scraped availability: one record per hut and month with a content hash."""
+
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from typing import Dict, Set, Text, Tuple
+
+DEFAULT_CACHE_PATH = os.path.join("data", "scrape_cache.db")
+
+CREATE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS scrape_cache (
+    hut_id INT NOT NULL,
+    month TEXT NOT NULL,
+    places TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    scraped_at REAL NOT NULL,
+    db_places TEXT,
+    db_hash TEXT,
+    PRIMARY KEY (hut_id, month)
+);
+"""
+
+
+def month_key(date: Text) -> Text:
+    """Month (YYYY-MM) of a date in the format dd.mm.yyyy."""
+    _, mm, yyyy = date.split(".")
+    return f"{yyyy}-{mm}"
+
+
+def month_key_from_offset(start_date: datetime.date, offset: int) -> Text:
+    """Month (YYYY-MM) that is `offset` months after the month of start_date."""
+    month_index = start_date.year * 12 + start_date.month - 1 + offset
+    return f"{month_index // 12}-{month_index % 12 + 1:02d}"
+
+
+def content_hash(places: Dict) -> Text:
+    """Hash of the scraped places of a month."""
+    return hashlib.sha1(json.dumps(places, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ScrapeCache:
+    """
+    SQLite cache of the scraped places per hut and month.
+
+    Every record keeps the latest scraped places and the places that were last written to the database. Scraped
+    months are stored immediately, so that a crash of the scraper or the driver does not lose them, and only dates
+    whose places differ from the last written ones have to be written to the database.
+    """
+
+    def __init__(self, path: Text = DEFAULT_CACHE_PATH) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(CREATE_TABLE_QUERY)
+        self.conn.commit()
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self.conn.close()
+
+    def fresh_months(self, hut_id: int, max_age: float) -> Set[Text]:
+        """
+        Months of a hut that were scraped within the freshness window.
+
+        Args:
+            hut_id: hut id
+            max_age: freshness window in seconds
+
+        Returns:
+            set of months (YYYY-MM)
+        """
+        rows = self.conn.execute(
+            "SELECT month FROM scrape_cache WHERE hut_id = ? AND scraped_at >= ?", (hut_id, time.time() - max_age)
+        )
+        return {month for (month,) in rows}
+
+    def store_scraped(self, hut_id: int, places_on_date: Dict[Text, object]) -> None:
+        """
+        Store scraped places of a hut (grouped into months) and mark them as scraped now.
+
+        Args:
+            hut_id: hut id
+            places_on_date: places by date (dd.mm.yyyy), as returned by the AvailabilityChecker
+        """
+        places_per_month = defaultdict(dict)
+        for date, places in places_on_date.items():
+            places_per_month[month_key(date)][date] = places
+        now = time.time()
+        self.conn.executemany(
+            """
+            INSERT INTO scrape_cache (hut_id, month, places, content_hash, scraped_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (hut_id, month) DO UPDATE SET
+                places = excluded.places, content_hash = excluded.content_hash, scraped_at = excluded.scraped_at
+            """,
+            [
+                (hut_id, month, json.dumps(places), content_hash(places), now)
+                for month, places in places_per_month.items()
+            ],
+        )
+        self.conn.commit()
+
+    def pending_diff(self, hut_id: int) -> Dict[Text, Tuple[object, object]]:
+        """
+        Previous and new places of the dates of a hut that changed since the last write to the database.
+
+        Returns:
+            tuple of the places last written (None if the date was not written yet) and the scraped places by date
+        """
+        rows = self.conn.execute(
+            "SELECT places, db_places FROM scrape_cache WHERE hut_id = ? AND db_hash IS NOT content_hash", (hut_id,)
+        )
+        changes = {}
+        for places_json, db_places_json in rows:
+            places = json.loads(places_json)
+            db_places = json.loads(db_places_json) if db_places_json is not None else {}
+            changes.update(
+                {date: (db_places.get(date), value) for date, value in places.items() if db_places.get(date) != value}
+            )
+        return changes
+
+    def mark_written(self, hut_id: int, written: Dict[Text, object]) -> None:
+        """
+        Mark places of a hut as written to the database.
+
+        Args:
+            hut_id: hut id
+            written: places by date (dd.mm.yyyy) that were written, e.g. the new places of pending_diff; the other
+                dates keep the places that were last written
+        """
+        written_per_month = defaultdict(dict)
+        for date, places in written.items():
+            written_per_month[month_key(date)][date] = places
+        updates = []
+        for month, written_places in written_per_month.items():
+            row = self.conn.execute(
+                "SELECT db_places FROM scrape_cache WHERE hut_id = ? AND month = ?", (hut_id, month)
+            ).fetchone()
+            if row is None:
+                continue
+            db_places = json.loads(row[0]) if row[0] is not None else {}
+            db_places.update(written_places)
+            updates.append((json.dumps(db_places), content_hash(db_places), hut_id, month))
+        self.conn.executemany(
+            "UPDATE scrape_cache SET db_places = ?, db_hash = ? WHERE hut_id = ? AND month = ?", updates
+        )
+        self.conn.commit()
@@ -0,0 +1,237 @@
+"""
+Telemetry of the availability scraper: per-hut timings, retries and a failure taxonomy, stored as JSONL run log.
+
+Show the slowest huts of the latest run and the huts that got slower compared to previous runs:
+
+    python scrape_telemetry.py report --log data/scrape_telemetry.jsonl
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import statistics
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, List, Text
+
+DEFAULT_LOG_PATH = os.path.join("data", "scrape_telemetry.jsonl")
+
+# failure taxonomy
+FAILURE_NOT_IN_SYSTEM = "not_in_system"
+FAILURE_TIMEOUT = "timeout"
+FAILURE_PARSE = "parse_error"
+FAILURE_DB = "db_error"
+FAILURE_UNKNOWN = "unknown"
+
+# a hut counts as regression if it took this factor longer than the median of the previous runs
+REGRESSION_FACTOR = 1.5
+
+
+def classify_failure(error: Exception) -> Text:
+    """
+    Map an exception raised while scraping or saving a hut to a failure class.
+
+    Args:
+        error: the exception
+
+    Returns:
+        one of the FAILURE_* classes
+    """
+    # compare by name and module to avoid importing selenium and psycopg2 here
+    error_types = type(error).__mro__
+    if isinstance(error, TimeoutError) or any(t.__name__ == "TimeoutException" for t in error_types):
+        return FAILURE_TIMEOUT
+    if any(t.__module__.split(".")[0] in ("psycopg2", "sqlalchemy") for t in error_types):
+        return FAILURE_DB
+    if isinstance(error, (ValueError, IndexError, KeyError, AttributeError)):
+        return FAILURE_PARSE
+    return FAILURE_UNKNOWN
+
+
+class ScrapeTelemetry:
+    """Collects timings and counters per hut and appends one JSON record per hut to the run log."""
+
+    def __init__(self, log_path: Text = None, run_id: Text = None) -> None:
+        """
+        Initialize telemetry of one scraper run.
+
+        Args:
+            log_path: JSONL file that records are appended to (None: only keep records in memory)
+            run_id: identifier of the run, defaults to the start time
+        """
+        self.log_path = log_path
+        self.run_id = run_id or datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        self.records: List[Dict] = []
+        self.counters: Counter = Counter()
+        self.current = None
+        self._hut_tic = None
+
+    def start_hut(self, hut_id: int) -> None:
+        """Start a new record for a hut (counters of the hut are only recorded until finish_hut)."""
+        self.current = {
+            "hut_id": hut_id,
+            "timings": defaultdict(float),
+            "months": [],
+            "retries": 0,
+            "cached_months": 0,
+            "driver_restarts": 0,
+        }
+        self._hut_tic = time.perf_counter()
+
+    @contextlib.contextmanager
+    def timer(self, name: Text) -> Iterator[None]:
+        """Add the duration of the block (in seconds) to the timing `name` of the current hut."""
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.current is not None:
+                self.current["timings"][name] += time.perf_counter() - tic
+
+    def record_month(self, seconds: float, nr_days: int) -> None:
+        """Record the extraction time of one calendar month."""
+        if self.current is not None:
+            self.current["months"].append({"seconds": seconds, "days": nr_days})
+
+    def count(self, name: Text, value: int = 1) -> None:
+        """Increase a counter (e.g. retries) of the current hut and of the run."""
+        self.counters[name] += value
+        if self.current is not None and name in self.current:
+            self.current[name] += value
+
+    def finish_hut(self, status: Text, failure: Text = None, nr_records: int = 0) -> Dict:
+        """
+        Close the record of the current hut and append it to the run log.
+
+        Args:
+            status: "success" or "failed"
+            failure: failure class (see FAILURE_* constants), None if successful
+            nr_records: number of availability records written to the database
+
+        Returns:
+            the record
+        """
+        record = self.current
+        record.update(
+            {
+                "run_id": self.run_id,
+                "status": status,
+                "failure": failure,
+                "total_seconds": time.perf_counter() - self._hut_tic,
+                "records": nr_records,
+                "timings": dict(record["timings"]),
+            }
+        )
+        if failure is not None:
+            self.counters[f"failure_{failure}"] += 1
+        self.records.append(record)
+        self._write(record)
+        self.current = None
+        return record
+
+    def finish_run(self, total_seconds: float) -> Dict:
+        """Append a summary record of the whole run to the log."""
+        summary = {
+            "run_id": self.run_id,
+            "type": "run_summary",
+            "total_seconds": total_seconds,
+            "huts": len(self.records),
+            "counters": dict(self.counters),
+        }
+        self._write(summary)
+        return summary
+
+    def failure_summary(self) -> Text:
+        """Failure counts by class as short text (e.g. for the Slack message)."""
+        failures = {k.replace("failure_", ""): v for k, v in self.counters.items() if k.startswith("failure_")}
+        return ", ".join(f"{k}: {v}" for k, v in sorted(failures.items())) or "none"
+
+    def _write(self, record: Dict) -> None:
+        if self.log_path is None:
+            return
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        with open(self.log_path, "a") as outfile:
+            outfile.write(json.dumps(record) + "\n")
+
+
+def load_run_log(log_path: Text) -> Dict[Text, List[Dict]]:
+    """Load the hut records of the run log, grouped by run id (in the order of the log)."""
+    runs = defaultdict(list)
+    with open(log_path, "r") as infile:
+        for line in infile:
+            record = json.loads(line)
+            if record.get("type") != "run_summary":
+                runs[record["run_id"]].append(record)
+    return runs
+
+
+def report(log_path: Text, top: int = 20, nr_previous_runs: int = 3) -> None:
+    """
+    Print the slowest huts and failures of the latest run and the regressions compared to previous runs.
+
+    Args:
+        log_path: path of the JSONL run log
+        top: number of huts to list
+        nr_previous_runs: number of previous runs that the latest run is compared to
+    """
+    runs = load_run_log(log_path)
+    if len(runs) == 0:
+        print("No runs in the log")
+        return
+    run_ids = list(runs)
+    latest_id = run_ids[-1]
+    latest = runs[latest_id]
+
+    print(f"Run {latest_id}: {len(latest)} huts, {sum(r['total_seconds'] for r in latest):.0f}s")
+    failures = Counter(r["failure"] for r in latest if r["failure"] is not None)
+    print("Failures: " + (", ".join(f"{k}: {v}" for k, v in failures.most_common()) or "none"))
+    # records of older runs have no cached months and driver restarts
+    print(
+        f"Retries: {sum(r['retries'] for r in latest)}, "
+        f"driver restarts: {sum(r.get('driver_restarts', 0) for r in latest)}, "
+        f"cached months: {sum(r.get('cached_months', 0) for r in latest)}"
+    )
+
+    print(f"\nSlowest {top} huts")
+    print(f"{'hut':>5} {'total':>8} {'page':>7} {'calendar':>9} {'months':>7} {'retries':>7}  status")
+    for record in sorted(latest, key=lambda r: r["total_seconds"], reverse=True)[:top]:
+        timings = record["timings"]
+        month_seconds = sum(m["seconds"] for m in record["months"])
+        print(
+            f"{record['hut_id']:>5} {record['total_seconds']:>8.1f} {timings.get('page_load', 0):>7.1f} "
+            f"{timings.get('calendar_wait', 0):>9.1f} {month_seconds:>7.1f} {record['retries']:>7}  "
+            f"{record['failure'] or record['status']}"
+        )
+
+    previous_ids = run_ids[-1 - nr_previous_runs : -1]
+    if len(previous_ids) == 0:
+        return
+    previous_times = defaultdict(list)
+    for run_id in previous_ids:
+        for record in runs[run_id]:
+            if record["status"] == "success":
+                previous_times[record["hut_id"]].append(record["total_seconds"])
+
+    regressions = []
+    for record in latest:
+        if record["status"] != "success" or record["hut_id"] not in previous_times:
+            continue
+        baseline = statistics.median(previous_times[record["hut_id"]])
+        if baseline > 0 and record["total_seconds"] > REGRESSION_FACTOR * baseline:
+            regressions.append((record["total_seconds"] / baseline, record["hut_id"], baseline, record))
+    print(f"\nRegressions compared to the median of {len(previous_ids)} previous run(s): {len(regressions)}")
+    for ratio, hut_id, baseline, record in sorted(regressions, key=lambda r: r[0], reverse=True)[:top]:
+        print(f"{hut_id:>5} {baseline:>8.1f}s -> {record['total_seconds']:>8.1f}s ({ratio:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report on the scraper run log")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--log", default=DEFAULT_LOG_PATH, help="path of the JSONL run log")
+    parser.add_argument("--top", type=int, default=20, help="number of huts to list")
+    parser.add_argument("--runs", type=int, default=3, help="number of previous runs to compare against")
+    args = parser.parse_args()
+
+    report(args.log, top=args.top, nr_previous_runs=args.runs)
@@ -0,0 +1,53 @@
+"""Conversion of filtering and route finding results into JSON-serializable structures."""
+
+from typing import Dict
+
+import pandas as pd
+
+
+def table_to_dict(table: pd.DataFrame) -> [Dict]:
+    """
+    Converts pandas dataframe to list of dicts.
+
+    Args:
+        table: pandas dataframe
+
+    Returns:
+        List of dicts
+    """
+    if table.index.name is not None:
+        table.reset_index(inplace=True)
+    table.drop(["geometry"], axis=1, errors="ignore", inplace=True)
+    return [row.to_dict() for _, row in table.iterrows()]
+
+
+def routes_to_json(trip_options: pd.DataFrame, huts_with_id: pd.DataFrame, nr_days: int) -> [Dict]:
+    """
+    Converts the trip options of the multi-day route finding to a list of route dicts.
+
+    Args:
+        trip_options: output of multi_day_route_finding or flexible_start_route_finding (one row per route)
+        huts_with_id: hut table indexed by hut id, containing latitude and longitude
+        nr_days: number of days of the trip
+
+    Returns:
+        List of dicts with the route infos, the coordinates of all huts and the distances between huts (and the start
+        date for routes of the flexible-start search)
+    """
+    json_dicts = []
+    for _, row in trip_options.iterrows():
+        # make list of coordinates
+        coordinates = [
+            [huts_with_id.loc[row[f"day{k}"], "latitude"], huts_with_id.loc[row[f"day{k}"], "longitude"]]
+            for k in range(nr_days)
+        ]
+        # combine names, places and distances
+        infos = " -> ".join(
+            [row[f"name_day{k}"] + " (" + str(int(row[f"places_day{k}"])) + " spots)" for k in range(nr_days)]
+        )
+        dist = ", ".join([str(round(row[f"distance_day{k}"] / 1000, 2)) + " km" for k in range(1, nr_days)])
+        route = {"infos": infos, "coordinates": coordinates, "distance": dist}
+        if "start_date" in row:
+            route["startDate"] = row["start_date"]
+        json_dicts.append(route)
+    return json_dicts
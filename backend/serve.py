@@ -0,0 +1,315 @@
+"""
+Multi-process serving of the API: one waitress server per worker process on a shared listening socket.
+
+A single waitress process runs the pandas work of all requests on one core (GIL). This server forks several workers
+instead. The supervisor process only holds the listening socket and never imports the app. For every generation of
+the data it forks a loader process, which imports the app (hut database, trail connections, marker grid) once,
+freezes the loaded objects for the garbage collector and then forks the workers, so that the workers share the
+loaded data with the loader copy-on-write instead of loading a copy each. Workers that die are restarted by the
+loader.
+
+Graceful reload: when the data files change (or on SIGHUP), the supervisor starts a new generation that loads the
+new data. Once its workers accept connections, the old workers stop accepting, finish their requests in flight and
+exit. If loading the new data fails, the old generation keeps serving.
+
+State per process: the admission slots and the metrics of the app exist once per worker. The concurrency limits
+(HUTFINDER_CONCURRENCY) are limits of the server and are split between the workers, but every worker keeps at least one
+slot per endpoint class, so a class never has fewer slots than there are workers. /metrics is answered by whichever
+worker accepts the connection and only contains the requests of that worker, not the totals of the server. Run from
+the backend folder:
+
+    python serve.py --port 5000 --workers 4
+"""
+
+import argparse
+import contextlib
+import gc
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from typing import List, Optional, Set, Text, Tuple
+
+from waitress import create_server
+from waitress.channel import HTTPChannel
+from waitress.task import WSGITask
+
+logger = logging.getLogger(__name__)
+
+# files that are loaded by the app at import time, a new generation is started when one of them changes
+DATA_FILES = [os.path.join("data", "huts_database.geojson"), os.path.join("data", "feasible_connections.csv")]
+# seconds between two checks of the data files
+RELOAD_CHECK_INTERVAL = 5.0
+# seconds that a new generation may take to load the data before it is given up
+LOAD_TIMEOUT = 300.0
+# seconds that a stopping worker waits for its requests in flight before it exits anyway
+GRACEFUL_TIMEOUT = 30.0
+# seconds that a stopping worker keeps idle keep-alive connections open (their next response closes them)
+IDLE_CLOSE_DELAY = 2.0
+# seconds between restarts of a worker or generation that died
+RESTART_DELAY = 1.0
+
+
+def data_fingerprint(paths: List[Text] = DATA_FILES) -> Tuple[Optional[int], ...]:
+    """Modification times of the data files (None for missing files)."""
+    fingerprint = []
+    for path in paths:
+        try:
+            fingerprint.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            fingerprint.append(None)
+    return tuple(fingerprint)
+
+
+# time at which the worker started to stop (empty while it serves)
+_stopping: List[float] = []
+
+
+class _ClosingTask(WSGITask):
+    """Request task that closes the keep-alive connection after its response once the worker is stopping."""
+
+    def build_response_header(self) -> bytes:
+        if _stopping:
+            # sends "Connection: close", so the client opens its next request on a worker that keeps serving
+            self.set_close_on_finish()
+        return super().build_response_header()
+
+
+class _ClosingChannel(HTTPChannel):
+    task_class = _ClosingTask
+
+
+def _busy(channel: HTTPChannel) -> bool:
+    # a request is being received, processed or sent on the connection
+    return bool(channel.requests) or channel.request is not None or channel.total_outbufs_len > 0
+
+
+def run_worker(app_module: object, sock: socket.socket, threads: int) -> None:
+    """
+    Serve requests in a forked worker until SIGTERM, then stop accepting and finish the requests in flight.
+
+    Args:
+        app_module: the imported app module
+        sock: shared listening socket
+        threads: number of request threads
+    """
+    signal.signal(signal.SIGTERM, lambda signum, frame: _stopping.append(time.monotonic()))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    app_module.after_fork()
+
+    server = create_server(app_module.app, sockets=[sock], threads=threads)
+    server.channel_class = _ClosingChannel
+    listening = True
+    while True:
+        server.asyncore.loop(
+            timeout=server.adj.asyncore_loop_timeout, map=server._map, use_poll=server.adj.asyncore_use_poll, count=1
+        )
+        if not _stopping:
+            continue
+        if listening:
+            # only this worker's copy of the socket is closed, the other workers keep accepting
+            server.del_channel()
+            server.socket.close()
+            listening = False
+        if time.monotonic() - _stopping[0] > IDLE_CLOSE_DELAY:
+            for channel in list(server.active_channels.values()):
+                if not _busy(channel):
+                    channel.will_close = True
+        if not server.active_channels or time.monotonic() - _stopping[0] > GRACEFUL_TIMEOUT:
+            break
+    server.task_dispatcher.shutdown(cancel_pending=False, timeout=1)
+    logging.shutdown()
+    os._exit(0)
+
+
+def run_generation(sock: socket.socket, workers: int, threads: int, ready_fd: int) -> None:
+    """
+    Load the app once, fork the workers and restart workers that die, until SIGTERM stops all workers.
+
+    Args:
+        sock: shared listening socket
+        workers: number of worker processes
+        threads: number of request threads per worker
+        ready_fd: pipe that is written to once the workers are forked
+    """
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(True))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # the app splits the concurrency limits between the workers (see admission.py)
+    os.environ["HUTFINDER_WORKERS"] = str(workers)
+    import app as app_module
+
+    # objects that exist before the fork are never collected, so the collector does not touch (and copy) their pages
+    gc.collect()
+    gc.freeze()
+
+    def fork_worker() -> int:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(app_module, sock, threads)
+            finally:
+                os._exit(1)
+        return pid
+
+    children = {fork_worker() for _ in range(workers)}
+    os.write(ready_fd, b"1")
+    os.close(ready_fd)
+    logger.info(f"Generation {os.getpid()} serves with workers {sorted(children)}")
+
+    stop_sent = False
+    while children:
+        if stopping and not stop_sent:
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+            stop_sent = True
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.1)
+            continue
+        children.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited with status {status}, restarting it")
+            time.sleep(RESTART_DELAY)
+            children.add(fork_worker())
+    os._exit(0)
+
+
+class Supervisor:
+    """Holds the listening socket and replaces the generation of workers when the data changes."""
+
+    def __init__(self, sock: socket.socket, workers: int, threads: int, data_files: List[Text] = DATA_FILES) -> None:
+        """
+        Initialize the supervisor.
+
+        Args:
+            sock: listening socket
+            workers: number of worker processes per generation
+            threads: number of request threads per worker
+            data_files: files whose changes trigger a reload
+        """
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        self.data_files = data_files
+        self.generation: Optional[int] = None
+        self.retiring: Set[int] = set()
+        self._reload_requested = False
+        self._stop_requested = False
+
+    def start_generation(self) -> Optional[int]:
+        """Fork a new generation and wait until its workers are forked, returns its pid (None if loading failed)."""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                run_generation(self.sock, self.workers, self.threads, write_fd)
+            except BaseException:
+                logger.exception("Loading the app failed")
+            finally:
+                os._exit(1)
+        os.close(write_fd)
+        # the pipe is closed without a byte if the generation exits before its workers are forked
+        readable, _, _ = select.select([read_fd], [], [], LOAD_TIMEOUT)
+        ready = os.read(read_fd, 1) if readable else b""
+        os.close(read_fd)
+        if ready:
+            return pid
+        logger.error(f"Generation {pid} failed to start")
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        return None
+
+    def retire(self, pid: int) -> None:
+        """Stop a generation gracefully."""
+        os.kill(pid, signal.SIGTERM)
+        self.retiring.add(pid)
+
+    def reap(self) -> None:
+        """Collect exited generations and restart the current generation if it died."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.retiring.discard(pid)
+            if pid == self.generation and not self._stop_requested:
+                logger.warning(f"Generation {pid} exited with status {status}, starting a new one")
+                self.generation = self.start_generation()
+
+    def reload(self) -> None:
+        """Start a generation with the current data and retire the old one once the new one serves."""
+        new_generation = self.start_generation()
+        if new_generation is None:
+            logger.error("Reload failed, the previous generation keeps serving")
+            return
+        if self.generation is not None:
+            self.retire(self.generation)
+        self.generation = new_generation
+        logger.info(f"Reloaded, generation {new_generation} serves")
+
+    def run(self) -> None:
+        """Serve until SIGTERM or SIGINT, reloading when the data files change or on SIGHUP."""
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, "_reload_requested", True))
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, "_stop_requested", True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, "_stop_requested", True))
+
+        loaded = data_fingerprint(self.data_files)
+        self.generation = self.start_generation()
+        if self.generation is None:
+            raise RuntimeError("The app could not be loaded")
+        last_seen, last_check = loaded, time.monotonic()
+        while not self._stop_requested:
+            time.sleep(0.2)
+            self.reap()
+            if time.monotonic() - last_check >= RELOAD_CHECK_INTERVAL:
+                fingerprint, last_check = data_fingerprint(self.data_files), time.monotonic()
+                # reload once the files did not change for one interval (i.e. are completely written)
+                if fingerprint != loaded and fingerprint == last_seen:
+                    logger.info("Data files changed, reloading")
+                    self._reload_requested = True
+                last_seen = fingerprint
+            if self._reload_requested:
+                self._reload_requested = False
+                loaded = data_fingerprint(self.data_files)
+                self.reload()
+            if self.generation is None:
+                time.sleep(RESTART_DELAY)
+                self.generation = self.start_generation()
+
+        logger.info("Stopping")
+        if self.generation is not None:
+            self.retire(self.generation)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while self.retiring and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.reap()
+        for pid in self.retiring:
+            os.kill(pid, signal.SIGKILL)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Serve the API with several worker processes")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=5000, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="request threads per worker")
+    args = parser.parse_args()
+
+    listen_socket = socket.create_server((args.host, args.port), backlog=1024)
+    logger.info(f"Listening on {args.host}:{args.port} with {args.workers} workers")
+    Supervisor(listen_socket, args.workers, args.threads).run()
@@ -0,0 +1,155 @@
+"""Offline datasets for benchmarking and load testing: checked-in data and synthetic Alps huts."""
+
+import os
+from datetime import datetime, timedelta
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from filtering import DATE_FORMAT_OUT
+
+# rough bounding box of the Alps (lat_min, lat_max, lon_min, lon_max)
+ALPS_BBOX = (45.8, 47.8, 5.9, 13.5)
+METERS_PER_DEGREE_LAT = 111_320
+AVAILABILITY_CSV_PATH = os.path.join("data", "availability.csv")
+
+
+def load_checked_in_availability(path: str = AVAILABILITY_CSV_PATH) -> pd.DataFrame:
+    """
+    Load the checked-in availability table and convert it to the format of the hut_availability table.
+
+    The csv has one row per hut and room type and one column per date with entries such as "12 Spaces".
+    Places of all room types are summed up and dates without any place are dropped.
+
+    Args:
+        path: path to the availability csv
+
+    Returns:
+        pd.DataFrame with columns hut_id, date and places_avail
+    """
+    availability = pd.read_csv(path, index_col=0).drop("room_type", axis=1)
+    long_format = availability.melt(id_vars="id", var_name="date", value_name="places")
+    long_format["places_avail"] = pd.to_numeric(
+        long_format["places"].str.extract(r"^(\d+)", expand=False), errors="coerce"
+    )
+    long_format = long_format.groupby(["id", "date"])["places_avail"].sum().reset_index()
+    long_format = long_format[long_format["places_avail"] > 0].rename({"id": "hut_id"}, axis=1)
+    long_format["places_avail"] = long_format["places_avail"].astype(int)
+    return long_format.reset_index(drop=True)
+
+
+def make_date_list(nr_days: int, start_date: datetime = datetime(2025, 7, 1)) -> list[str]:
+    """Generate a list of consecutive dates in DATE_FORMAT_OUT."""
+    return [(start_date + timedelta(days=i)).strftime(DATE_FORMAT_OUT) for i in range(nr_days)]
+
+
+def make_huts(nr_huts: int, seed: int = 0) -> gpd.GeoDataFrame:
+    """
+    Generate a synthetic hut table with the same columns as data/huts_database.geojson.
+
+    Args:
+        nr_huts: number of huts
+        seed: random seed
+
+    Returns:
+        gpd.GeoDataFrame with uniformly distributed huts in the Alps bounding box
+    """
+    rng = np.random.default_rng(seed)
+    lat_min, lat_max, lon_min, lon_max = ALPS_BBOX
+    latitude = rng.uniform(lat_min, lat_max, nr_huts)
+    longitude = rng.uniform(lon_min, lon_max, nr_huts)
+    altitude = rng.integers(800, 3600, nr_huts).astype(float)
+    ids = np.arange(1, nr_huts + 1)
+    huts = pd.DataFrame(
+        {
+            "id": ids,
+            "name_original": [f"Hütte {i} DAV, Sektion {i % 50}" for i in ids],
+            "hut_warden": "-",
+            "phone": "-",
+            "total_places": rng.integers(10, 150, nr_huts),
+            "altitude": [f"{int(a)} m" for a in altitude],
+            "coordinates": "-",
+            "name": [f"Hütte {i}" for i in ids],
+            "verein": rng.choice(["DAV", "SAC", "ÖAV", "AVS", None], nr_huts),
+            "sektion": [f" Sektion {i % 50}" for i in ids],
+            "latitude": latitude,
+            "longitude": longitude,
+            "altitude_m": altitude,
+        }
+    )
+    return gpd.GeoDataFrame(huts, geometry=gpd.points_from_xy(longitude, latitude), crs="EPSG:4326")
+
+
+def make_connections(
+    huts: gpd.GeoDataFrame, avg_degree: int = 4, max_distance: int = 13000, chunk_size: int = 512
+) -> pd.DataFrame:
+    """
+    Connect every hut to its nearest neighbours, like data/feasible_connections.csv.
+
+    Args:
+        huts: hut table with latitude and longitude
+        avg_degree: number of nearest neighbours per hut (controls the connection density)
+        max_distance: connections longer than this (in meters) are dropped, -1 for no limit
+        chunk_size: number of source huts processed at once (bounds memory use)
+
+    Returns:
+        pd.DataFrame indexed by id_source with columns id_target and distance
+    """
+    # equirectangular projection to meters is accurate enough at the scale of hut connections
+    y = huts["latitude"].values * METERS_PER_DEGREE_LAT
+    x = huts["longitude"].values * METERS_PER_DEGREE_LAT * np.cos(np.radians(huts["latitude"].values.mean()))
+    coords = np.stack([x, y], axis=1)
+    ids = huts["id"].values
+    k = min(avg_degree, len(huts) - 1)
+
+    sources, targets, distances = [], [], []
+    for start in range(0, len(huts), chunk_size):
+        chunk = coords[start : start + chunk_size]
+        dist = np.linalg.norm(chunk[:, None, :] - coords[None, :, :], axis=-1)
+        # exclude the hut itself
+        dist[np.arange(len(chunk)), np.arange(start, start + len(chunk))] = np.inf
+        nearest = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        sources.append(np.repeat(ids[start : start + len(chunk)], k))
+        targets.append(ids[nearest].ravel())
+        distances.append(np.take_along_axis(dist, nearest, axis=1).ravel())
+
+    connections = pd.DataFrame(
+        {
+            "id_source": np.concatenate(sources),
+            "id_target": np.concatenate(targets),
+            "distance": np.concatenate(distances).astype(int),
+        }
+    )
+    if max_distance > 0:
+        connections = connections[connections["distance"] <= max_distance]
+    return connections.set_index("id_source")
+
+
+def make_availability(
+    hut_ids: np.ndarray, date_list: list[str], sparsity: float = 0.5, max_places: int = 40, seed: int = 0
+) -> pd.DataFrame:
+    """
+    Generate availability in the long format of the hut_availability table.
+
+    Args:
+        hut_ids: ids of the huts
+        date_list: dates in DATE_FORMAT_OUT
+        sparsity: fraction of (hut, date) cells without any free place
+        max_places: maximum number of free places per hut and date
+        seed: random seed
+
+    Returns:
+        pd.DataFrame with columns hut_id, date and places_avail
+    """
+    rng = np.random.default_rng(seed)
+    places = rng.integers(1, max_places + 1, (len(hut_ids), len(date_list)))
+    places[rng.random(places.shape) < sparsity] = 0
+    availability = pd.DataFrame(places, index=pd.Index(hut_ids, name="hut_id"), columns=date_list)
+    availability = availability.reset_index().melt(id_vars="hut_id", var_name="date", value_name="places_avail")
+    return availability[availability["places_avail"] > 0].reset_index(drop=True)
+
+
+def pivot_availability(availability: pd.DataFrame) -> pd.DataFrame:
+    """Pivot long-format availability to one row per hut and one column per date (as in multi_day_planning)."""
+    return availability.pivot(index="hut_id", columns="date", values="places_avail")
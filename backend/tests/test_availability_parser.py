@@ -0,0 +1,64 @@
+"""Tests of the parsers of the reservation website pages against the fixtures in fixtures/scraper."""
+
+import datetime
+import glob
+import json
+import os
+from typing import Optional, Text
+
+import pytest
+
+from availability_parser import (
+    convert_message_to_date,
+    parse_availability_table,
+    parse_calendar_month,
+    parse_preamble,
+)
+from benchmark import parse_availability_table_bs4
+
+FIXTURE_DIR = os.path.join("fixtures", "scraper")
+# parser of each page kind (prefix of the file name)
+PARSERS = {"calendar": parse_calendar_month, "table": parse_availability_table, "preamble": parse_preamble}
+PAGES = sorted(os.path.basename(path) for path in glob.glob(os.path.join(FIXTURE_DIR, "*.html")))
+
+
+def load_json(file_name: Text) -> object:
+    """Content of a JSON file of the fixtures."""
+    with open(os.path.join(FIXTURE_DIR, file_name), "r", encoding="utf-8") as infile:
+        return json.load(infile)
+
+
+def read_page(file_name: Text) -> Text:
+    """HTML of a page of the fixtures."""
+    with open(os.path.join(FIXTURE_DIR, file_name), "r", encoding="utf-8") as infile:
+        return infile.read()
+
+
+EXPECTED = load_json("expected.json")
+MESSAGES = load_json("preamble_messages.json")
+
+
+def test_all_pages_have_expected_results() -> None:
+    """Every page has a parser and an expected result, and every expected result has a page."""
+    assert {file_name.split("_")[0] for file_name in PAGES} <= set(PARSERS)
+    assert set(PAGES) == set(EXPECTED)
+
+
+@pytest.mark.parametrize("file_name", PAGES)
+def test_parse_page(file_name: Text) -> None:
+    """The parser of the page kind gives the expected result."""
+    assert PARSERS[file_name.split("_")[0]](read_page(file_name)) == EXPECTED[file_name]
+
+
+@pytest.mark.parametrize("file_name", [file_name for file_name in PAGES if file_name.startswith("table_")])
+def test_table_parsing_matches_baseline(file_name: Text) -> None:
+    """The lxml table parser gives the same result as the previous BeautifulSoup parsing."""
+    page_html = read_page(file_name)
+    assert parse_availability_table(page_html) == parse_availability_table_bs4(page_html)
+
+
+@pytest.mark.parametrize("message,date", [(message["message"], message["date"]) for message in MESSAGES])
+def test_convert_message_to_date(message: Text, date: Optional[Text]) -> None:
+    """Preamble and error messages give their date, messages of unknown formats give None."""
+    expected = datetime.datetime.fromisoformat(date) if date is not None else None
+    assert convert_message_to_date(message) == expected
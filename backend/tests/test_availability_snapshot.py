@@ -0,0 +1,41 @@
+"""Tests of the availability snapshots: coverage of dates, age and withdrawal of the latest version."""
+
+import datetime
+
+import pandas as pd
+
+from availability_snapshot import SnapshotReader, publish_snapshot, withdraw_snapshot
+
+AVAILABILITY = pd.DataFrame(
+    {
+        "hut_id": [1, 1, 2, 3],
+        "date": ["01.08.2026", "03.08.2026", "02.08.2026", "03.08.2026"],
+        "places_avail": [5, 0, 12, 3],
+    }
+)
+
+
+def test_snapshot_covers_its_dates(tmp_path: object) -> None:
+    """The snapshot answers the dates from its first to its last date, other dates are not covered."""
+    publish_snapshot(AVAILABILITY, str(tmp_path))
+    snapshot = SnapshotReader(str(tmp_path)).current()
+    assert snapshot.covers(["01.08.2026", "03.08.2026"])
+    assert not snapshot.covers(["31.07.2026", "01.08.2026"])
+    assert not snapshot.covers(["04.08.2026"])
+
+    availability = snapshot.availability_for_dates(["02.08.2026", "03.08.2026"], min_places=1)
+    assert sorted(availability.itertuples(index=False, name=None)) == [(2, "02.08.2026", 12), (3, "03.08.2026", 3)]
+
+
+def test_outdated_and_withdrawn_snapshots(tmp_path: object) -> None:
+    """A snapshot is fresh after publishing, outdated after the maximum age and not used after a withdrawal."""
+    publish_snapshot(AVAILABILITY, str(tmp_path))
+    reader = SnapshotReader(str(tmp_path))
+    snapshot = reader.current()
+    assert snapshot.is_fresh()
+    snapshot.created -= datetime.timedelta(days=2)
+    assert not snapshot.is_fresh()
+
+    withdraw_snapshot(str(tmp_path))
+    assert reader.current() is None
+    withdraw_snapshot(str(tmp_path))
@@ -0,0 +1,160 @@
+"""Tests of the concurrent crawl of the hut pages against a local HTTP server and of the parsing of the hut info."""
+
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+from build_hut_database import crawl_general_info, parse_altitude, parse_places
+
+HUT_PAGE = """<html><body>
+<h4>Hut {hut_id}, SAC Section {hut_id}</h4>
+<span>Total sleeping places: {places}</span>
+<span>Height above sea level: 2{hut_id:03d} m</span>
+<span>Coordinates: 625.565 / 151.040</span>
+</body></html>"""
+# hut that does not exist and hut that fails once before it is served
+MISSING_HUT, FLAKY_HUT = 13, 7
+
+
+class HutPageHandler(BaseHTTPRequestHandler):
+    """Serves the calendar page of a hut, records the requests and the client connections."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        """Answer a calendar page request."""
+        stats = self.server.stats
+        hut_id = int(parse_qs(urlparse(self.path).query)["hut_id"][0])
+        with stats["lock"]:
+            stats["requests"][hut_id] = stats["requests"].get(hut_id, 0) + 1
+            stats["connections"].add(self.client_address)
+            attempt = stats["requests"][hut_id]
+        if hut_id == MISSING_HUT:
+            self.reply(404, "not found")
+        elif hut_id == FLAKY_HUT and attempt == 1:
+            self.reply(503, "busy")
+        else:
+            self.reply(200, HUT_PAGE.format(hut_id=hut_id, places=10 + hut_id))
+
+    def reply(self, status: int, body: str) -> None:
+        """Send a response that keeps the connection open."""
+        encoded = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, *args: object) -> None:
+        """Do not log requests."""
+
+
+@pytest.fixture
+def hut_server() -> Iterator[Tuple[str, Dict]]:
+    """Local server of the hut pages, yields the url template and the request stats."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), HutPageHandler)
+    server.stats = {"lock": threading.Lock(), "requests": {}, "connections": set()}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/reservation/calendar?hut_id={{hut_id}}", server.stats
+    server.shutdown()
+    server.server_close()
+
+
+def test_crawl_with_pooled_session(hut_server: Tuple[str, Dict], tmp_path: object) -> None:
+    """All huts are crawled over at most max_workers connections, errors are retried or skipped."""
+    base_url, stats = hut_server
+    raw_path = str(tmp_path / "raw")
+    hut_ids = range(1, 21)
+    huts = crawl_general_info(raw_path, str(tmp_path / "huts.csv"), hut_ids, base_url=base_url, max_workers=4)
+
+    assert sorted(huts.index) == [hut_id for hut_id in hut_ids if hut_id != MISSING_HUT]
+    assert huts.loc[5, "name"] == "Hut 5"
+    assert huts.loc[5, "total_places"] == "15"
+    assert huts.loc[5, "coordinates"] == "625.565 / 151.040"
+    # the server error is retried by the session, the missing hut is skipped without raw file
+    assert stats["requests"][FLAKY_HUT] == 2
+    assert stats["requests"][MISSING_HUT] == 1
+    assert not os.path.exists(os.path.join(raw_path, f"{MISSING_HUT}.json"))
+    # keep-alive connections of the pool are reused
+    assert len(stats["connections"]) <= 4
+
+
+def test_fresh_raw_files_are_not_crawled(hut_server: Tuple[str, Dict], tmp_path: object) -> None:
+    """Huts with a raw file younger than max_age are read from the file."""
+    base_url, stats = hut_server
+    raw_path = tmp_path / "raw"
+    raw_path.mkdir()
+    with open(raw_path / "1.json", "w") as outfile:
+        json.dump({"id": 1, "name_original": "Cached hut", "name": "Cached hut"}, outfile)
+
+    huts = crawl_general_info(str(raw_path), str(tmp_path / "huts.csv"), [1, 2], base_url=base_url, max_workers=2)
+    assert huts.loc[1, "name"] == "Cached hut"
+    assert huts.loc[2, "name"] == "Hut 2"
+    assert 1 not in stats["requests"]
+
+    # with max_age 0, the raw file is outdated
+    crawl_general_info(str(raw_path), str(tmp_path / "huts.csv"), [1], base_url=base_url, max_age=0)
+    assert stats["requests"][1] == 1
+
+
+def get_alt_meter(alt: Optional[str]) -> float:
+    """Parsing of the altitude before the vectorized parse_altitude (reference)."""
+    try:
+        alt_int = float(alt.replace("m", ""))
+    except ValueError:
+        alt_int = pd.NA
+    except AttributeError:
+        alt_int = pd.NA
+    return alt_int
+
+
+def get_places_cleaned(places: str) -> int:
+    """Parsing of the places before the vectorized parse_places (reference)."""
+    try:
+        places_int = int(places)
+    except ValueError:
+        parts = places.split(" ")
+        places_int = 10
+        for p in parts:
+            try:
+                places_int = int(p)
+                break
+            except ValueError:
+                continue
+    return places_int
+
+
+# altitude and places texts of the hut pages, including the irregular ones
+ALTITUDES = ["2654 m", "2654m", " 1200 m ", "980", "3029.5 m", "-", "", "ca. 2000 m", "m", None]
+PLACES = ["40", " 40 ", "+12", "56 (winter room 10)", "approx. 25 places", "25  places", "12 + 4", "-", "", "none"]
+
+
+@pytest.mark.parametrize("text", ALTITUDES)
+def test_parse_altitude_like_before(text: Optional[str]) -> None:
+    """The vectorized altitude parsing gives the same altitude as the parsing per hut, NaN where it failed."""
+    expected = get_alt_meter(text)
+    parsed = parse_altitude(pd.Series([text], dtype=object)).iloc[0]
+    if pd.isna(expected):
+        assert pd.isna(parsed)
+    else:
+        assert parsed == expected
+
+
+@pytest.mark.parametrize("text", PLACES)
+def test_parse_places_like_before(text: str) -> None:
+    """The vectorized places parsing gives the same number of places as the parsing per hut."""
+    assert parse_places(pd.Series([text])).iloc[0] == get_places_cleaned(text)
+
+
+def test_parse_whole_columns() -> None:
+    """Parsing the whole column gives the values of the parsing per hut and keeps the index."""
+    places = pd.Series(PLACES, index=range(10, 10 + len(PLACES)))
+    assert parse_places(places).tolist() == [get_places_cleaned(text) for text in PLACES]
+    assert parse_places(places).index.equals(places.index)
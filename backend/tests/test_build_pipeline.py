@@ -0,0 +1,117 @@
+"""Tests of the incremental build with stages on temporary files."""
+
+import os
+from typing import List, Text
+
+from build_pipeline import Stage, content_hash, run_stages
+
+
+def write(path: Text, text: Text) -> None:
+    """Write a text file."""
+    with open(path, "w") as outfile:
+        outfile.write(text)
+
+
+def read(path: Text) -> Text:
+    """Read a text file."""
+    with open(path, "r") as infile:
+        return infile.read()
+
+
+def make_stages(directory: Text, calls: List[Text]) -> List[Stage]:
+    """Two stages: upper copies the source to upper.txt, count writes the length of upper.txt to count.txt."""
+    source, upper, count = (os.path.join(directory, name) for name in ("source.txt", "upper.txt", "count.txt"))
+
+    def run_upper() -> None:
+        """Write the source in upper case."""
+        calls.append("upper")
+        write(upper, read(source).upper())
+
+    def run_count() -> None:
+        """Write the length of the upper case text."""
+        calls.append("count")
+        write(count, str(len(read(upper))))
+
+    return [
+        Stage("upper", run_upper, inputs=[source], outputs=[upper]),
+        Stage("count", run_count, inputs=[upper], outputs=[count]),
+    ]
+
+
+def test_unchanged_stages_are_skipped(tmp_path: object) -> None:
+    """A second build without changes runs no stage."""
+    write(os.path.join(tmp_path, "source.txt"), "hut")
+    state_path = os.path.join(tmp_path, "build_state.json")
+    calls = []
+    assert run_stages(make_stages(tmp_path, calls), state_path) == ["upper", "count"]
+    assert run_stages(make_stages(tmp_path, calls), state_path) == []
+    assert calls == ["upper", "count"]
+    assert read(os.path.join(tmp_path, "count.txt")) == "3"
+
+
+def test_changed_input_reruns_the_dependent_stages(tmp_path: object) -> None:
+    """A changed input reruns its stage and the stages that read the new outputs."""
+    source = os.path.join(tmp_path, "source.txt")
+    state_path = os.path.join(tmp_path, "build_state.json")
+    write(source, "hut")
+    run_stages(make_stages(tmp_path, []), state_path)
+
+    write(source, "hutte")
+    calls = []
+    assert run_stages(make_stages(tmp_path, calls), state_path) == ["upper", "count"]
+    assert read(os.path.join(tmp_path, "count.txt")) == "5"
+
+    # same content written again: the hash is unchanged, so nothing runs
+    write(source, "hutte")
+    assert run_stages(make_stages(tmp_path, calls), state_path) == []
+
+
+def test_deleted_or_modified_output_reruns_its_stage(tmp_path: object) -> None:
+    """A stage whose output was deleted or modified runs again; its unchanged dependents are skipped."""
+    write(os.path.join(tmp_path, "source.txt"), "hut")
+    state_path = os.path.join(tmp_path, "build_state.json")
+    run_stages(make_stages(tmp_path, []), state_path)
+
+    os.remove(os.path.join(tmp_path, "count.txt"))
+    assert run_stages(make_stages(tmp_path, []), state_path) == ["count"]
+    assert read(os.path.join(tmp_path, "count.txt")) == "3"
+
+    # the rewritten output has the same content as before, so count is up to date
+    write(os.path.join(tmp_path, "upper.txt"), "edited")
+    assert run_stages(make_stages(tmp_path, []), state_path) == ["upper"]
+    assert read(os.path.join(tmp_path, "upper.txt")) == "HUT"
+
+
+def test_force_and_always_run(tmp_path: object) -> None:
+    """Forced builds run every stage, always_run stages run in every build."""
+    write(os.path.join(tmp_path, "source.txt"), "hut")
+    state_path = os.path.join(tmp_path, "build_state.json")
+    run_stages(make_stages(tmp_path, []), state_path)
+    assert run_stages(make_stages(tmp_path, []), state_path, force=True) == ["upper", "count"]
+
+    stages = make_stages(tmp_path, [])
+    stages[0].always_run = True
+    assert run_stages(stages, state_path) == ["upper"]
+
+
+def test_changed_params_rerun_the_stage(tmp_path: object) -> None:
+    """A change of the parameters of a stage changes its fingerprint."""
+    write(os.path.join(tmp_path, "source.txt"), "hut")
+    state_path = os.path.join(tmp_path, "build_state.json")
+    run_stages(make_stages(tmp_path, []), state_path)
+    stages = make_stages(tmp_path, [])
+    stages[1].params = {"pbf": "alps.osm.pbf"}
+    assert run_stages(stages, state_path) == ["count"]
+
+
+def test_content_hash_of_directories(tmp_path: object) -> None:
+    """Directories are hashed by the names and contents of their files, missing paths give None."""
+    directory = os.path.join(tmp_path, "raw")
+    os.makedirs(directory)
+    write(os.path.join(directory, "1.txt"), "a")
+    before = content_hash(directory)
+    write(os.path.join(directory, "2.txt"), "b")
+    assert content_hash(directory) != before
+    os.remove(os.path.join(directory, "2.txt"))
+    assert content_hash(directory) == before
+    assert content_hash(os.path.join(tmp_path, "missing")) is None
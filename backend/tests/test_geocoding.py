@@ -0,0 +1,145 @@
+"""Tests of the geocoding cache with a stand-in geocoder and of the parsing of the hut page coordinates."""
+
+from typing import Optional, Text
+
+import pytest
+
+from geocoding import (
+    CACHE_LOOKUP_CHUNK,
+    Coordinates,
+    GeocodeCache,
+    Geocoder,
+    StaticGeocoder,
+    geocode_queries,
+    normalize_query,
+    parse_page_coordinates,
+)
+
+# coordinates fields of the hut pages (data/huts_database.geojson) with the expected latitude and longitude
+PAGE_COORDINATES = [
+    # decimal degrees
+    ("46.510228 / 7.771708", 46.510228, 7.771708),
+    ("50.8973335,14.1357629", 50.8973335, 14.1357629),
+    ("47.509660 n / 10.057730 e", 47.509660, 10.057730),
+    ("50.927783 n 14.335000 e", 50.927783, 14.335000),
+    ("47.622288 n / 12.976388", 47.622288, 12.976388),
+    ("n 46.917222 / e 12.168889", 46.917222, 12.168889),
+    ('lat="47.065833" lon="10.504717"', 47.065833, 10.504717),
+    ("lat 47.91959308450919 / long 15.556729169593588", 47.919593, 15.556729),
+    ("n 50.52215°  e 9.91325°", 50.52215, 9.91325),
+    ("längengrad: 12.427530° breitengrad: 47.038877°", 47.038877, 12.427530),
+    # degrees, minutes and seconds
+    ("n 47° 42' 16\" , e 12° 14' 36\"", 47 + 42 / 60 + 16 / 3600, 12 + 14 / 60 + 36 / 3600),
+    ("47°41'35.2\"n 12°58'50.3\"e", 47 + 41 / 60 + 35.2 / 3600, 12 + 58 / 60 + 50.3 / 3600),
+    ("47° 25′ 38.139″ n , 11° 25′ 17.705″ o", 47 + 25 / 60 + 38.139 / 3600, 11 + 25 / 60 + 17.705 / 3600),
+    ("47° 32‘ 16“ nord,  10° 46‘ 24“ ost", 47 + 32 / 60 + 16 / 3600, 10 + 46 / 60 + 24 / 3600),
+    ("47° 7? 9? n 10° 8? 34? e", 47 + 7 / 60 + 9 / 3600, 10 + 8 / 60 + 34 / 3600),
+    ("47°34'1,5*n,14°36'43*o", 47 + 34 / 60 + 1.5 / 3600, 14 + 36 / 60 + 43 / 3600),
+    ("47°37´41.37``n 12°48`03.34``e", 47 + 37 / 60 + 41.37 / 3600, 12 + 48 / 60 + 3.34 / 3600),
+    ("längengrad: 12°23'32'' | breitengrad: 47°07'23''", 47 + 7 / 60 + 23 / 3600, 12 + 23 / 60 + 32 / 3600),
+    ("long. 11°37'52,0'' lat. 46°25'15,5''", 46 + 25 / 60 + 15.5 / 3600, 11 + 37 / 60 + 52 / 3600),
+    ("13°40’47’’, 47°02’13’’", 47 + 2 / 60 + 13 / 3600, 13 + 40 / 60 + 47 / 3600),
+    ("wgs84\t12°08'02,4''\t47°07'26,9''", 47 + 7 / 60 + 26.9 / 3600, 12 + 8 / 60 + 2.4 / 3600),
+    ("n 46 40 59,800,  e 11 16 54,972", 46 + 40 / 60 + 59.8 / 3600, 11 + 16 / 60 + 54.972 / 3600),
+    ("47° 0 4 n / 11° 44 50 o", 47 + 0 / 60 + 4 / 3600, 11 + 44 / 60 + 50 / 3600),
+    ("47.03.18 12.17.53", 47 + 3 / 60 + 18 / 3600, 12 + 17 / 60 + 53 / 3600),
+    # degrees and decimal minutes
+    ("47° 20,323' / 11° 30,436'", 47 + 20.323 / 60, 11 + 30.436 / 60),
+    ("n 47°35.221` o 12°52.168`", 47 + 35.221 / 60, 12 + 52.168 / 60),
+    ("n46 59.633  e010 53.283", 46 + 59.633 / 60, 10 + 53.283 / 60),
+    # swiss grid LV03 and LV95
+    ("625.565 / 151.040", 46.5102, 7.7717),
+    ("2'625'565 / 1'151'040", 46.5102, 7.7717),
+    ("2'628'518.938 / 1'151'333.890", 46.5127, 7.8102),
+    ("2’754’232/1’234’902", 47.2470, 9.4761),
+    ("e 638'830 / n 152'875", 46.5261, 7.9447),
+    ("720'450  150'535", 46.4953, 9.0077),
+    ("767 325 / 131 325", 46.3125, 9.6111),
+    # UTM with zone
+    ("utm: 32t, ost: 0644933, nord: 5271597.", 47.5816, 10.9274),
+    ("utm:33t 282075 5280893", 47.6447, 12.0983),
+    ("5167964 327067 33t wgs 84", 46.6429, 12.7403),
+    ("n 5.247.560 utm o 32.687.070", 47.3547, 11.4771),
+]
+
+# fields that are not recognized
+UNPARSEABLE = [
+    # UTM without zone: the easting is valid in zone 32 and 33
+    "utm y (nord) 5.231.585 / utm x (ost) 691.353",
+    "5280260 / 445766",
+    "xxx.xxx / yyy.yyy",
+    "x / y",
+    "115.554 km",
+    "gf4h+67 annaberg im lammertal",
+    # minutes and seconds above 60
+    "47°70'20.4\"n 12°32'77.9\"e",
+    "47.444722 / 11820833",
+    None,
+]
+
+
+@pytest.mark.parametrize("text,lat,lon", PAGE_COORDINATES)
+def test_parse_page_coordinates(text: Text, lat: float, lon: float) -> None:
+    """The formats of the hut pages give latitude and longitude (100 m precision for the grids)."""
+    assert parse_page_coordinates(text) == pytest.approx((lat, lon), abs=1e-3)
+
+
+@pytest.mark.parametrize("text", UNPARSEABLE)
+def test_parse_page_coordinates_unknown(text: Optional[Text]) -> None:
+    """Unknown or ambiguous formats give None."""
+    assert parse_page_coordinates(text) is None
+
+
+class FailingGeocoder(Geocoder):
+    """Geocoder whose lookups fail like network errors."""
+
+    def geocode(self, query: Text) -> Optional[Coordinates]:
+        """Raise an error."""
+        raise ConnectionError(query)
+
+
+def test_geocoder_is_abstract() -> None:
+    """Geocoders have to implement geocode."""
+    with pytest.raises(TypeError):
+        Geocoder()
+
+
+def test_geocode_queries_uses_cache(tmp_path: object) -> None:
+    """Cached queries (also not found ones) are not looked up again, normalized queries are looked up once."""
+    geocoder = StaticGeocoder({"Blüemlisalphütte, Kandersteg": (46.49, 7.77)})
+    cache = GeocodeCache(str(tmp_path / "geocode_cache.db"))
+    queries = ["Blüemlisalphütte, Kandersteg", "blüemlisalphütte ,  kandersteg", "Unknown hut"]
+
+    results = geocode_queries(queries, geocoder, cache)
+    assert results == {"blüemlisalphütte, kandersteg": (46.49, 7.77), "unknown hut": None}
+    assert geocoder.nr_lookups == 2
+
+    results = geocode_queries(queries, geocoder, cache)
+    assert results[normalize_query("Blüemlisalphütte, Kandersteg")] == (46.49, 7.77)
+    assert geocoder.nr_lookups == 2
+    cache.close()
+
+
+def test_failed_lookups_are_not_cached(tmp_path: object) -> None:
+    """Lookups that raise are returned as not found but retried in the next run."""
+    cache = GeocodeCache(str(tmp_path / "geocode_cache.db"))
+    assert geocode_queries(["Some hut"], FailingGeocoder(), cache) == {"some hut": None}
+    assert cache.get_many(["some hut"]) == {}
+
+    geocoder = StaticGeocoder({"Some hut": (47.0, 11.0)})
+    assert geocode_queries(["Some hut"], geocoder, cache) == {"some hut": (47.0, 11.0)}
+    assert geocoder.nr_lookups == 1
+    cache.close()
+
+
+def test_cache_reads_only_requested_queries(tmp_path: object) -> None:
+    """Cached results are read in chunks of requested queries, queries that are not cached are left out."""
+    cache = GeocodeCache(str(tmp_path / "geocode_cache.db"))
+    for i in range(2 * CACHE_LOOKUP_CHUNK + 10):
+        cache.put(f"hut {i}", None if i % 7 == 0 else (46.0, 7.0 + i / 1000))
+    requested = [f"hut {i}" for i in range(1, 3 * CACHE_LOOKUP_CHUNK, 2)] + ["hut 1"]
+    results = cache.get_many(requested)
+    assert set(results) == {f"hut {i}" for i in range(1, 2 * CACHE_LOOKUP_CHUNK + 10, 2)}
+    assert results["hut 7"] is None
+    assert results["hut 3"] == (46.0, 7.003)
+    cache.close()
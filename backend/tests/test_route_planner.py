@@ -0,0 +1,104 @@
+"""Tests of the route counts of the planner against the routes of the exhaustive search on small graphs."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from filtering import multi_day_route_finding
+from route_planner import RouteGraph, RoutePlanner
+
+DATES = ["01.08.2026", "02.08.2026", "03.08.2026", "04.08.2026", "05.08.2026"]
+# path 1 - 2 - 3 - 4 with a branch 3 - 5 (no cycles), and the same with a triangle 1 - 2 - 6 - 1
+TREE = [(1, 2), (2, 3), (3, 4), (3, 5)]
+TRIANGLE = [*TREE, (2, 6), (6, 1)]
+
+
+def make_connections(edges: list) -> pd.DataFrame:
+    """Connection table with both directions of every edge, 1 km each."""
+    sources = [source for edge in edges for source in (edge[0], edge[1])]
+    targets = [target for edge in edges for target in (edge[1], edge[0])]
+    return pd.DataFrame({"id_target": targets, "distance": 1000}, index=pd.Index(sources, name="id_source"))
+
+
+def make_availability(hut_ids: list, closed: tuple = ()) -> pd.DataFrame:
+    """Places per hut and date, NaN for the closed (hut, date index) cells."""
+    places = pd.DataFrame(5.0, index=hut_ids, columns=DATES)
+    for hut_id, day in closed:
+        places.loc[hut_id, DATES[day]] = np.nan
+    return places
+
+
+def nr_routes(edges: list, nr_days: int, closed: tuple = (), **fixed_huts: int) -> int:
+    """Number of routes with unique huts of the exhaustive search."""
+    hut_ids = sorted({hut for edge in edges for hut in edge})
+    routes = multi_day_route_finding(
+        DATES[:nr_days],
+        make_availability(hut_ids, closed),
+        {hut_id: f"Hut {hut_id}" for hut_id in hut_ids},
+        feasible_connections=make_connections(edges),
+        **fixed_huts,
+    )
+    return len(routes)
+
+
+def estimate(edges: list, nr_days: int, closed: tuple = (), **fixed_huts: int) -> int:
+    """Number of routes estimated by the planner."""
+    hut_ids = sorted({hut for edge in edges for hut in edge})
+    planner = RoutePlanner(
+        DATES[:nr_days],
+        make_availability(hut_ids, closed),
+        {},
+        nr_days,
+        feasible_connections=make_connections(edges),
+        **fixed_huts,
+    )
+    return planner.estimated_routes
+
+
+@pytest.mark.parametrize("nr_days", [2, 3, 4, 5])
+def test_estimate_is_exact_without_cycles(nr_days: int) -> None:
+    """Without cycles, every route that does not go back to the previous hut has unique huts."""
+    assert estimate(TREE, nr_days) == nr_routes(TREE, nr_days)
+    closed = ((3, 1), (5, 3))
+    assert estimate(TREE, nr_days, closed) == nr_routes(TREE, nr_days, closed)
+
+
+@pytest.mark.parametrize("nr_days", [2, 3, 4, 5])
+def test_estimate_bounds_routes_with_cycles(nr_days: int) -> None:
+    """Cycles of three huts are only excluded by the search, the estimate is exact for up to three days."""
+    if nr_days <= 3:
+        assert estimate(TRIANGLE, nr_days) == nr_routes(TRIANGLE, nr_days)
+    else:
+        assert estimate(TRIANGLE, nr_days) > nr_routes(TRIANGLE, nr_days)
+
+
+@pytest.mark.parametrize("fixed_huts", [{"start_hut_id": 3}, {"end_hut_id": 4}, {"start_hut_id": 1, "end_hut_id": 5}])
+def test_estimate_with_fixed_huts(fixed_huts: dict) -> None:
+    """Searches from or to a fixed hut are counted from or to that hut only."""
+    for nr_days in (2, 3, 4):
+        assert estimate(TREE, nr_days, **fixed_huts) == nr_routes(TREE, nr_days, **fixed_huts)
+
+
+def test_routes_per_day_counts_partial_routes() -> None:
+    """The count after each day is the number of partial routes of that many days."""
+    hut_ids = [1, 2, 3, 4, 5]
+    graph = RouteGraph(DATES[:3], make_availability(hut_ids), make_connections(TREE))
+    # 5 huts, 8 one-day moves, and the moves without going back: 1-2-3, 2-3-4, 2-3-5, 3-2-1, 4-3-2, 4-3-5, 5-3-2, 5-3-4
+    assert graph.routes_per_day(3).tolist() == [5, 8, 8]
+
+
+@pytest.mark.parametrize("nr_days", [2, 3, 4, 5])
+def test_route_huts_contain_huts_of_all_routes(nr_days: int) -> None:
+    """The marker huts contain the huts of all routes, and without cycles no other huts."""
+    for edges in (TREE, TRIANGLE):
+        hut_ids = sorted({hut for edge in edges for hut in edge})
+        closed = ((5, nr_days - 1),)
+        graph = RouteGraph(DATES[:nr_days], make_availability(hut_ids, closed), make_connections(edges))
+        routes = multi_day_route_finding(
+            DATES[:nr_days], make_availability(hut_ids, closed), {}, feasible_connections=make_connections(edges)
+        )
+        route_hut_ids = set(routes[[f"day{i}" for i in range(nr_days)]].to_numpy().ravel())
+        marker_ids = set(graph.hut_ids[graph.route_huts(nr_days)])
+        assert route_hut_ids <= marker_ids
+        if edges == TREE:
+            assert route_hut_ids == marker_ids
@@ -0,0 +1,60 @@
+"""Tests of the coverage of queries by the precomputed routes on the hut database with random availability."""
+
+from datetime import date
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+
+from filtering import filter_huts, multi_day_route_finding
+from route_precompute import PrecomputedRoutes, precompute_routes, weekend_trips
+
+# one region (latitude, longitude, radius in km)
+REGION = (46.55, 7.95, 40)
+TODAY = date(2026, 7, 1)
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory: pytest.TempPathFactory) -> tuple:
+    """Precomputed routes of the region, the huts and the availability of the first weekend trips."""
+    huts = gpd.read_file("data/huts_database.geojson")
+    rng = np.random.default_rng(0)
+    trips = weekend_trips(TODAY, nr_weekends=1)
+    dates = sorted({day for trip in trips for day in trip})
+    availability = pd.DataFrame(
+        [(hut_id, day, int(rng.integers(1, 20))) for hut_id in huts["id"] for day in dates if rng.random() < 0.6],
+        columns=["hut_id", "date", "places_avail"],
+    )
+    path = str(tmp_path_factory.mktemp("routes") / "precomputed_routes.npz")
+    precompute_routes(availability, huts, TODAY, path, regions={"region": REGION})
+    return PrecomputedRoutes(path), huts, availability, trips
+
+
+def test_covered_query_gives_same_routes(store: tuple) -> None:
+    """A query whose huts lie within the region gives the routes of the search on the availability."""
+    precomputed, huts, availability, trips = store
+    lat, lon, radius = REGION
+    hut_ids = filter_huts(huts, start_lat=lat, start_lon=lon, max_distance=radius - 10)["id"]
+    key = precomputed.find(hut_ids, trips[0])
+    assert key is not None
+
+    id_to_hut = huts.set_index("id")["name"].to_dict()
+    avail_per_date = availability.pivot(index="hut_id", columns="date", values="places_avail")
+    expected = multi_day_route_finding(
+        trips[0], avail_per_date[avail_per_date.index.isin(hut_ids)].reindex(columns=trips[0]), id_to_hut
+    )
+    routes = precomputed.routes(key, hut_ids, id_to_hut)
+    assert len(routes) == len(expected) > 0
+
+
+def test_huts_outside_region_are_not_covered(store: tuple) -> None:
+    """A query with a hut outside of the region (even if only slightly) or with other dates is not covered."""
+    precomputed, huts, _, trips = store
+    lat, lon, radius = REGION
+    region_hut_ids = filter_huts(huts, start_lat=lat, start_lon=lon, max_distance=radius)["id"]
+    wider_hut_ids = filter_huts(huts, start_lat=lat, start_lon=lon, max_distance=radius + 1)["id"]
+    assert len(wider_hut_ids) > len(region_hut_ids)
+    assert precomputed.find(region_hut_ids, trips[0]) is not None
+    assert precomputed.find(wider_hut_ids, trips[0]) is None
+    assert precomputed.find(region_hut_ids, ["01.01.2020", "02.01.2020"]) is None
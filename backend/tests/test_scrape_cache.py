@@ -0,0 +1,84 @@
+"""Tests of the cache of scraped availability and of the diff of places to write to the database."""
+
+import datetime
+import os
+from typing import Dict, List, Text, Tuple
+
+from scrape_cache import ScrapeCache, month_key, month_key_from_offset
+
+HUT_ID = 42
+
+
+def db_rows(hut_id: int, pending: Dict[Text, Tuple[object, object]]) -> List[Tuple[int, Text, int]]:
+    """Rows that avail_update_script writes to the database for a pending diff (only numbers of places)."""
+    return [
+        (hut_id, date, int(places))
+        for date, (_, places) in pending.items()
+        if isinstance(places, int) or places.isdigit()
+    ]
+
+
+def test_written_places_are_not_pending(tmp_path: object) -> None:
+    """Places are pending until they are marked as written, an unchanged scrape of the next run has no diff."""
+    cache = ScrapeCache(os.path.join(tmp_path, "scrape_cache.db"))
+    places = {"01.07.2026": "12", "02.07.2026": "0", "01.08.2026": 5}
+    cache.store_scraped(HUT_ID, places)
+    pending = cache.pending_diff(HUT_ID)
+    assert pending == {date: (None, value) for date, value in places.items()}
+    assert cache.pending_diff(HUT_ID + 1) == {}
+
+    cache.mark_written(HUT_ID, {date: new for date, (_, new) in pending.items()})
+    assert cache.pending_diff(HUT_ID) == {}
+
+    # next run: the same places are scraped again, one date changed
+    cache.store_scraped(HUT_ID, places)
+    assert cache.pending_diff(HUT_ID) == {}
+    cache.store_scraped(HUT_ID, {**places, "02.07.2026": "3"})
+    assert cache.pending_diff(HUT_ID) == {"02.07.2026": ("0", "3")}
+    cache.close()
+
+
+def test_partial_write_keeps_other_dates_pending(tmp_path: object) -> None:
+    """Dates of a month that were not written stay pending, also after the cache is reopened."""
+    path = os.path.join(tmp_path, "scrape_cache.db")
+    cache = ScrapeCache(path)
+    cache.store_scraped(HUT_ID, {"01.07.2026": "12", "02.07.2026": "8", "03.07.2026": "4"})
+    cache.mark_written(HUT_ID, {"02.07.2026": "8"})
+    assert cache.pending_diff(HUT_ID) == {"01.07.2026": (None, "12"), "03.07.2026": (None, "4")}
+    cache.close()
+
+    cache = ScrapeCache(path)
+    cache.mark_written(HUT_ID, {"01.07.2026": "12", "03.07.2026": "4"})
+    assert cache.pending_diff(HUT_ID) == {}
+    cache.close()
+
+
+def test_closed_dates_are_written_without_rows(tmp_path: object) -> None:
+    """Non-numeric places (e.g. closed huts) give no database row, but are marked written and not pending again."""
+    cache = ScrapeCache(os.path.join(tmp_path, "scrape_cache.db"))
+    cache.store_scraped(HUT_ID, {"01.07.2026": "closed", "02.07.2026": "7"})
+    pending = cache.pending_diff(HUT_ID)
+    assert db_rows(HUT_ID, pending) == [(HUT_ID, "02.07.2026", 7)]
+
+    cache.mark_written(HUT_ID, {date: new for date, (_, new) in pending.items()})
+    cache.store_scraped(HUT_ID, {"01.07.2026": "closed", "02.07.2026": "7"})
+    assert cache.pending_diff(HUT_ID) == {}
+
+    # the hut opens: the date is pending with its previous text
+    cache.store_scraped(HUT_ID, {"01.07.2026": "20", "02.07.2026": "7"})
+    pending = cache.pending_diff(HUT_ID)
+    assert pending == {"01.07.2026": ("closed", "20")}
+    assert db_rows(HUT_ID, pending) == [(HUT_ID, "01.07.2026", 20)]
+    cache.close()
+
+
+def test_fresh_months_and_month_keys(tmp_path: object) -> None:
+    """Scraped months are fresh within the window, month keys wrap around the year."""
+    cache = ScrapeCache(os.path.join(tmp_path, "scrape_cache.db"))
+    cache.store_scraped(HUT_ID, {"31.12.2026": "1", "01.01.2027": "2"})
+    assert cache.fresh_months(HUT_ID, 60) == {"2026-12", "2027-01"}
+    assert cache.fresh_months(HUT_ID, -60) == set()
+    cache.close()
+
+    assert month_key("05.03.2027") == "2027-03"
+    assert month_key_from_offset(datetime.date(2026, 11, 19), 2) == "2027-01"
@@ -0,0 +1,56 @@
+"""Tests of the trail distances on a small synthetic network."""
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+
+from trail_network import compute_trail_connections
+
+# nodes on a straight east-west path, about 780 m apart (0.01 degree of longitude at 45.5 degree latitude)
+NODE_LONGITUDES = [7.0, 7.01, 7.02, 7.03, 7.04]
+LATITUDE = 45.5
+
+
+def make_network() -> tuple:
+    """Nodes and edges of a straight path with 5 nodes."""
+    nodes = gpd.GeoDataFrame(
+        {"id": [101, 102, 103, 104, 105], "lon": NODE_LONGITUDES, "lat": LATITUDE},
+        geometry=gpd.points_from_xy(NODE_LONGITUDES, [LATITUDE] * 5),
+        crs="EPSG:4326",
+    )
+    edges = pd.DataFrame({"u": [101, 102, 103, 104], "v": [102, 103, 104, 105], "length": [780.0] * 4})
+    return nodes, edges
+
+
+def make_huts(longitudes: list) -> gpd.GeoDataFrame:
+    """Huts at the given longitudes on the path, 100 m higher from west to east."""
+    return gpd.GeoDataFrame(
+        {"id": np.arange(1, len(longitudes) + 1), "altitude_m": [2000.0 + 100 * i for i in range(len(longitudes))]},
+        geometry=gpd.points_from_xy(longitudes, [LATITUDE] * len(longitudes)),
+        crs="EPSG:4326",
+    )
+
+
+@pytest.mark.parametrize("nr_workers", [1, 2])
+def test_fewer_huts_than_chunks(nr_workers: int) -> None:
+    """Fewer snapped huts than chunks (4 per worker) must not give empty chunks."""
+    nodes, edges = make_network()
+    huts = make_huts([7.0, 7.02, 7.04])
+    connections = compute_trail_connections(huts, nodes, edges, max_distance=2000, nr_workers=nr_workers)
+
+    pairs = set(zip(connections.index, connections["id_target"], strict=True))
+    # neighbouring huts are 2 edges apart, the outer huts 4 edges (above the maximum distance)
+    assert pairs == {(1, 2), (2, 1), (2, 3), (3, 2)}
+    assert (connections["distance"] == 1560).all()
+    # without node elevations, the ascent is the altitude difference of the huts
+    assert connections.loc[1, "ascent"] == 100
+    assert connections.loc[2].set_index("id_target").loc[1, "ascent"] == 0
+
+
+def test_no_snapped_huts() -> None:
+    """No hut close to the network gives no connections."""
+    nodes, edges = make_network()
+    huts = make_huts([8.0])
+    connections = compute_trail_connections(huts, nodes, edges, nr_workers=2)
+    assert len(connections) == 0
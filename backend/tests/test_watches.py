@@ -0,0 +1,69 @@
+"""Tests of the watch store and of the matching of changed cells against the watches."""
+
+import datetime
+
+from watches import Notifier, WatchStore, notify_changes, public_watch
+
+
+def test_watch_requires_token(tmp_path: object) -> None:
+    """A watch can only be read and removed with its token, the contact is not public."""
+    store = WatchStore(str(tmp_path / "watches.db"))
+    watch_id, token = store.add("user@example.com", [5], ["01.08.2026"], min_places=2)
+    other_id, other_token = store.add("other@example.com", [6], ["01.08.2026"])
+    assert watch_id != other_id and token != other_token
+
+    assert store.get(watch_id, token)["contact"] == "user@example.com"
+    assert "token_hash" not in store.get(watch_id, token)
+    assert "contact" not in public_watch(store.get(watch_id, token))
+    for wrong_token in (None, "", other_token, token[:-1]):
+        assert store.get(watch_id, wrong_token) is None
+        assert not store.remove(watch_id, wrong_token)
+    assert store.get(watch_id, token) is not None
+
+    assert store.remove(watch_id, token)
+    assert store.get(watch_id, token) is None
+    assert [watch["id"] for watch in store.active(datetime.date(2026, 7, 1))] == [other_id]
+    store.close()
+
+
+class RecordingNotifier(Notifier):
+    """Notifier that records the notifications."""
+
+    def __init__(self) -> None:
+        self.notifications = []
+
+    def notify(self, watch: dict, matches: list) -> None:
+        """Record the matches of a watch."""
+        self.notifications.append((watch["id"], matches))
+
+
+def test_notify_changes_uses_index_of_cells(tmp_path: object) -> None:
+    """Changed cells are matched when the places cross the minimum, removed and expired watches are not indexed."""
+    store = WatchStore(str(tmp_path / "watches.db"))
+    hut_watch, _ = store.add("a", [5], ["01.08.2026", "02.08.2026"], min_places=2)
+    region_watch, _ = store.add("b", range(1, 201), [f"{day:02d}.08.2026" for day in range(1, 31)], min_places=1)
+    removed_watch, removed_token = store.add("c", [5], ["01.08.2026"])
+    expired_watch, _ = store.add("d", [5], ["01.06.2026"])
+    assert store.remove(removed_watch, removed_token)
+
+    changes = [
+        (5, "01.08.2026", 0, 3),  # both watches
+        (5, "02.08.2026", 1, 1),  # below the minimum of the hut watch, no crossing for the region watch
+        (7, "03.08.2026", None, 4),  # unknown before
+        (300, "01.08.2026", 0, 10),  # not watched
+        (5, "01.06.2026", 0, 10),  # expired
+    ]
+    notifier = RecordingNotifier()
+    matches = notify_changes(changes, store, notifier, datetime.date(2026, 7, 1))
+    assert matches == {
+        hut_watch: [{"hut_id": 5, "date": "01.08.2026", "places": 3}],
+        region_watch: [
+            {"hut_id": 5, "date": "01.08.2026", "places": 3},
+            {"hut_id": 7, "date": "03.08.2026", "places": 4},
+        ],
+    }
+    assert sorted(watch_id for watch_id, _ in notifier.notifications) == [hut_watch, region_watch]
+    nr_cells = store.conn.execute("SELECT COUNT(*) FROM watch_cells").fetchone()[0]
+    assert nr_cells == 2 + 200 * 30
+    assert expired_watch not in store.watches([expired_watch])
+    store.close()
@@ -0,0 +1,260 @@
+"""
+Hut-to-hut walking distances and ascent on the trail network of a local OpenStreetMap extract.
+
+The walking network of the extract is loaded with pyrosm, every hut is snapped to its nearest network node and
+bounded shortest path searches from all huts run in parallel processes. The result has the same format as
+data/feasible_connections.csv (plus an ascent column), so the route finder uses trail distances instead of beelines
+without any additional cost per request. Run from the backend folder:
+
+    python trail_network.py --pbf data/alps.osm.pbf --workers 8
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+CRS_METRIC = 2421
+# same limit as the beeline connections (see build_hut_database.save_feasible_connections)
+MAX_TRAIL_DISTANCE = 13000
+# huts further away from the next path are not connected
+MAX_SNAP_DISTANCE = 500
+
+# state of the worker processes (graph and huts), set once per process by _init_worker
+_WORKER_STATE: Dict = {}
+
+
+def load_trail_network(pbf_path: str) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """
+    Load the walking network (hiking paths, tracks, footways) of an OSM extract.
+
+    Args:
+        pbf_path: path of the .osm.pbf file
+
+    Returns:
+        tuple of nodes (columns id, lon, lat) and edges (columns u, v, length in meters)
+    """
+    # only needed to read the extract, the distance computation works on any nodes and edges
+    from pyrosm import OSM
+
+    osm = OSM(pbf_path)
+    nodes, edges = osm.get_network(network_type="walking", nodes=True)
+    return nodes, edges
+
+
+def build_graph(nodes: pd.DataFrame, edges: pd.DataFrame) -> csr_matrix:
+    """
+    Build an undirected sparse graph of the trail network, weighted by the edge length in meters.
+
+    Args:
+        nodes: network nodes, the position in this table is the node index in the graph
+        edges: network edges with columns u, v (osm node ids) and length
+
+    Returns:
+        upper triangular adjacency matrix (use with directed=False)
+    """
+    node_index = pd.Series(np.arange(len(nodes)), index=nodes["id"].values)
+    u = node_index.reindex(edges["u"].values).to_numpy()
+    v = node_index.reindex(edges["v"].values).to_numpy()
+    valid = ~(np.isnan(u) | np.isnan(v)) & (u != v)
+    pairs = pd.DataFrame(
+        {
+            "a": np.minimum(u[valid], v[valid]).astype(int),
+            "b": np.maximum(u[valid], v[valid]).astype(int),
+            "length": edges["length"].to_numpy(dtype=float)[valid],
+        }
+    )
+    # parallel ways between the same nodes: keep the shortest (the sparse constructor would sum them)
+    pairs = pairs.groupby(["a", "b"], as_index=False)["length"].min()
+    return csr_matrix((pairs["length"], (pairs["a"], pairs["b"])), shape=(len(nodes), len(nodes)))
+
+
+def snap_huts(huts: gpd.GeoDataFrame, nodes: gpd.GeoDataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the nearest network node of every hut.
+
+    Args:
+        huts: huts with point geometries
+        nodes: network nodes with point geometries
+
+    Returns:
+        tuple of node index and snap distance (meters) per hut
+    """
+    node_coords = nodes.geometry.to_crs(CRS_METRIC).get_coordinates().to_numpy()
+    hut_coords = huts.geometry.to_crs(CRS_METRIC).get_coordinates().to_numpy()
+    snap_distance, node_index = cKDTree(node_coords).query(hut_coords)
+    return node_index, snap_distance
+
+
+def path_ascent(
+    predecessors: np.ndarray, target_node: int, elevations: np.ndarray, start_alt: float, end_alt: float
+) -> float:
+    """
+    Sum of the climbs along the shortest path to a target node.
+
+    Args:
+        predecessors: predecessor of every node in the shortest path tree of the source
+        target_node: node index of the target hut
+        elevations: elevation per node (NaN if unknown)
+        start_alt: altitude of the source hut
+        end_alt: altitude of the target hut
+
+    Returns:
+        ascent in meters
+    """
+    path = [target_node]
+    while predecessors[path[-1]] >= 0:
+        path.append(predecessors[path[-1]])
+    profile = np.concatenate([[start_alt], elevations[path[::-1]], [end_alt]])
+    profile = profile[~np.isnan(profile)]
+    return float(np.clip(np.diff(profile), 0, None).sum())
+
+
+def _init_worker(state: Dict) -> None:
+    _WORKER_STATE.update(state)
+
+
+def _connections_from(source_positions: np.ndarray) -> List[Dict]:
+    """Trail connections from a chunk of huts (positions in the hut arrays of the worker state)."""
+    state = _WORKER_STATE
+    max_distance = state["max_distance"]
+    distances, predecessors = dijkstra(
+        state["graph"],
+        directed=False,
+        indices=state["hut_nodes"][source_positions],
+        return_predecessors=True,
+        # the snap distances are added to the path length
+        limit=max_distance - state["snap_distance"][source_positions].min(),
+    )
+    connections = []
+    for row, source in enumerate(source_positions):
+        total = state["snap_distance"][source] + distances[row, state["hut_nodes"]] + state["snap_distance"]
+        for target in np.nonzero(total <= max_distance)[0]:
+            if target == source:
+                continue
+            ascent = path_ascent(
+                predecessors[row],
+                state["hut_nodes"][target],
+                state["elevations"],
+                state["altitudes"][source],
+                state["altitudes"][target],
+            )
+            connections.append(
+                {
+                    "id_source": state["hut_ids"][source],
+                    "id_target": state["hut_ids"][target],
+                    "distance": int(total[target]),
+                    "ascent": int(ascent),
+                }
+            )
+    return connections
+
+
+def compute_trail_connections(
+    huts: gpd.GeoDataFrame,
+    nodes: gpd.GeoDataFrame,
+    edges: pd.DataFrame,
+    max_distance: int = MAX_TRAIL_DISTANCE,
+    max_snap_distance: float = MAX_SNAP_DISTANCE,
+    node_elevations: pd.Series = None,
+    nr_workers: int = None,
+) -> pd.DataFrame:
+    """
+    Compute the walking distance and ascent between all pairs of huts that are connected by a short enough trail.
+
+    Args:
+        huts: huts with columns id, altitude_m and point geometries
+        nodes: network nodes (see load_trail_network)
+        edges: network edges (see load_trail_network)
+        max_distance: maximum walking distance in meters
+        max_snap_distance: maximum distance in meters between a hut and its nearest network node
+        node_elevations: elevation per osm node id (e.g. sampled from a terrain model). Without them, the ascent is
+            the altitude difference of the huts
+        nr_workers: number of processes (default: number of CPUs)
+
+    Returns:
+        pd.DataFrame with index id_source and columns id_target, distance and ascent, as data/feasible_connections.csv
+    """
+    graph = build_graph(nodes, edges)
+    node_index, snap_distance = snap_huts(huts, nodes)
+    snapped = snap_distance <= max_snap_distance
+    if not snapped.all():
+        print(f"{(~snapped).sum()} huts are further than {max_snap_distance}m from the trail network - skip them")
+
+    elevations = np.full(len(nodes), np.nan)
+    if node_elevations is not None:
+        elevations = node_elevations.reindex(nodes["id"].values).to_numpy(dtype=float)
+    state = {
+        "graph": graph,
+        "hut_nodes": node_index[snapped],
+        "snap_distance": snap_distance[snapped],
+        "hut_ids": huts["id"].values[snapped],
+        "altitudes": huts["altitude_m"].to_numpy(dtype=float)[snapped],
+        "elevations": elevations,
+        "max_distance": max_distance,
+    }
+
+    nr_workers = nr_workers or os.cpu_count()
+    nr_snapped = int(snapped.sum())
+    # several chunks per worker to balance dense and sparse regions of the network, but no empty chunks
+    chunks = np.array_split(np.arange(nr_snapped), min(nr_snapped, nr_workers * 4)) if nr_snapped > 0 else []
+    with ProcessPoolExecutor(max_workers=nr_workers, initializer=_init_worker, initargs=(state,)) as executor:
+        connections = [c for chunk_connections in executor.map(_connections_from, chunks) for c in chunk_connections]
+
+    trail_connections = pd.DataFrame(connections, columns=["id_source", "id_target", "distance", "ascent"])
+    return trail_connections.sort_values(["id_source", "id_target"]).set_index("id_source")
+
+
+def build_trail_connections(
+    pbf_path: str,
+    out_path: str = os.path.join("data", "feasible_connections.csv"),
+    max_distance: int = MAX_TRAIL_DISTANCE,
+    max_snap_distance: float = MAX_SNAP_DISTANCE,
+    node_elevations_path: str = None,
+    nr_workers: int = None,
+) -> None:
+    """Compute the trail connections of all huts in data/huts_database.geojson and save them as csv."""
+    huts = gpd.read_file(os.path.join("data", "huts_database.geojson")).dropna(subset=["latitude", "longitude"])
+    nodes, edges = load_trail_network(pbf_path)
+    node_elevations = None
+    if node_elevations_path is not None:
+        node_elevations = pd.read_csv(node_elevations_path, index_col="id")["ele"]
+
+    trail_connections = compute_trail_connections(
+        huts,
+        nodes,
+        edges,
+        max_distance=max_distance,
+        max_snap_distance=max_snap_distance,
+        node_elevations=node_elevations,
+        nr_workers=nr_workers,
+    )
+    trail_connections.to_csv(out_path)
+    print(f"Saved {len(trail_connections)} trail connections to {out_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute hut-to-hut trail distances from an OSM extract")
+    parser.add_argument("--pbf", required=True, help="path of the OSM extract (.osm.pbf)")
+    parser.add_argument("--out", default=os.path.join("data", "feasible_connections.csv"), help="output csv")
+    parser.add_argument("--max-distance", type=int, default=MAX_TRAIL_DISTANCE, help="maximum walking distance (m)")
+    parser.add_argument("--max-snap-distance", type=float, default=MAX_SNAP_DISTANCE, help="max hut-path distance (m)")
+    parser.add_argument("--node-elevations", default=None, help="optional csv with columns id (osm node id) and ele")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: number of CPUs)")
+    args = parser.parse_args()
+
+    build_trail_connections(
+        args.pbf,
+        args.out,
+        max_distance=args.max_distance,
+        max_snap_distance=args.max_snap_distance,
+        node_elevations_path=args.node_elevations,
+        nr_workers=args.workers,
+    )
@@ -0,0 +1,373 @@
+"""
+Availability watches: users register a hut (or a region) and dates and are notified when enough places free up.
+
+Watches are kept in a SQLite store together with a persistent inverted index of their cells (hut_id, date), which is
+written when a watch is registered. After every availability update, the changed cells (hut, date, previous and new
+places) are looked up in this index with one indexed query, so the matching cost grows with the number of changed
+cells and not with the number of watches times huts times dates. A watch matches a cell when
+the places cross its minimum (from below min_places to at least min_places). Matches are sent through a notifier,
+which can be replaced by a local stand-in (e.g. for tests or a deployment without Slack).
+"""
+
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WATCH_DB_PATH = os.path.join("data", "watches.db")
+# store that the app registers the watches in and the updater matches them from
+WATCH_DB_PATH = os.environ.get("HUTFINDER_WATCH_DB", DEFAULT_WATCH_DB_PATH)
+DEFAULT_NOTIFICATION_LOG_PATH = os.path.join("data", "watch_notifications.jsonl")
+SLACK_CHANNEL = "#hut-finder"
+# header of the token that is issued on registration and required to read or remove a watch
+WATCH_TOKEN_HEADER = "X-Watch-Token"
+# fields of a watch that are not returned by the API
+PRIVATE_FIELDS = ("contact",)
+DATE_FORMAT_DB = "%d.%m.%Y"
+
+CREATE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS watches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    contact TEXT NOT NULL,
+    hut_ids TEXT NOT NULL,
+    dates TEXT NOT NULL,
+    min_places INT NOT NULL,
+    region TEXT,
+    last_date TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_notified_at REAL,
+    token_hash TEXT
+);
+"""
+# inverted index of the watches: one row per watched hut and date
+CREATE_CELLS_QUERY = """
+CREATE TABLE IF NOT EXISTS watch_cells (
+    hut_id INT NOT NULL,
+    date TEXT NOT NULL,
+    watch_id INT NOT NULL,
+    min_places INT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS watch_cells_cell ON watch_cells (hut_id, date);
+CREATE INDEX IF NOT EXISTS watch_cells_watch ON watch_cells (watch_id);
+"""
+# changed cells of a matching, joined with the index (CROSS JOIN makes SQLite loop over the changed cells and look
+# up each of them in the index, instead of scanning the index)
+CREATE_CHANGES_QUERY = """
+CREATE TEMP TABLE IF NOT EXISTS changed_cells (
+    hut_id INT NOT NULL,
+    date TEXT NOT NULL,
+    previous_places INT,
+    places INT NOT NULL
+);
+"""
+MATCH_QUERY = """
+SELECT cells.watch_id, changes.hut_id, changes.date, changes.places
+FROM changed_cells AS changes
+CROSS JOIN watch_cells AS cells ON cells.hut_id = changes.hut_id AND cells.date = changes.date
+WHERE changes.places >= cells.min_places
+    AND (changes.previous_places IS NULL OR changes.previous_places < cells.min_places)
+ORDER BY cells.watch_id, changes.rowid
+"""
+
+# changed cell: (hut_id, date (dd.mm.yyyy), previous places (None if unknown), new places)
+Change = Tuple[int, Text, Optional[int], int]
+
+
+class WatchStore:
+    """SQLite store of the watches. The connection is shared by the threads of the app."""
+
+    def __init__(self, path: Text = DEFAULT_WATCH_DB_PATH) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self.conn.execute(CREATE_TABLE_QUERY)
+            # stores created before the watch tokens: their watches cannot be read or removed through the API
+            columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(watches)")}
+            if "token_hash" not in columns:
+                self.conn.execute("ALTER TABLE watches ADD COLUMN token_hash TEXT")
+            # stores created before the index of the cells: index the existing watches once
+            has_cells = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'watch_cells'").fetchone()
+            self.conn.executescript(CREATE_CELLS_QUERY)
+            if has_cells is None:
+                for row in self.conn.execute("SELECT * FROM watches").fetchall():
+                    watch = _row_to_watch(row)
+                    self._insert_cells(watch["id"], watch["hut_ids"], watch["dates"], watch["min_places"])
+            self.conn.commit()
+
+    def _insert_cells(self, watch_id: int, hut_ids: List[int], dates: List[Text], min_places: int) -> None:
+        self.conn.executemany(
+            "INSERT INTO watch_cells (hut_id, date, watch_id, min_places) VALUES (?, ?, ?, ?)",
+            [(hut_id, date, watch_id, min_places) for hut_id in hut_ids for date in dates],
+        )
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self.conn.close()
+
+    def add(
+        self, contact: Text, hut_ids: Iterable[int], dates: Iterable[Text], min_places: int = 1, region: Dict = None
+    ) -> Tuple[int, Text]:
+        """
+        Register a watch.
+
+        Only the hash of the returned token is stored, the token is required to read or remove the watch.
+
+        Args:
+            contact: contact of the user (e.g. email address or slack handle), passed to the notifier
+            hut_ids: watched huts (the huts of a region are resolved when the watch is registered)
+            dates: watched dates (dd.mm.yyyy)
+            min_places: minimum number of free places
+            region: search region (latitude, longitude and radius) of a region watch, for display only
+
+        Returns:
+            id and token of the new watch
+        """
+        hut_ids, dates = sorted({int(hut_id) for hut_id in hut_ids}), sorted(set(dates), key=_date_key)
+        if len(hut_ids) == 0 or len(dates) == 0:
+            raise ValueError("A watch needs at least one hut and one date")
+        last_date = _date_key(dates[-1]).isoformat()
+        token = secrets.token_urlsafe(24)
+        with self._lock:
+            cursor = self.conn.execute(
+                "INSERT INTO watches (contact, hut_ids, dates, min_places, region, last_date, created_at, token_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    contact,
+                    json.dumps(hut_ids),
+                    json.dumps(dates),
+                    int(min_places),
+                    json.dumps(region) if region is not None else None,
+                    last_date,
+                    time.time(),
+                    _hash_token(token),
+                ),
+            )
+            self._insert_cells(cursor.lastrowid, hut_ids, dates, int(min_places))
+            self.conn.commit()
+        return cursor.lastrowid, token
+
+    def remove(self, watch_id: int, token: Text) -> bool:
+        """Remove a watch, returns whether it existed and the token is the token of the watch."""
+        with self._lock:
+            row = self.conn.execute("SELECT token_hash FROM watches WHERE id = ?", (watch_id,)).fetchone()
+            if row is None or not _token_matches(token, row["token_hash"]):
+                return False
+            self.conn.execute("DELETE FROM watches WHERE id = ?", (watch_id,))
+            self.conn.execute("DELETE FROM watch_cells WHERE watch_id = ?", (watch_id,))
+            self.conn.commit()
+        return True
+
+    def get(self, watch_id: int, token: Text) -> Optional[Dict]:
+        """Watch by id, None if it does not exist or the token is not the token of the watch."""
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM watches WHERE id = ?", (watch_id,)).fetchone()
+        if row is None or not _token_matches(token, row["token_hash"]):
+            return None
+        return _row_to_watch(row)
+
+    def active(self, today: datetime.date) -> List[Dict]:
+        """All watches with at least one date from today onwards."""
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM watches WHERE last_date >= ?", (today.isoformat(),)).fetchall()
+        return [_row_to_watch(row) for row in rows]
+
+    def remove_expired(self, today: datetime.date) -> int:
+        """Remove the watches whose dates are all in the past, returns their number."""
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM watch_cells WHERE watch_id IN (SELECT id FROM watches WHERE last_date < ?)",
+                (today.isoformat(),),
+            )
+            cursor = self.conn.execute("DELETE FROM watches WHERE last_date < ?", (today.isoformat(),))
+            self.conn.commit()
+        return cursor.rowcount
+
+    def watches(self, watch_ids: Iterable[int]) -> Dict[int, Dict]:
+        """Watches by id."""
+        watch_ids = list(watch_ids)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM watches WHERE id IN ({', '.join('?' * len(watch_ids))})", watch_ids
+            ).fetchall()
+        return {row["id"]: _row_to_watch(row) for row in rows}
+
+    def match(self, changes: Iterable[Change]) -> Dict[int, List[Dict]]:
+        """
+        Match changed cells against the index of the watches.
+
+        A watch matches a cell when the places cross its minimum (from below min_places, or unknown, to at least
+        min_places).
+
+        Args:
+            changes: changed cells (hut_id, date, previous places or None, new places)
+
+        Returns:
+            matched cells (hut_id, date, places) by watch id
+        """
+        matches = defaultdict(list)
+        with self._lock:
+            self.conn.execute(CREATE_CHANGES_QUERY)
+            self.conn.execute("DELETE FROM changed_cells")
+            self.conn.executemany(
+                "INSERT INTO changed_cells VALUES (?, ?, ?, ?)",
+                (
+                    (int(hut_id), date, None if previous is None else int(previous), int(places))
+                    for hut_id, date, previous, places in changes
+                ),
+            )
+            for watch_id, hut_id, date, places in self.conn.execute(MATCH_QUERY):
+                matches[watch_id].append({"hut_id": hut_id, "date": date, "places": places})
+            self.conn.execute("DELETE FROM changed_cells")
+            self.conn.commit()
+        return dict(matches)
+
+    def mark_notified(self, watch_ids: Iterable[int]) -> None:
+        """Store the time of the last notification of watches."""
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE watches SET last_notified_at = ? WHERE id = ?", [(now, watch_id) for watch_id in watch_ids]
+            )
+            self.conn.commit()
+
+
+def to_places(value: object) -> Optional[int]:
+    """Number of places of a scraped value (None for unknown values, e.g. error messages)."""
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+def public_watch(watch: Dict) -> Dict:
+    """Watch without the fields that are only used for the notifications (e.g. the contact)."""
+    return {key: value for key, value in watch.items() if key not in PRIVATE_FIELDS}
+
+
+def _hash_token(token: Text) -> Text:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _token_matches(token: Optional[Text], token_hash: Optional[Text]) -> bool:
+    if not token or token_hash is None:
+        return False
+    return hmac.compare_digest(_hash_token(token), token_hash)
+
+
+def _date_key(date: Text) -> datetime.date:
+    return datetime.datetime.strptime(date, DATE_FORMAT_DB).date()
+
+
+def _row_to_watch(row: sqlite3.Row) -> Dict:
+    watch = dict(row)
+    del watch["token_hash"]
+    watch["hut_ids"] = json.loads(watch["hut_ids"])
+    watch["dates"] = json.loads(watch["dates"])
+    watch["region"] = json.loads(watch["region"]) if watch["region"] is not None else None
+    return watch
+
+
+class Notifier(ABC):
+    """Interface of notifiers: deliver the matches of a watch to its user."""
+
+    @abstractmethod
+    def notify(self, watch: Dict, matches: List[Dict]) -> None:
+        """
+        Send a notification.
+
+        Args:
+            watch: the matched watch (see WatchStore)
+            matches: matched cells with hut_id, date and places
+        """
+
+
+def format_message(watch: Dict, matches: List[Dict], id_to_hut: Dict = None) -> Text:
+    """Text of a notification."""
+    id_to_hut = id_to_hut or {}
+    lines = []
+    for match in matches:
+        hut_name = id_to_hut.get(match["hut_id"], f"Hut {match['hut_id']}")
+        lines.append(f"- {hut_name} on {match['date']}: {match['places']} places")
+    return f"Watch {watch['id']} ({watch['contact']}): places became available\n" + "\n".join(lines)
+
+
+class SlackNotifier(Notifier):
+    """Post notifications to a Slack channel."""
+
+    def __init__(self, client: object, channel: Text = SLACK_CHANNEL, id_to_hut: Dict = None) -> None:
+        """
+        Initialize the notifier.
+
+        Args:
+            client: slack WebClient
+            channel: channel of the notifications
+            id_to_hut: mapping from hut id to hut name for the messages
+        """
+        self.client = client
+        self.channel = channel
+        self.id_to_hut = id_to_hut
+
+    def notify(self, watch: Dict, matches: List[Dict]) -> None:
+        """Post the matches of a watch."""
+        self.client.chat_postMessage(
+            channel=self.channel, text=format_message(watch, matches, self.id_to_hut), username="PennyMe"
+        )
+
+
+class LogNotifier(Notifier):
+    """Local stand-in notifier that appends the notifications to a JSONL file."""
+
+    def __init__(self, path: Text = DEFAULT_NOTIFICATION_LOG_PATH) -> None:
+        self.path = path
+
+    def notify(self, watch: Dict, matches: List[Dict]) -> None:
+        """Append the matches of a watch to the log file."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        record = {"time": time.time(), "watch_id": watch["id"], "contact": watch["contact"], "matches": matches}
+        with open(self.path, "a") as outfile:
+            outfile.write(json.dumps(record) + "\n")
+
+
+def notify_changes(
+    changes: Iterable[Change], store: WatchStore, notifier: Notifier, today: datetime.date
+) -> Dict[int, List[Dict]]:
+    """
+    Match the changes of an update run against the active watches and notify the users (run after every update).
+
+    A failing notification is logged and does not stop the notifications of the other watches.
+
+    Args:
+        changes: changed cells (hut_id, date, previous places or None, new places)
+        store: watch store
+        notifier: notifier for the matches
+        today: current date (watches whose dates are all in the past are removed)
+
+    Returns:
+        matched cells by watch id
+    """
+    store.remove_expired(today)
+    matches = store.match(changes)
+    matched_watches = store.watches(matches)
+    notified = []
+    for watch_id, watch_matches in matches.items():
+        try:
+            notifier.notify(matched_watches[watch_id], watch_matches)
+            notified.append(watch_id)
+        except Exception as e:
+            logger.error(f"Notification of watch {watch_id} failed: {e}")
+    store.mark_notified(notified)
+    return matches